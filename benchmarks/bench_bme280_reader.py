@@ -0,0 +1,90 @@
+#!python
+"""Counts the I2C bus transactions per BME280 sample with and without the cached reader.
+
+A fake SMBus stands in for the hardware so this can run on any machine.
+"""
+
+import argparse
+import sys
+import time
+
+import bme280
+
+from weathercheck.bme280_basic import BME280Reader
+
+# Calibration words and bytes lifted from a real sensor so the compensation math is sane.
+CAL_WORDS = {
+    0x88: 28485,
+    0x8A: 26735,
+    0x8C: 50,
+    0x8E: 36738,
+    0x90: 54939,
+    0x92: 3024,
+    0x94: 8192,
+    0x96: 9,
+    0x98: 65529,
+    0x9A: 9900,
+    0x9C: 55306,
+    0x9E: 4285,
+    0xE1: 351,
+}
+CAL_BYTES = {0xA1: 75, 0xE3: 0, 0xE4: 20, 0xE5: 0, 0xE6: 3, 0xE7: 30}
+RAW_BLOCK = [0x52, 0x8A, 0x00, 0x83, 0x2B, 0x00, 0x6A, 0x3C]
+
+
+class FakeSMBus(object):
+    """Minimal SMBus replacement that counts every transaction."""
+
+    def __init__(self):
+        self.transactions = 0
+
+    def read_word_data(self, address, register):
+        self.transactions += 1
+        return CAL_WORDS.get(register, 0)
+
+    def read_byte_data(self, address, register):
+        self.transactions += 1
+        return CAL_BYTES.get(register, 0)
+
+    def write_byte_data(self, address, register, value):
+        self.transactions += 1
+
+    def read_i2c_block_data(self, address, register, length):
+        self.transactions += 1
+        return RAW_BLOCK[:length]
+
+    def close(self):
+        pass
+
+
+def uncached(bus, address, n):
+    """The old path, calibration is loaded before every sample."""
+    for _ in range(n):
+        cal = bme280.load_calibration_params(bus, address)
+        bme280.sample(bus, address, cal)
+
+
+def cached(bus, address, n):
+    """The reader path, calibration is loaded once."""
+    reader = BME280Reader(address=address, bus=bus)
+    reader.read_many(n)
+
+
+def main(nsamples):
+    address = 0x77
+    for name, func in (("per-sample calibration", uncached), ("BME280Reader", cached)):
+        bus = FakeSMBus()
+        t0 = time.perf_counter()
+        func(bus, address, nsamples)
+        dt = time.perf_counter() - t0
+        print(
+            f"{name:>24}: {bus.transactions / nsamples:6.2f} bus transactions/sample, "
+            f"{1e3 * dt / nsamples:6.2f} ms/sample"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--nsamples", type=int, default=200)
+    args = parser.parse_args()
+    sys.exit(main(args.nsamples))
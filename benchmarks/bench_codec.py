@@ -0,0 +1,78 @@
+#!python
+"""Bytes per reading and encode/decode throughput of the MQTT payload codecs.
+
+BME280 readings from the simulator are encoded one per message and in
+batches, as plain JSON (what bme280_scrape used to send), the JSON envelope,
+the schema packed binary codec and both of those compressed with zlib.
+"""
+
+import argparse
+import json
+import sys
+import time
+
+from weathercheck.mqtt_tools import (
+    BinaryCodec,
+    JSONCodec,
+    compress_payload,
+    decode_batch,
+    record_timestamps,
+)
+from weathercheck.bme280_basic import bme280_dict
+from weathercheck.simulators import SimBME280Reader
+
+TOPIC = "station/BME280reading"
+
+
+def make_records(n):
+    reader = SimBME280Reader(seed=0, step=60.0)
+    return [record_timestamps(bme280_dict(reader)) for _ in range(n)]
+
+
+def encode_batches(codec, records, batch, compression=None):
+    payloads = []
+    for i in range(0, len(records), batch):
+        items = [codec.pack(TOPIC, irec)[0] for irec in records[i : i + batch]]
+        payload = codec.encode(TOPIC, items)
+        if compression:
+            payload = compress_payload(payload, compression)
+        payloads.append(payload)
+    return payloads
+
+
+def main(nrecords, batch):
+    records = make_records(nrecords)
+    print(f"{nrecords:,} BME280 readings, batches of {batch}")
+    cases = [("plain json", None, 1, None)]
+    for size in (1, batch):
+        for codec in (JSONCodec(), BinaryCodec()):
+            for compression in (None, "zlib"):
+                if size == 1 and compression:
+                    continue
+                name = f"{codec.name}{'+' + compression if compression else ''} x{size}"
+                cases.append((name, codec, size, compression))
+
+    for name, codec, size, compression in cases:
+        t0 = time.perf_counter()
+        if codec is None:
+            payloads = [json.dumps(irec).encode() for irec in records]
+        else:
+            payloads = encode_batches(codec, records, size, compression)
+        t_enc = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        ndec = sum(len(decode_batch(ipay)) for ipay in payloads)
+        t_dec = time.perf_counter() - t0
+        assert ndec == nrecords
+        nbytes = sum(len(ipay) for ipay in payloads)
+        print(
+            f"{name:>18}: {nbytes / nrecords:7.1f} B/reading, "
+            f"encode {nrecords / t_enc / 1e3:7.1f} k/s, decode {nrecords / t_dec / 1e3:7.1f} k/s"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--nrecords", type=int, default=100_000)
+    parser.add_argument("-b", "--batch", type=int, default=50)
+    args = parser.parse_args()
+    sys.exit(main(args.nrecords, args.batch))
@@ -0,0 +1,85 @@
+#!python
+"""Decode throughput per message format.
+
+Simulated BME280 readings are encoded in each format the ingest side can
+receive and decoded with DecoderPipeline. The eval based mqtt2dict that the
+legacy format used to go through is timed for comparison.
+"""
+
+import argparse
+import json
+import sys
+import time
+
+from weathercheck import mqtt_tools
+from weathercheck.bme280_basic import bme280_dict
+from weathercheck.mqtt_tools import (
+    BinaryCodec,
+    DecoderPipeline,
+    compress_payload,
+    decode_json,
+    record_timestamps,
+)
+from weathercheck.simulators import SimBME280Reader
+
+TOPIC = "station/BME280reading"
+
+
+def old_mqtt2dict(msg):
+    """What mqtt2dict used to do with every message."""
+    index = msg.find("messages:")
+    return eval(msg[index + len("messages:") :].strip())
+
+
+def make_payloads(nrecords, batch):
+    reader = SimBME280Reader(seed=0, step=60.0)
+    records = [record_timestamps(bme280_dict(reader)) for _ in range(nrecords)]
+    binary = BinaryCodec()
+    groups = [records[i : i + batch] for i in range(0, nrecords, batch)]
+    envelopes = [
+        json.dumps({"v": 1, "n": len(igroup), "records": igroup}).encode()
+        for igroup in groups
+    ]
+    return {
+        "legacy": [("messages: " + repr(irec)).encode() for irec in records],
+        "json": [json.dumps(irec).encode() for irec in records],
+        f"json x{batch}": envelopes,
+        f"json+zlib x{batch}": [compress_payload(ienv) for ienv in envelopes],
+        "binary": [binary.encode(TOPIC, [irec]) for irec in records],
+        f"binary x{batch}": [binary.encode(TOPIC, igroup) for igroup in groups],
+    }
+
+
+def timeit(func, payloads):
+    t0 = time.perf_counter()
+    n = 0
+    for ipay in payloads:
+        n += len(func(ipay))
+    return time.perf_counter() - t0, n
+
+
+def main(nrecords, batch):
+    payloads = make_payloads(nrecords, batch)
+    pipeline = DecoderPipeline()
+    print(
+        f"{nrecords:,} BME280 readings, orjson {'on' if mqtt_tools.available(mqtt_tools.orjson) else 'off'}"
+    )
+    cases = [("legacy eval (old)", lambda p: [old_mqtt2dict(p.decode())], "legacy")]
+    cases += [(name, pipeline.decode, name) for name in payloads]
+    cases.append(("json (stdlib)", lambda p: [json.loads(p)], "json"))
+    cases.append(("json (memoryview)", lambda p: decode_json(memoryview(p)), "json"))
+    for name, func, key in cases:
+        dt, n = timeit(func, payloads[key])
+        assert n == nrecords
+        nmsgs = len(payloads[key])
+        print(
+            f"{name:>18}: {nmsgs / dt / 1e3:8.1f} k msg/s, {n / dt / 1e3:8.1f} k readings/s"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--nrecords", type=int, default=100_000)
+    parser.add_argument("-b", "--batch", type=int, default=50)
+    args = parser.parse_args()
+    sys.exit(main(args.nrecords, args.batch))
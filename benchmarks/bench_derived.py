@@ -0,0 +1,66 @@
+#!python
+"""Throughput of the vectorized derived meteorology functions.
+
+Each function is run over arrays of synthetic readings and compared with the
+old one sample at a time Python loop, which is timed on a smaller slice.
+"""
+
+import argparse
+import math
+import sys
+import time
+
+import numpy as np
+
+from weathercheck import derived
+
+
+def scalar_dewpoint(temp_c, hum):
+    """The per sample math that used to live in get_bme280_data."""
+    b = 17.62
+    c = 243.12
+    gamma = (b * temp_c / (c + temp_c)) + math.log(hum / 100.0)
+    return (c * gamma) / (b - gamma)
+
+
+def timeit(func, *args):
+    t0 = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - t0
+
+
+def main(nrows, nloop):
+    rng = np.random.default_rng(0)
+    temp_c = rng.uniform(-20.0, 40.0, nrows)
+    hum = rng.uniform(5.0, 100.0, nrows)
+    pres = rng.uniform(950.0, 1040.0, nrows)
+    wind = rng.uniform(0.0, 60.0, nrows)
+    print(f"{nrows:,} rows")
+    cases = [
+        ("celsius_to_fahrenheit", derived.celsius_to_fahrenheit, (temp_c,)),
+        ("dewpoint", derived.dewpoint, (temp_c, hum)),
+        ("vapor_pressure", derived.vapor_pressure, (temp_c, hum)),
+        ("absolute_humidity", derived.absolute_humidity, (temp_c, hum)),
+        ("heat_index", derived.heat_index, (temp_c, hum)),
+        ("humidex", derived.humidex, (temp_c, hum)),
+        ("wind_chill", derived.wind_chill, (temp_c, wind)),
+        ("sea_level_pressure", derived.sea_level_pressure, (pres, 110.0, temp_c)),
+    ]
+    for name, func, args in cases:
+        dt = timeit(func, *args)
+        print(f"{name:>22}: {dt:7.3f} s, {nrows / dt / 1e6:8.1f} M rows/s")
+
+    tl = temp_c[:nloop].tolist()
+    hl = hum[:nloop].tolist()
+    dt = timeit(lambda: [scalar_dewpoint(t, h) for t, h in zip(tl, hl)])
+    print(
+        f"{'python loop dewpoint':>22}: {nrows / nloop * dt:7.3f} s (extrapolated), {nloop / dt / 1e6:8.1f} M rows/s"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--nrows", type=int, default=10_000_000)
+    parser.add_argument("-l", "--nloop", type=int, default=200_000)
+    args = parser.parse_args()
+    sys.exit(main(args.nrows, args.nloop))
@@ -0,0 +1,114 @@
+#!python
+"""Checks the cold import of weathercheck against a time budget.
+
+Both the bare package import and the imports bin/run_scraper.py makes, read
+from the script itself, are timed. Each is done in a fresh interpreter with an
+audit hook that records any file opened under /dev and which heavy libraries
+ended up in sys.modules. The script exits with a non zero status if the
+budget is blown, a device file was opened or a heavy library was loaded.
+"""
+
+import argparse
+import ast
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+SCRAPER = Path(__file__).resolve().parent.parent / "bin" / "run_scraper.py"
+
+HEAVY = [
+    "pandas",
+    "numpy",
+    "matplotlib",
+    "adafruit_gps",
+    "serial",
+    "yaml",
+    "psutil",
+    "paho.mqtt.client",
+    "smbus2",
+    "bme280",
+    "iotdb",
+]
+
+CHILD = """
+import json, sys, time
+opened = []
+
+def hook(event, args):
+    if event == "open" and isinstance(args[0], str) and args[0].startswith("/dev/"):
+        opened.append(args[0])
+
+sys.addaudithook(hook)
+t0 = time.perf_counter()
+exec({statement!r})
+dt = time.perf_counter() - t0
+heavy = [m for m in {heavy!r} if type(sys.modules.get(m)).__name__ == "module"]
+print(json.dumps(dict(seconds=dt, devices=opened, heavy=heavy)))
+"""
+
+
+def scraper_imports(path=SCRAPER):
+    """The weathercheck imports at the top of a script, as one statement."""
+    tree = ast.parse(Path(path).read_text())
+    lines = [
+        ast.unparse(inode)
+        for inode in tree.body
+        if isinstance(inode, (ast.Import, ast.ImportFrom))
+        and "weathercheck" in ast.unparse(inode)
+    ]
+    return "\n".join(lines)
+
+
+def cold_import(python, statement="import weathercheck"):
+    """Runs an import statement in a new interpreter and returns what it saw."""
+    out = subprocess.run(
+        [python, "-c", CHILD.format(heavy=HEAVY, statement=statement)],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(out.stdout)
+
+
+def main(budget, scraper_budget, repeats, python):
+    ok = True
+    # The scraper's imports pull in asyncio, logging and ssl from the standard
+    # library, which it needs anyway, so they get a budget of their own.
+    targets = {
+        "weathercheck": ("import weathercheck", budget),
+        "run_scraper.py imports": (scraper_imports(), scraper_budget),
+    }
+    for name, (statement, limit) in targets.items():
+        times = []
+        for _ in range(repeats):
+            res = cold_import(python, statement)
+            times.append(res["seconds"])
+            if res["devices"]:
+                print(f"Device files opened on import: {res['devices']}")
+                ok = False
+            if res["heavy"]:
+                print(f"Heavy libraries loaded on import: {res['heavy']}")
+                ok = False
+        best = min(times)
+        print(f"Cold import of {name}: best {1e3 * best:.2f} ms over {repeats} runs")
+        if best > limit:
+            print(f"Over the budget of {1e3 * limit:.0f} ms")
+            ok = False
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-b", "--budget", type=float, default=0.05, help="Seconds.")
+    parser.add_argument(
+        "-s",
+        "--scraper-budget",
+        type=float,
+        default=0.15,
+        help="Seconds for the imports of bin/run_scraper.py.",
+    )
+    parser.add_argument("-r", "--repeats", type=int, default=5)
+    parser.add_argument("--python", default=sys.executable)
+    args = parser.parse_args()
+    sys.exit(main(args.budget, args.scraper_budget, args.repeats, args.python))
@@ -0,0 +1,84 @@
+#!python
+"""Throughput of the ingest service without a broker.
+
+Synthetic scraper messages are pushed through IngestService.on_message, as
+the paho network thread would, as fast as possible. The callback rate shows
+what the network thread has to spend per message, the processed rate what
+the workers sustain.
+"""
+
+import argparse
+import json
+import sys
+import time
+
+from weathercheck.bme280_basic import bme280_dict
+from weathercheck.ingest import IngestService, StatsSink
+from weathercheck.mqtt_tools import BinaryCodec, record_timestamps
+from weathercheck.simulators import SimBME280Reader
+
+
+class FakeClient(object):
+    """Stands in for the paho client, subscribing does nothing."""
+
+    on_message = None
+
+    def subscribe(self, topic, qos=0):
+        pass
+
+
+class Message(object):
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+def make_messages(n, codec, batch):
+    reader = SimBME280Reader(seed=0, step=60.0)
+    binary = BinaryCodec()
+    msgs = []
+    for i in range(n):
+        topic = f"station{i % 50}/BME280reading"
+        records = [record_timestamps(bme280_dict(reader)) for _ in range(batch)]
+        if codec == "json" and batch == 1:
+            payload = json.dumps(records[0]).encode()
+        elif codec == "json":
+            payload = json.dumps({"v": 1, "n": batch, "records": records}).encode()
+        else:
+            payload = binary.encode(topic, records)
+        msgs.append(Message(topic, payload))
+    return msgs
+
+
+def run(msgs, mode, workers):
+    service = IngestService(
+        FakeClient(), StatsSink, workers=workers, mode=mode, queue_size=len(msgs)
+    ).start()
+    t0 = time.perf_counter()
+    for imsg in msgs:
+        service.on_message(None, None, imsg)
+    t_cb = time.perf_counter() - t0
+    service.stop()
+    t_all = time.perf_counter() - t0
+    stats = service.stats()
+    assert stats["messages"] == len(msgs) and not stats["errors"], stats
+    return t_cb, t_all, stats
+
+
+def main(nmsgs, workers):
+    for codec, batch in (("json", 1), ("json", 10), ("binary", 10)):
+        msgs = make_messages(nmsgs, codec, batch)
+        for mode in ("thread", "process"):
+            t_cb, t_all, stats = run(msgs, mode, workers)
+            print(
+                f"{codec:>6} x{batch:<3} {mode:>7} x{workers}: callback {nmsgs / t_cb / 1e3:7.1f} k msg/s, "
+                f"processed {nmsgs / t_all / 1e3:6.1f} k msg/s, {stats['records'] / t_all / 1e3:7.1f} k readings/s"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--nmsgs", type=int, default=200_000)
+    parser.add_argument("-w", "--workers", type=int, default=2)
+    args = parser.parse_args()
+    sys.exit(main(args.nmsgs, args.workers))
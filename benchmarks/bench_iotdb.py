@@ -0,0 +1,121 @@
+#!python
+"""IoTDB write throughput against the size of the write buffer.
+
+Simulated BME280 readings are written through iotdb_session with a range of
+batch sizes, a batch size of 1 being one insert_aligned_record call per
+row. With --host the rows go to a real server. Otherwise a stand-in session
+serializes what would be sent and sleeps one round trip per call, so the
+numbers show the client side cost plus the given round trip time.
+"""
+
+import argparse
+import sys
+import time
+
+from iotdb.utils.IoTDBConstants import TSDataType
+
+from weathercheck.bme280_basic import BME280_COLUMNS, bme280_dict
+from weathercheck.iotdb_input import iotdb_session
+from weathercheck.mqtt_tools import record_timestamps
+from weathercheck.simulators import SimBME280Reader
+
+
+class RoundTripSession(object):
+    """Stands in for iotdb.Session.Session, one sleep of rtt per call."""
+
+    def __init__(self, rtt):
+        self.rtt = rtt
+        self.calls = 0
+
+    def set_storage_group(self, group):
+        pass
+
+    def create_aligned_time_series(self, *args):
+        pass
+
+    def insert_aligned_record(self, device, timestamp, measurements, types, values):
+        self.calls += 1
+        time.sleep(self.rtt)
+
+    def insert_aligned_tablet(self, tablet):
+        self.insert_aligned_tablets([tablet])
+
+    def insert_aligned_tablets(self, tablets):
+        for itab in tablets:
+            itab.get_binary_timestamps()
+            itab.get_binary_values()
+        self.calls += 1
+        time.sleep(self.rtt)
+
+    def close(self):
+        pass
+
+
+def make_rows(nrows):
+    reader = SimBME280Reader(seed=0, step=1.0)
+    return [record_timestamps(bme280_dict(reader)) for _ in range(nrows)]
+
+
+def run(rows, batch, args, run_index):
+    sesh = None
+    if not args.host:
+        sesh = RoundTripSession(args.rtt)
+    session = iotdb_session(
+        args.host,
+        args.port,
+        args.user,
+        args.password,
+        BME280_COLUMNS,
+        [TSDataType.DOUBLE] * len(BME280_COLUMNS),
+        f"bench{run_index}",
+        "root.weathercheck_bench",
+        None,
+        batch_size=batch,
+        max_age=1.0,
+        sesh=sesh,
+    )
+    t0 = time.perf_counter()
+    for irow in rows:
+        session.insert_data(irow)
+    session.close()
+    return time.perf_counter() - t0, session
+
+
+def main(args):
+    rows = make_rows(args.nrows)
+    where = (
+        f"{args.host}:{args.port}"
+        if args.host
+        else f"stand-in, rtt {args.rtt * 1e3:g} ms"
+    )
+    print(f"{args.nrows:,} BME280 rows, {where}")
+    for i, batch in enumerate(args.batches):
+        dt, session = run(
+            rows[: args.nrows if batch > 1 else args.nsingle], batch, args, i
+        )
+        assert session.rows_written == (args.nrows if batch > 1 else args.nsingle)
+        print(
+            f"batch {batch:>5}: {session.rows_written / dt / 1e3:8.2f} k rows/s, "
+            f"{session.rows_written} rows in {dt:.2f} s"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--nrows", type=int, default=20_000)
+    parser.add_argument(
+        "--nsingle", type=int, default=1000, help="Rows for the one row per call case."
+    )
+    parser.add_argument(
+        "-b", "--batches", type=int, nargs="+", default=[1, 10, 100, 1000, 5000]
+    )
+    parser.add_argument(
+        "--host", default="", help="IoTDB server, empty for the stand-in."
+    )
+    parser.add_argument("--port", default="6667")
+    parser.add_argument("--user", default="root")
+    parser.add_argument("--password", default="root")
+    parser.add_argument(
+        "--rtt", type=float, default=0.002, help="Round trip in s of the stand-in."
+    )
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,408 @@
+#!python
+"""IoTDB storage size and write throughput for each encoding and compressor.
+
+A month of one minute readings from a simulated station, the BME280 values
+and a reading counter, is written through iotdb_session once per choice of
+encoding and compressor, "default" being the encoding of each data type in
+DEFAULT_ENCODINGS. Every choice gets its own time series.
+
+Without --host the rows go to a stand-in that keeps the columns and, like
+the server when it flushes, cuts them into pages of --page points, encodes
+and compresses each page and counts the bytes. Its encoders follow the
+layout of IoTDB's PLAIN, TS_2DIFF, GORILLA and RLE encoders, floats are
+scaled by 10**--precision for TS_2DIFF and RLE as the server does with
+max_point_number. The sizes are estimates for comparing the choices and
+leave out the file and chunk headers. The time column is always TS_2DIFF,
+the server's default. Compressors whose Python package is not installed are
+skipped. The write rate with the stand-in is the client side cost alone.
+
+With --host the rows go to a real server. The size is the growth of its
+data directory, --data-dir, after a flush, and the storage groups are
+deleted afterwards unless --keep is given.
+"""
+
+import argparse
+import importlib
+import lzma
+import os
+import struct
+import sys
+import time
+import zlib
+
+import numpy as np
+from iotdb.utils.IoTDBConstants import Compressor, TSDataType, TSEncoding
+
+from weathercheck.bme280_basic import BME280_COLUMNS, bme280_dict
+from weathercheck.iotdb_input import (
+    SUPPORTED_ENCODINGS,
+    MeasurementSchema,
+    iotdb_session,
+)
+from weathercheck.mqtt_tools import record_timestamps
+from weathercheck.simulators import SimBME280Reader
+
+COLUMNS = BME280_COLUMNS + ["Reading count"]
+TYPES = [TSDataType.DOUBLE] * len(BME280_COLUMNS) + [TSDataType.INT64]
+
+
+def _optional(module, attr):
+    try:
+        return getattr(importlib.import_module(module), attr)
+    except ImportError:
+        return None
+
+
+def _lz4():
+    compress = _optional("lz4.block", "compress")
+    return compress and (lambda data: compress(data, store_size=False))
+
+
+def _zstd():
+    compressor = _optional("zstandard", "ZstdCompressor")
+    return compressor and compressor().compress
+
+
+COMPRESSORS = {
+    "UNCOMPRESSED": lambda: lambda data: data,
+    "SNAPPY": lambda: _optional("snappy", "compress"),
+    "LZ4": _lz4,
+    "ZSTD": _zstd,
+    "GZIP": lambda: zlib.compress,
+    "LZMA2": lambda: lambda data: lzma.compress(
+        data, format=lzma.FORMAT_RAW, filters=[{"id": lzma.FILTER_LZMA2}]
+    ),
+}
+
+
+def pack_bits(values, widths):
+    """Writes each value in its number of bits, most significant bit first."""
+    values = np.asarray(values, dtype=np.uint64)
+    widths = np.asarray(widths, dtype=np.int64)
+    if not len(values):
+        return b""
+    bits = np.unpackbits(values.astype(">u8").view(np.uint8).reshape(-1, 8), axis=1)
+    return np.packbits(bits[np.arange(64) >= 64 - widths[:, None]]).tobytes()
+
+
+def zigzag(ints):
+    ints = np.asarray(ints, dtype=np.int64)
+    return ((ints << 1) ^ (ints >> 63)).astype(np.uint64)
+
+
+def varint(value):
+    out = bytearray()
+    while value > 0x7F:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def to_ints(column, dtype, precision):
+    if dtype in (TSDataType.FLOAT, TSDataType.DOUBLE):
+        column = np.round(np.nan_to_num(column) * 10**precision)
+    return np.asarray(column, dtype=np.int64)
+
+
+def encode_plain(column, dtype):
+    if dtype in (TSDataType.TEXT, TSDataType.STRING):
+        return b"".join(varint(len(ival)) + ival.encode() for ival in column)
+    return np.asarray(column, dtype=dtype.np_dtype()).tobytes()
+
+
+def encode_ts_2diff(ints, block=128):
+    """Deltas less their minimum, bit packed in blocks, as DeltaBinaryEncoder."""
+    out = []
+    for start in range(0, len(ints), block):
+        values = ints[start : start + block]
+        deltas = np.diff(values)
+        min_delta = int(deltas.min()) if len(deltas) else 0
+        packed = (deltas - min_delta).astype(np.uint64)
+        width = int(packed.max()).bit_length() if len(packed) else 0
+        out.append(struct.pack(">iiqq", len(deltas), width, min_delta, int(values[0])))
+        out.append(pack_bits(packed, np.full(len(packed), width)))
+    return b"".join(out)
+
+
+def encode_gorilla(column, dtype):
+    """XOR against the previous value keeping the window of meaningful bits."""
+    if dtype in (TSDataType.FLOAT, TSDataType.DOUBLE):
+        bits = np.asarray(column, dtype=np.float64).view(np.uint64)
+    else:
+        bits = np.asarray(column, dtype=np.int64).view(np.uint64)
+    xors = np.empty_like(bits)
+    xors[0] = bits[0]
+    xors[1:] = bits[1:] ^ bits[:-1]
+    fields = [(int(bits[0]), 64)]
+    lead, trail = 65, 65
+    for ixor in xors[1:].tolist():
+        if ixor == 0:
+            fields.append((0, 1))
+            continue
+        ilead = 64 - ixor.bit_length()
+        itrail = (ixor & -ixor).bit_length() - 1
+        if ilead >= lead and itrail >= trail:
+            fields.append((0b10, 2))
+            fields.append((ixor >> trail, 64 - lead - trail))
+        else:
+            lead, trail = min(ilead, 63), itrail
+            nmeaningful = 64 - lead - trail
+            fields.append((0b11, 2))
+            fields.append((lead, 6))
+            fields.append((nmeaningful - 1, 6))
+            fields.append((ixor >> trail, nmeaningful))
+    values, widths = zip(*fields)
+    return pack_bits(values, widths)
+
+
+def encode_rle(ints):
+    """Runs of 8 or more as (count, value), the rest bit packed in groups of 8."""
+    values = zigzag(ints)
+    width = int(values.max()).bit_length() if len(values) else 0
+    nbytes = (width + 7) // 8
+    starts = np.flatnonzero(np.diff(values, prepend=values[:1] + 1) != 0)
+    lengths = np.diff(np.append(starts, len(values)))
+    out = [struct.pack(">i", width)]
+    literal = []
+
+    def flush_literal():
+        for i in range(0, len(literal), 8):
+            group = literal[i : i + 8]
+            out.append(varint(1 | 1 << 1))
+            out.append(pack_bits(group + [0] * (8 - len(group)), [width] * 8))
+        literal.clear()
+
+    for istart, ilen in zip(starts.tolist(), lengths.tolist()):
+        if ilen >= 8:
+            flush_literal()
+            out.append(varint(ilen << 1))
+            out.append(int(values[istart]).to_bytes(nbytes, "little"))
+        else:
+            literal.extend([int(values[istart])] * ilen)
+    flush_literal()
+    return b"".join(out)
+
+
+def encode(column, dtype, encoding, precision):
+    if encoding == TSEncoding.TS_2DIFF:
+        return encode_ts_2diff(to_ints(column, dtype, precision))
+    if encoding == TSEncoding.GORILLA:
+        return encode_gorilla(column, dtype)
+    if encoding == TSEncoding.RLE:
+        return encode_rle(to_ints(column, dtype, precision))
+    return encode_plain(column, dtype)
+
+
+class StorageSession(object):
+    """Stands in for iotdb.Session.Session, keeping the columns it is sent.
+
+    Parameters
+    ----------
+    page : int
+        Most points in a page.
+    precision : int
+        Digits kept after the point when floats are encoded as integers.
+    """
+
+    def __init__(self, page=10000, precision=2):
+        self.page = page
+        self.precision = precision
+        self.series = {}
+
+    def set_storage_group(self, group):
+        pass
+
+    def create_aligned_time_series(
+        self, device, measurements, data_types, encodings, compressors
+    ):
+        self.series[device] = {
+            "times": [],
+            "columns": {
+                iname: (itype, ienc, icomp, [])
+                for iname, itype, ienc, icomp in zip(
+                    measurements, data_types, encodings, compressors
+                )
+            },
+        }
+
+    def insert_aligned_tablet(self, tablet):
+        self.insert_aligned_tablets([tablet])
+
+    def insert_aligned_tablets(self, tablets):
+        for itab in tablets:
+            series = self.series[itab.get_insert_target_name()]
+            series["times"].append(itab.get_timestamps())
+            for iname, ivalues in zip(itab.get_measurements(), itab.get_values()):
+                series["columns"][iname][3].append(ivalues)
+
+    def close(self):
+        pass
+
+    def stored_bytes(self, device):
+        """Encodes and compresses the pages of a device, returns the total size."""
+        series = self.series[device]
+        times = np.concatenate(series["times"])
+        compress = None
+        nbytes = 0
+        for iname, (itype, ienc, icomp, ichunks) in series["columns"].items():
+            compress = COMPRESSORS[icomp.name]()
+            column = np.concatenate(ichunks)
+            for start in range(0, len(column), self.page):
+                page = column[start : start + self.page]
+                nbytes += len(compress(encode(page, itype, ienc, self.precision)))
+        for start in range(0, len(times), self.page):
+            page = times[start : start + self.page]
+            nbytes += len(compress(encode_ts_2diff(page)))
+        return nbytes
+
+
+def make_rows(ndays, period):
+    reader = SimBME280Reader(seed=0, step=period)
+    rows = []
+    for i in range(int(ndays * 86400 / period)):
+        irow = record_timestamps(bme280_dict(reader))
+        irow["Reading count"] = i
+        rows.append(irow)
+    return rows
+
+
+def choice_schema(encoding, compressor):
+    """Schema with the encoding for every measurement that can have it."""
+    encodings = None
+    if encoding != "default":
+        encodings = {
+            iname: encoding
+            for iname, itype in zip(COLUMNS, TYPES)
+            if TSEncoding[encoding] in SUPPORTED_ENCODINGS[itype]
+        }
+    return MeasurementSchema(COLUMNS, TYPES, encodings, compressor)
+
+
+def dir_size(path):
+    return sum(
+        os.path.getsize(os.path.join(iroot, iname))
+        for iroot, _, inames in os.walk(path)
+        for iname in inames
+    )
+
+
+def run(rows, schema, args, run_index):
+    group = f"root.weathercheck_enc{run_index}"
+    sesh = None
+    if not args.host:
+        sesh = StorageSession(args.page, args.precision)
+    session = iotdb_session(
+        args.host,
+        args.port,
+        args.user,
+        args.password,
+        schema.measurements,
+        schema.data_types,
+        "station",
+        group,
+        None,
+        batch_size=args.batch,
+        sesh=sesh,
+        encodings=schema.encodings,
+        compressors=schema.compressors,
+    )
+    t0 = time.perf_counter()
+    for irow in rows:
+        session.insert_data(irow)
+    session.flush()
+    dt = time.perf_counter() - t0
+    if sesh is not None:
+        nbytes = sesh.stored_bytes(session.device)
+        session.close()
+        return dt, nbytes
+    before = dir_size(args.data_dir) if args.data_dir else 0
+    session.call("execute_non_query_statement", "flush")
+    nbytes = dir_size(args.data_dir) - before if args.data_dir else None
+    if not args.keep:
+        session.call("delete_storage_group", group)
+    session.close()
+    return dt, nbytes
+
+
+def main(args):
+    rows = make_rows(args.days, args.period)
+    where = f"{args.host}:{args.port}" if args.host else "stand-in"
+    print(f"{len(rows):,} rows of {len(COLUMNS)} measurements, {where}")
+    compressors = []
+    for iname in args.compressors:
+        if args.host or COMPRESSORS[iname]() is not None:
+            compressors.append(iname)
+        else:
+            print(f"{iname} skipped, its Python package is not installed.")
+    print(
+        f"{'encoding':>9} {'compressor':>12} {'k rows/s':>9} {'bytes':>10} "
+        f"{'B/row':>7} {'ratio':>6}"
+    )
+    first = None
+    run_index = 0
+    for iencoding in args.encodings:
+        for icomp in compressors:
+            schema = choice_schema(iencoding, Compressor[icomp])
+            dt, nbytes = run(rows, schema, args, run_index)
+            run_index += 1
+            size = f"{'-':>10} {'-':>7} {'-':>6}"
+            if nbytes:
+                first = first or nbytes
+                size = (
+                    f"{nbytes:>10,} {nbytes / len(rows):>7.2f} {first / nbytes:>6.2f}"
+                )
+            print(f"{iencoding:>9} {icomp:>12} {len(rows) / dt / 1e3:>9.1f} {size}")
+    print("The ratio is the size of the first choice over the size of each.")
+    if not args.host:
+        print(
+            f"TS_2DIFF and RLE keep {args.precision} digits of the floats, "
+            "PLAIN and GORILLA all of them."
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--days", type=float, default=30.0)
+    parser.add_argument(
+        "--period", type=float, default=60.0, help="Seconds between readings."
+    )
+    parser.add_argument(
+        "-e",
+        "--encodings",
+        nargs="+",
+        default=["PLAIN", "default", "GORILLA", "TS_2DIFF", "RLE"],
+        help="TSEncoding names, default for the one of each data type.",
+    )
+    parser.add_argument(
+        "-c",
+        "--compressors",
+        nargs="+",
+        default=list(COMPRESSORS),
+        choices=list(COMPRESSORS),
+    )
+    parser.add_argument("-b", "--batch", type=int, default=1000)
+    parser.add_argument(
+        "--page", type=int, default=10000, help="Points per page of the stand-in."
+    )
+    parser.add_argument(
+        "--precision",
+        type=int,
+        default=2,
+        help="Digits kept when the stand-in encodes floats as integers.",
+    )
+    parser.add_argument(
+        "--host", default="", help="IoTDB server, empty for the stand-in."
+    )
+    parser.add_argument("--port", default="6667")
+    parser.add_argument("--user", default="root")
+    parser.add_argument("--password", default="root")
+    parser.add_argument(
+        "--data-dir", default="", help="Data directory of the server for the sizes."
+    )
+    parser.add_argument(
+        "--keep", action="store_true", help="Keep the storage groups on the server."
+    )
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,115 @@
+#!python
+"""Mapping readings to IoTDB rows for wide schemas.
+
+Times the per key work insert_data does before anything is sent: the old
+loop with a substring test and a list index per key, against
+MeasurementSchema.map with its compiled name to column dictionary. Building
+a NumpyTablet from the mapped rows is timed as well.
+"""
+
+import argparse
+import random
+import sys
+import time
+
+from iotdb.utils.IoTDBConstants import TSDataType
+
+from weathercheck.iotdb_input import MeasurementSchema, iotdb_session
+
+
+def old_map(datadict, measurements, datatypes):
+    """What insert_data used to do with every reading."""
+    meas_list = []
+    d_list = []
+    val_list = []
+    cur_ts = None
+    for ikey, iobj in datadict.items():
+        if "timestamp" in ikey:
+            cur_ts = iobj
+
+        elif ikey in measurements:
+            cur_ind = measurements.index(ikey)
+            meas_list.append(ikey)
+            d_list.append(datatypes[cur_ind])
+            val_list.append(iobj)
+    return cur_ts, meas_list, d_list, val_list
+
+
+class NullSession(object):
+    def set_storage_group(self, group):
+        pass
+
+    def create_aligned_time_series(self, *args):
+        pass
+
+    def close(self):
+        pass
+
+
+def make_readings(width, nrows):
+    rng = random.Random(0)
+    measurements = [f"measurement_{i:03d}" for i in range(width)]
+    datatypes = [TSDataType.DOUBLE] * (width - width // 5) + [TSDataType.INT64] * (
+        width // 5
+    )
+    readings = []
+    for irow in range(nrows):
+        reading = {"timestamp": 1.7e9 + irow, "station": "station01"}
+        for imeas, itype in zip(measurements, datatypes):
+            if rng.random() < 0.05:
+                continue
+            if itype == TSDataType.INT64:
+                reading[imeas] = rng.randint(0, 1000)
+            else:
+                reading[imeas] = rng.random() if rng.random() > 0.01 else float("nan")
+        readings.append(reading)
+    return measurements, datatypes, readings
+
+
+def main(nrows, widths, batch):
+    print(f"{nrows:,} readings per width")
+    for width in widths:
+        measurements, datatypes, readings = make_readings(width, nrows)
+        t0 = time.perf_counter()
+        for ireading in readings:
+            old_map(ireading, measurements, datatypes)
+        t_old = time.perf_counter() - t0
+
+        schema = MeasurementSchema(measurements, datatypes)
+        t0 = time.perf_counter()
+        rows = [schema.map(ireading) for ireading in readings]
+        t_new = time.perf_counter() - t0
+
+        session = iotdb_session(
+            None,
+            None,
+            None,
+            None,
+            measurements,
+            datatypes,
+            "d",
+            "root.b",
+            None,
+            sesh=NullSession(),
+        )
+        rows = [(int(its * 1e3), ivals) for its, ivals in rows]
+        t0 = time.perf_counter()
+        for i in range(0, nrows, batch):
+            session.make_tablet("root.b.d", rows[i : i + batch])
+        t_tab = time.perf_counter() - t0
+        print(
+            f"{width:>4} measurements: old {nrows / t_old / 1e3:7.1f} k rows/s, "
+            f"compiled {nrows / t_new / 1e3:7.1f} k rows/s "
+            f"({t_old / t_new:.1f}x), tablets of {batch} {nrows / t_tab / 1e3:7.1f} k rows/s"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--nrows", type=int, default=20_000)
+    parser.add_argument(
+        "-w", "--widths", type=int, nargs="+", default=[10, 50, 100, 200]
+    )
+    parser.add_argument("-b", "--batch", type=int, default=1000)
+    args = parser.parse_args()
+    sys.exit(main(args.nrows, args.widths, args.batch))
@@ -0,0 +1,81 @@
+#!python
+"""Throughput of the bulk NMEA log parser.
+
+A log of synthetic GGA, RMC and VTG sentences, with a few corrupted ones, is
+written to a temporary file and parsed with one and with several processes.
+For comparison the start of the log is also run through adafruit_gps one
+sentence at a time.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import adafruit_gps
+
+from weathercheck.gps_tools import parse_nmea_log
+from weathercheck.simulators import SimGPSSerial, nmea_sentence
+
+
+def make_log(path, nsentences, block=3000):
+    """Writes a log by repeating a block of simulated sentences."""
+    sim = SimGPSSerial(realtime=False)
+    lines = []
+    while len(lines) < block:
+        lines.extend(sim._synth_fix())
+        lines.append(nmea_sentence("GPVTG,54.7,T,34.4,M,005.5,N,010.2,K,A"))
+    # Corrupt one sentence in a thousand so the checksum test has work to do.
+    for i in range(0, len(lines), 1000):
+        lines[i] = lines[i][:10] + b"#" + lines[i][11:]
+    data = b"".join(lines[:block])
+    reps, extra = divmod(nsentences, block)
+    with open(path, "wb") as file:
+        for _ in range(reps):
+            file.write(data)
+        file.write(b"".join(lines[:extra]))
+
+
+def adafruit_rate(path, nsentences):
+    """Sentences per second going through adafruit_gps.GPS.update."""
+    uart = SimGPSSerial(nmea_file=path, realtime=False, loop=False)
+    gps = adafruit_gps.GPS(uart)
+    t0 = time.perf_counter()
+    for _ in range(nsentences):
+        gps.update()
+    return nsentences / (time.perf_counter() - t0)
+
+
+def main(nsentences, processes, chunk_mb):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "gps.nmea")
+        t0 = time.perf_counter()
+        make_log(path, nsentences)
+        size = os.path.getsize(path)
+        print(
+            f"Wrote {nsentences:,} sentences, {size / 2**20:.0f} MB in {time.perf_counter() - t0:.1f} s"
+        )
+        for nproc in sorted({1, processes}):
+            t0 = time.perf_counter()
+            arrays, counts = parse_nmea_log(path, chunk_mb << 20, nproc)
+            dt = time.perf_counter() - t0
+            nrows = {kind: len(arr) for kind, arr in arrays.items()}
+            print(
+                f"{nproc} process(es): {dt:6.2f} s, {counts['sentences'] / dt / 1e6:5.2f} M sentences/s, "
+                f"{size / dt / 2**20:6.0f} MB/s, rows {nrows}, bad checksums {counts['bad_checksum']}"
+            )
+        rate = adafruit_rate(path, min(nsentences, 30000))
+        print(
+            f"adafruit_gps: {rate / 1e6:5.2f} M sentences/s, "
+            f"{nsentences / rate:6.1f} s for the whole log (extrapolated)"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--nsentences", type=int, default=10_000_000)
+    parser.add_argument("-p", "--processes", type=int, default=os.cpu_count())
+    parser.add_argument("-c", "--chunk_mb", type=int, default=16)
+    args = parser.parse_args()
+    sys.exit(main(args.nsentences, args.processes, args.chunk_mb))
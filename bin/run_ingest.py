@@ -0,0 +1,226 @@
+#!python
+import argparse
+import functools
+import sys
+import time
+from pathlib import Path
+
+from weathercheck import IngestService, MQTTConnection, get_certs
+from weathercheck.ingest import INGEST_TOPICS, JSONLinesSink, StatsSink
+
+
+def parse_command_line(str_input=None):
+    """This will parse through the command line arguments
+
+    Function to go through the command line and if given a list of strings all
+    also output a namespace object.
+
+    Parameters
+    ----------
+    str_input : list
+        A list of strings or the input from the command line.
+
+    Returns
+    -------
+    input_args : Namespace
+        An object holding the input arguments wrt the variables.
+    """
+    scriptpath = Path(sys.argv[0])
+    scriptname = scriptpath.name
+
+    formatter = argparse.RawDescriptionHelpFormatter(scriptname)
+    width = formatter._width
+    title = "Runs MQTT ingest"
+    shortdesc = "Subscribes to the scraper topics and writes the readings to a sink."
+    desc = "\n".join(
+        (
+            "*" * width,
+            "*{0:^{1}}*".format(title, width - 2),
+            "*{0:^{1}}*".format("", width - 2),
+            "*{0:^{1}}*".format(shortdesc, width - 2),
+            "*" * width,
+        )
+    )
+    parser = argparse.ArgumentParser(
+        description=desc, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "-b",
+        "--broker",
+        dest="broker",
+        help="Broker address.",
+        required=True,
+        type=str,
+    )
+    parser.add_argument(
+        "-p",
+        "--port",
+        dest="port",
+        help="Port number for the broker.",
+        default=8883,
+        type=int,
+    )
+    parser.add_argument(
+        "-t",
+        "--topics",
+        dest="topics",
+        help="Comma separated topic filters to subscribe to.",
+        default=",".join(INGEST_TOPICS),
+        type=str,
+    )
+    parser.add_argument(
+        "-s",
+        "--sink",
+        dest="sink",
+        help=(
+            "Where the readings go, stats (only count them), jsonl:<path> or "
+            "iotdb:<host>[:<port>]."
+        ),
+        default="stats",
+        type=str,
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        dest="workers",
+        help="Number of workers decoding and writing.",
+        default=2,
+        type=int,
+    )
+    parser.add_argument(
+        "-m",
+        "--mode",
+        dest="mode",
+        help="Workers are threads or processes, thread or process.",
+        default="thread",
+        type=str,
+    )
+    parser.add_argument(
+        "-q",
+        "--queuesize",
+        dest="queue_size",
+        help="Most messages waiting for the workers, more are dropped.",
+        default=100000,
+        type=int,
+    )
+    parser.add_argument(
+        "-r",
+        "--report",
+        dest="report",
+        help="Seconds between printing the message counts.",
+        default=60.0,
+        type=float,
+    )
+    parser.add_argument(
+        "-c",
+        "--certfolder",
+        dest="certfolder",
+        help="Location of the certs",
+        default="",
+        type=str,
+    )
+    if str_input is None:
+        return parser.parse_args()
+    return parser.parse_args(str_input)
+
+
+def iotdb_sink(host, port, index=0):
+    """Makes a pool of IoTDB sessions as the sink of one worker."""
+    from weathercheck.iotdb_input import IoTDBPool
+
+    return IoTDBPool(host, port, batch_size=100)
+
+
+def get_sink_factory(sink):
+    """Makes the sink factory from the --sink string."""
+    if sink == "stats":
+        return StatsSink
+    if sink.startswith("jsonl:"):
+        return functools.partial(JSONLinesSink, sink[len("jsonl:") :])
+    if sink.startswith("iotdb:"):
+        host, _, port = sink[len("iotdb:") :].partition(":")
+        return functools.partial(iotdb_sink, host, port or "6667")
+    raise ValueError(
+        f"Unknown sink {sink!r}, use stats, jsonl:<path> or iotdb:<host>[:<port>]."
+    )
+
+
+def ingest_main(
+    broker,
+    port,
+    topics=",".join(INGEST_TOPICS),
+    sink="stats",
+    workers=2,
+    mode="thread",
+    queue_size=100000,
+    report=60.0,
+    certfolder="",
+):
+    """Runs the ingest service until it is killed.
+
+    Parameters
+    ----------
+    broker : str
+        Address of the broker.
+    port : int
+        Port number for the broker.
+    topics : str
+        Comma separated topic filters to subscribe to.
+    sink : str
+        Where the readings go, stats, jsonl:<path> or iotdb:<host>[:<port>].
+    workers : int
+        Number of workers decoding and writing.
+    mode : str
+        Workers are threads or processes, thread or process.
+    queue_size : int
+        Most messages waiting for the workers.
+    report : float
+        Seconds between printing the message counts.
+    certfolder : str
+        The folder holding the certs.
+    """
+    ca_certs_in, certfile_in, keyfile_in = get_certs(certfolder)
+    client = MQTTConnection(
+        broker,
+        port,
+        ca_certs_in=ca_certs_in,
+        certfile_in=certfile_in,
+        keyfile_in=keyfile_in,
+    )
+    service = IngestService(
+        client,
+        get_sink_factory(sink),
+        topics=[itopic for itopic in topics.split(",") if itopic],
+        workers=workers,
+        mode=mode,
+        queue_size=queue_size,
+    ).start()
+    client.start()
+    try:
+        last = service.stats()
+        last_time = time.monotonic()
+        while True:
+            time.sleep(report)
+            stats = service.stats()
+            now = time.monotonic()
+            rate = (stats["messages"] - last["messages"]) / (now - last_time)
+            print(f"{rate:.1f} messages/s", stats)
+            last, last_time = stats, now
+    finally:
+        client.stop()
+        service.stop()
+
+
+if __name__ == "__main__":
+    args_commd = parse_command_line()
+    arg_dict = {k: v for k, v in args_commd._get_kwargs() if v is not None}
+    import signal
+
+    # handle SIGTERM (getting killed) gracefully by calling sys.exit
+    def sigterm_handler(signal, frame):
+        print("Killed")
+        sys.stdout.flush()
+        sys.exit(128 + signal)
+
+    signal.signal(signal.SIGTERM, sigterm_handler)
+    ingest_main(**arg_dict)
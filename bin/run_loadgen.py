@@ -0,0 +1,600 @@
+#!python
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+from pathlib import Path
+
+import psutil
+
+from weathercheck import (
+    BatchPublisher,
+    bme280_scrape,
+    get_certs,
+    MQTTConnection,
+    parse_qos,
+    PublishPipeline,
+    ScrapeJob,
+    run_jobs,
+    select_backend,
+    start_system_sampler,
+    sys_scrape,
+)
+from weathercheck.backends import create_backend
+from weathercheck.mqtt_tools import LatencyHistogram
+
+
+def parse_command_line(str_input=None):
+    """This will parse through the command line arguments
+
+    Function to go through the command line and if given a list of strings all
+    also output a namespace object.
+
+    Parameters
+    ----------
+    str_input : list
+        A list of strings or the input from the command line.
+
+    Returns
+    -------
+    input_args : Namespace
+        An object holding the input arguments wrt the variables.
+    """
+    scriptpath = Path(sys.argv[0])
+    scriptname = scriptpath.name
+
+    formatter = argparse.RawDescriptionHelpFormatter(scriptname)
+    width = formatter._width
+    title = "Runs MQTT load generator"
+    shortdesc = "Publishes from a fleet of simulated stations and measures it."
+    desc = "\n".join(
+        (
+            "*" * width,
+            "*{0:^{1}}*".format(title, width - 2),
+            "*{0:^{1}}*".format("", width - 2),
+            "*{0:^{1}}*".format(shortdesc, width - 2),
+            "*" * width,
+        )
+    )
+    parser = argparse.ArgumentParser(
+        description=desc, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "-b",
+        "--broker",
+        dest="broker",
+        help="Broker address.",
+        default="localhost",
+        type=str,
+    )
+    parser.add_argument(
+        "-p",
+        "--port",
+        dest="port",
+        help="Port number for the broker.",
+        default=1883,
+        type=int,
+    )
+    parser.add_argument(
+        "-n",
+        "--stations",
+        dest="stations",
+        help="Number of virtual stations.",
+        default=10,
+        type=int,
+    )
+    parser.add_argument(
+        "-j",
+        "--processes",
+        dest="processes",
+        help="Number of processes the stations are spread over.",
+        default=1,
+        type=int,
+    )
+    parser.add_argument(
+        "-r",
+        "--rate",
+        dest="rate",
+        help="BME280 readings per second from each station.",
+        default=1.0,
+        type=float,
+    )
+    parser.add_argument(
+        "-s",
+        "--sysrate",
+        dest="sysrate",
+        help="System readings per second from each station, 0 turns them off.",
+        default=0.1,
+        type=float,
+    )
+    parser.add_argument(
+        "-d",
+        "--duration",
+        dest="duration",
+        help="Seconds to publish for.",
+        default=30.0,
+        type=float,
+    )
+    parser.add_argument(
+        "-x",
+        "--telemetry",
+        dest="telemetry",
+        help="Comma separated groups of extended host telemetry in the system "
+        "readings, see run_scraper.py.",
+        default="percore,loadavg,soc,network,diskio",
+        type=str,
+    )
+    parser.add_argument(
+        "-k",
+        "--batch",
+        dest="batch",
+        help="Readings per MQTT message, 1 publishes every reading on its own.",
+        default=1,
+        type=int,
+    )
+    parser.add_argument(
+        "-l",
+        "--batchlatency",
+        dest="batch_latency",
+        help="Longest time in seconds a reading waits in a batch.",
+        default=10.0,
+        type=float,
+    )
+    parser.add_argument(
+        "-f",
+        "--codec",
+        dest="codec",
+        help="Payload format, json or binary.",
+        default="json",
+        type=str,
+    )
+    parser.add_argument(
+        "-z",
+        "--compression",
+        dest="compression",
+        help="Compression for batches, zlib, zstd or none.",
+        default="zlib",
+        type=str,
+    )
+    parser.add_argument(
+        "-q",
+        "--qos",
+        dest="qos",
+        help="MQTT QoS, one level for all topics or per topic as "
+        "BME280reading:1,compute_status:0.",
+        default="0",
+        type=str,
+    )
+    parser.add_argument(
+        "--inflight",
+        dest="inflight",
+        help="Most QoS 1/2 messages waiting for the broker's ack, per station.",
+        default=20,
+        type=int,
+    )
+    parser.add_argument(
+        "-t",
+        "--threads",
+        dest="threads",
+        help="Threads per process doing the publishing.",
+        default=8,
+        type=int,
+    )
+    parser.add_argument(
+        "--drain",
+        dest="drain",
+        help="Longest time in seconds to wait for acks after the run.",
+        default=10.0,
+        type=float,
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        dest="output",
+        help="JSON file to write the settings and results to.",
+        default="",
+        type=str,
+    )
+    parser.add_argument(
+        "-c",
+        "--certfolder",
+        dest="certfolder",
+        help="Location of the certs",
+        default="",
+        type=str,
+    )
+    if str_input is None:
+        return parser.parse_args()
+    return parser.parse_args(str_input)
+
+
+class CountingClient(object):
+    """Passes publishes on to the connection, counting the messages and bytes.
+
+    A message is counted when paho calls on_publish for it, after it was
+    written to the socket for QoS 0 and after the broker acked it otherwise,
+    not when the connection takes it into its queue. The publish of the paho
+    client is wrapped so that messages the connection sends from its queue
+    after a reconnect are counted as well.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        # PublishPipeline hooks on_publish of the paho client it finds here.
+        self.client = connection.client
+        self.messages = 0
+        self.nbytes = 0
+        self.failed = 0
+        self._sizes = {}
+        self._early = set()
+        self._lock = threading.Lock()
+        self._paho_publish = self.client.publish
+        self.client.publish = self._publish_paho
+        self._chained = self.client.on_publish
+        self.client.on_publish = self._on_publish
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        result = self.connection.publish(topic, payload, qos, retain)
+        if result[0] != 0:
+            with self._lock:
+                self.failed += 1
+        return result
+
+    def _publish_paho(self, topic, payload=None, qos=0, retain=False, properties=None):
+        result = self._paho_publish(topic, payload, qos, retain, properties)
+        if result.rc == 0:
+            size = len(payload) if payload is not None else 0
+            with self._lock:
+                if result.mid in self._early:
+                    # on_publish came before publish returned.
+                    self._early.discard(result.mid)
+                    self.messages += 1
+                    self.nbytes += size
+                else:
+                    self._sizes[result.mid] = size
+        return result
+
+    def _on_publish(self, client, userdata, mid, reason_code, properties):
+        with self._lock:
+            size = self._sizes.pop(mid, None)
+            if size is None:
+                self._early.add(mid)
+            else:
+                self.messages += 1
+                self.nbytes += size
+        if self._chained is not None:
+            self._chained(client, userdata, mid, reason_code, properties)
+
+
+class VirtualStation(object):
+    """One simulated station with its own connection and publishing stack.
+
+    The readings are made by bme280_scrape and sys_scrape from a simulated
+    BME280 and the simulated system stats, the same way run_scraper.py does.
+
+    Parameters
+    ----------
+    index : int
+        Number of the station, seeds the simulator and names the topics.
+    broker : str
+        Address of the broker.
+    port : int
+        Port number for the broker.
+    options : dict
+        The command line settings.
+    certs : tuple
+        ca_certs, certfile and keyfile from get_certs.
+    """
+
+    def __init__(self, index, broker, port, options, certs):
+        self.name = f"loadgen{index:04d}"
+        ca_certs_in, certfile_in, keyfile_in = certs
+        self.connection = MQTTConnection(
+            broker,
+            port,
+            client_id=self.name,
+            ca_certs_in=ca_certs_in,
+            certfile_in=certfile_in,
+            keyfile_in=keyfile_in,
+        )
+        self.counter = CountingClient(self.connection)
+        client = self.counter
+        default_qos, topic_qos = parse_qos(options["qos"])
+        self.pipeline = None
+        if default_qos or any(topic_qos.values()):
+            self.pipeline = PublishPipeline(
+                client, topic_qos, default_qos, options["inflight"]
+            )
+            client = self.pipeline
+        self.batcher = None
+        if options["batch"] > 1 or options["codec"] != "json":
+            compression = options["compression"]
+            self.batcher = BatchPublisher(
+                client,
+                max_records=options["batch"],
+                max_latency=options["batch_latency"],
+                codec=options["codec"],
+                compression=None if compression == "none" else compression,
+            )
+            client = self.batcher
+        self.publisher = client
+        self.reader = create_backend("bme280", station=index)
+        self.readings = 0
+        self.failed = 0
+        # Start and end of the run, no readings are taken outside it.
+        self.window = (0.0, float("inf"))
+
+    def scrape_bme(self):
+        if self._in_window():
+            self._count(bme280_scrape(self.publisher, self.name, reader=self.reader))
+
+    def scrape_sys(self):
+        if self._in_window():
+            self._count(sys_scrape(self.publisher, self.name))
+
+    def _in_window(self):
+        # The jobs check stop_when after a run, so one more tick comes after
+        # the end, it is left out to keep the rates to the run.
+        return self.window[0] <= time.monotonic() < self.window[1]
+
+    def _count(self, result):
+        self.readings += 1
+        if not result:
+            self.failed += 1
+
+    def waiting(self):
+        """Messages not yet acked, in the pipeline or the connection queue."""
+        nwait = self.connection.queued()
+        if self.pipeline is not None:
+            nwait += self.pipeline.inflight + self.pipeline.backlog
+        return nwait
+
+
+def run_worker(indices, options, results):
+    """Runs a share of the stations in this process and puts its counts in results.
+
+    Parameters
+    ----------
+    indices : list
+        Numbers of the stations to run.
+    options : dict
+        The command line settings.
+    results : multiprocessing.Queue
+        Where the dictionary of counts goes.
+    """
+    select_backend("bme280", "sim")
+    select_backend("system", "sim")
+    telemetry = [ifield for ifield in options["telemetry"].split(",") if ifield]
+    start_system_sampler(1.0, telemetry)
+    certs = get_certs(options["certfolder"])
+    stations = [
+        VirtualStation(i, options["broker"], options["port"], options, certs)
+        for i in indices
+    ]
+    for istation in stations:
+        istation.connection.start()
+    deadline = time.monotonic() + 10.0
+    connected = sum(
+        istation.connection.wait_connected(max(0.0, deadline - time.monotonic()))
+        for istation in stations
+    )
+
+    proc = psutil.Process()
+    peak_rss = [proc.memory_info().rss]
+
+    def monitor():
+        peak_rss[0] = max(peak_rss[0], proc.memory_info().rss)
+        for istation in stations:
+            if istation.batcher is not None:
+                istation.batcher.poll()
+
+    end = float("inf")
+
+    def done():
+        return time.monotonic() >= end
+
+    nstations = options["stations"]
+    jobs = []
+    for istation, index in zip(stations, indices):
+        # Spread the stations over the period so they do not all publish at once.
+        phase = index / nstations
+        jobs.append(
+            ScrapeJob(
+                istation.name + "/bme",
+                istation.scrape_bme,
+                1.0 / options["rate"],
+                timeout=30.0,
+                offset=phase / options["rate"],
+                stop_when=done,
+            )
+        )
+        if options["sysrate"] > 0:
+            jobs.append(
+                ScrapeJob(
+                    istation.name + "/sys",
+                    istation.scrape_sys,
+                    1.0 / options["sysrate"],
+                    timeout=30.0,
+                    offset=phase / options["sysrate"],
+                    stop_when=done,
+                    essential=False,
+                )
+            )
+    jobs.append(ScrapeJob("monitor", monitor, 1.0, essential=False))
+
+    cpu0 = proc.cpu_times()
+    t0 = time.monotonic()
+    end = t0 + options["duration"]
+    for istation in stations:
+        istation.window = (t0, end)
+    asyncio.run(run_jobs(jobs, max_workers=options["threads"]))
+    elapsed = min(time.monotonic() - t0, options["duration"])
+    for istation in stations:
+        if istation.batcher is not None:
+            istation.batcher.flush()
+    drain_end = time.monotonic() + options["drain"]
+    while time.monotonic() < drain_end and any(ist.waiting() for ist in stations):
+        time.sleep(0.05)
+    cpu1 = proc.cpu_times()
+    peak_rss[0] = max(peak_rss[0], proc.memory_info().rss)
+
+    histogram = LatencyHistogram()
+    counts = {
+        "stations": len(stations),
+        "connected": connected,
+        "elapsed": elapsed,
+        "readings": 0,
+        "failed_readings": 0,
+        "messages": 0,
+        "bytes": 0,
+        "failed_publishes": 0,
+        "connection_dropped": 0,
+        "backlog_rejected": 0,
+        "failed_batches": 0,
+        "unacked": 0,
+        "skipped_ticks": sum(ijob.skipped for ijob in jobs[:-1]),
+        "max_lag": max(ijob.max_lag for ijob in jobs),
+        "cpu_seconds": (cpu1.user + cpu1.system) - (cpu0.user + cpu0.system),
+        "peak_rss": peak_rss[0],
+    }
+    for istation in stations:
+        counts["readings"] += istation.readings
+        counts["failed_readings"] += istation.failed
+        counts["messages"] += istation.counter.messages
+        counts["bytes"] += istation.counter.nbytes
+        counts["failed_publishes"] += istation.counter.failed
+        counts["connection_dropped"] += istation.connection.dropped
+        counts["unacked"] += istation.waiting()
+        if istation.pipeline is not None:
+            counts["backlog_rejected"] += istation.pipeline.rejected
+            histogram.merge(istation.pipeline.histogram)
+        if istation.batcher is not None:
+            counts["failed_batches"] += istation.batcher.failed_batches
+        istation.connection.stop(timeout=5)
+    counts["histogram"] = histogram
+    results.put(counts)
+
+
+def summarize(worker_counts, options):
+    """Adds up the counts of the workers into the rates and latencies."""
+    histogram = LatencyHistogram()
+    total = {}
+    for icounts in worker_counts:
+        histogram.merge(icounts.pop("histogram"))
+        for key, value in icounts.items():
+            if key in ("elapsed", "max_lag"):
+                total[key] = max(total.get(key, 0.0), value)
+            else:
+                total[key] = total.get(key, 0) + value
+    elapsed = total["elapsed"]
+    offered = options["stations"] * (options["rate"] + options["sysrate"])
+    summary = {
+        "offered_readings_per_s": offered,
+        "readings_per_s": (total["readings"] - total["failed_readings"]) / elapsed,
+        "messages_per_s": total["messages"] / elapsed,
+        "bytes_per_s": total["bytes"] / elapsed,
+        "bytes_per_message": total["bytes"] / max(1, total["messages"]),
+        "acked": histogram.count,
+        "ack_p50ms": 1e3 * histogram.quantile(0.5),
+        "ack_p90ms": 1e3 * histogram.quantile(0.9),
+        "ack_p99ms": 1e3 * histogram.quantile(0.99),
+        "ack_maxms": 1e3 * histogram.max,
+        "cpu_percent": 100.0 * total["cpu_seconds"] / elapsed,
+        "peak_rss_mb": total["peak_rss"] / 2**20,
+    }
+    summary.update(total)
+    return summary
+
+
+def print_summary(summary, options):
+    print(
+        f"{options['stations']} stations in {options['processes']} processes, "
+        f"{summary['connected']} connected, {summary['elapsed']:.1f} s"
+    )
+    print(
+        f"readings/s  offered {summary['offered_readings_per_s']:.1f}, "
+        f"taken {summary['readings_per_s']:.1f}"
+    )
+    print(
+        f"messages    {summary['messages']} ({summary['messages_per_s']:.1f}/s), "
+        f"{summary['bytes_per_s'] / 1e3:.1f} kB/s, "
+        f"{summary['bytes_per_message']:.0f} B/message"
+    )
+    if summary["acked"]:
+        print(
+            f"ack ms      p50 {summary['ack_p50ms']:.1f}, p90 {summary['ack_p90ms']:.1f}, "
+            f"p99 {summary['ack_p99ms']:.1f}, max {summary['ack_maxms']:.1f} "
+            f"({summary['acked']} acked)"
+        )
+    print(
+        f"drops       failed readings {summary['failed_readings']}, "
+        f"failed publishes {summary['failed_publishes']}, "
+        f"connection queue {summary['connection_dropped']}, "
+        f"backlog {summary['backlog_rejected']}, "
+        f"failed batches {summary['failed_batches']}, "
+        f"unacked {summary['unacked']}, skipped ticks {summary['skipped_ticks']}"
+    )
+    print(
+        f"client      CPU {summary['cpu_seconds']:.1f} s "
+        f"({summary['cpu_percent']:.1f} % of a core), "
+        f"peak RSS {summary['peak_rss_mb']:.1f} MB, "
+        f"max lag {1e3 * summary['max_lag']:.1f} ms"
+    )
+
+
+def loadgen_main(**options):
+    """Runs the stations over the processes and prints what they managed.
+
+    Parameters
+    ----------
+    options : dict
+        The command line settings, see parse_command_line.
+
+    Returns
+    -------
+    summary : dict
+        The totals, rates, ack latencies and CPU and memory use.
+    """
+    nproc = max(1, min(options["processes"], options["stations"]))
+    options["processes"] = nproc
+    results = multiprocessing.Queue()
+    procs = []
+    for iproc in range(nproc):
+        indices = list(range(iproc, options["stations"], nproc))
+        proc = multiprocessing.Process(
+            target=run_worker,
+            args=(indices, options, results),
+            name=f"LoadGen{iproc}",
+        )
+        proc.start()
+        procs.append(proc)
+    worker_counts = []
+    while len(worker_counts) < nproc:
+        try:
+            worker_counts.append(results.get(timeout=1.0))
+        except queue.Empty:
+            if not any(proc.is_alive() for proc in procs):
+                break
+    if len(worker_counts) < nproc:
+        print(f"{nproc - len(worker_counts)} of {nproc} processes failed.")
+        if not worker_counts:
+            raise Exception("No results from the load generator processes.")
+    for proc in procs:
+        proc.join()
+    summary = summarize(worker_counts, options)
+    print_summary(summary, options)
+    if options.get("output"):
+        with open(os.path.expanduser(options["output"]), "w") as file:
+            json.dump({"settings": options, "results": summary}, file, indent=2)
+    return summary
+
+
+if __name__ == "__main__":
+    args_commd = parse_command_line()
+    arg_dict = {k: v for k, v in args_commd._get_kwargs() if v is not None}
+    loadgen_main(**arg_dict)
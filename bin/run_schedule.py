@@ -6,16 +6,22 @@ import time
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
-import matplotlib
-import pandas as pd
 import schedule
 import yaml
 
-from weathercheck import get_bme280_data, mkdf, send_email, sys_stats
+from weathercheck import send_email
+from weathercheck.bme280_basic import BME280_COLUMNS, bme280_dict
+from weathercheck.column_buffer import ColumnBuffer
 
-matplotlib.use("Agg")
-import ipdb
-import matplotlib.pyplot as plt
+
+def get_pyplot():
+    """Imports pyplot with the Agg backend, only done once a plot is needed."""
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    return plt
 
 
 def parse_command_line(str_input=None):
@@ -109,9 +115,9 @@ def parse_command_line(str_input=None):
     return parser.parse_args(str_input)
 
 
-# GLOBAL
-DF_GLOBE, last_ts = mkdf()
-DF_EMERG = DF_GLOBE.copy()
+# GLOBAL, the buffers are filled in once run_schedule starts.
+DF_GLOBE = ColumnBuffer(BME280_COLUMNS)
+DF_EMERG = ColumnBuffer(BME280_COLUMNS)
 TIME_ZONE = "utc"
 TEMP_FLAG = False
 DROP_TIME = datetime(year=2025, month=1, day=1).astimezone(timezone.utc)
@@ -121,8 +127,9 @@ EMAIL_TIME = datetime(year=2025, month=1, day=1).astimezone(timezone.utc)
 def send_emergency_email(plotpath, emailconfig):
     global DF_EMERG, EMAIL_TIME, TIME_ZONE
     EMAIL_TIME = datetime.now().astimezone(timezone.utc)
+    plt = get_pyplot()
     fig, ax = plt.subplots(1, 1, figsize=(8, 10))
-    df_plot = DF_EMERG.copy()
+    df_plot = DF_EMERG.to_dataframe()
     df_plot.index = df_plot.index.tz_convert(TIME_ZONE)
     df_plot.plot(y="Temperature in F", ax=ax)
     ax.set_xlabel(f"Time: ({TIME_ZONE})")
@@ -139,17 +146,20 @@ def send_emergency_email(plotpath, emailconfig):
 
 def updatedf(thresh_f, plotpath, emailconfig):
     global DF_GLOBE, TEMP_FLAG, DROP_TIME, DF_EMERG, EMAIL_TIME
-    df_i, last_ts = mkdf()
-    DF_GLOBE = pd.concat([DF_GLOBE, df_i])
+    dfdict = bme280_dict()
+    last_ts = dfdict["Time"]
+    temp_f = dfdict["Temperature in F"]
+    DF_GLOBE.append_dict(dfdict)
 
-    if df_i["Temperature in F"].iloc[0] < thresh_f and not TEMP_FLAG:
+    if temp_f < thresh_f and not TEMP_FLAG:
         TEMP_FLAG = True
         DROP_TIME = last_ts
-        DF_EMERG = df_i.copy()
-    elif df_i["Temperature in F"].iloc[0] >= thresh_f and TEMP_FLAG:
+        DF_EMERG.clear()
+        DF_EMERG.append_dict(dfdict)
+    elif temp_f >= thresh_f and TEMP_FLAG:
         TEMP_FLAG = False
-    elif df_i["Temperature in F"].iloc[0] < thresh_f and TEMP_FLAG:
-        DF_EMERG = pd.concat([DF_EMERG, df_i])
+    elif temp_f < thresh_f and TEMP_FLAG:
+        DF_EMERG.append_dict(dfdict)
 
     email_check = last_ts > EMAIL_TIME + timedelta(days=1)
     emerg_time = last_ts > DROP_TIME + timedelta(hours=2)
@@ -169,8 +179,9 @@ def plot_and_save(plotpath, datapath):
 
     """
     global DF_GLOBE, TIME_ZONE
+    plt = get_pyplot()
     fig, ax = plt.subplots(1, 1, figsize=(8, 10))
-    df_plot = DF_GLOBE.copy()
+    df_plot = DF_GLOBE.to_dataframe()
     df_plot.index = df_plot.index.tz_convert(TIME_ZONE)
     df_plot.plot(y="Temperature in F", ax=ax)
     ax.set_xlabel(f"Time: ({TIME_ZONE})")
@@ -183,8 +194,9 @@ def plot_and_save(plotpath, datapath):
     plt.savefig(plotstr, dpi=300)
     plt.close(fig)
     print("Saving data to " + datastr)
-    DF_GLOBE.to_csv(datastr)
-    DF_GLOBE, last_ts = mkdf()
+    DF_GLOBE.to_dataframe().to_csv(datastr)
+    DF_GLOBE.clear()
+    DF_GLOBE.append_dict(bme280_dict())
 
 
 def run_schedule(thresh_f, revisit_time, plottod, plotdir, datadir, yamlconfig):
@@ -199,6 +211,9 @@ def run_schedule(thresh_f, revisit_time, plottod, plotdir, datadir, yamlconfig):
         configdict = yaml.safe_load(file)
     emailconfig = configdict["emergency_email"]
     TIME_ZONE = configdict.get("timezone", "utc")
+    dfdict = bme280_dict()
+    DF_GLOBE.append_dict(dfdict)
+    DF_EMERG.append_dict(dfdict)
     update_job = schedule.every(revisit_time).seconds.do(
         updatedf, thresh_f=thresh_f, plotpath=plotpath, emailconfig=emailconfig
     )
@@ -1,12 +1,24 @@
 #!python
 import argparse
+import asyncio
+import functools
 import sys
-import time
 from pathlib import Path
 
-import schedule
-
-from weathercheck import bme280_scrape, connect_mqtt, sys_scrape
+from weathercheck import (
+    BatchPublisher,
+    get_certs,
+    Spool,
+    inventory_scrape,
+    load_inventory,
+    MQTTConnection,
+    parse_qos,
+    PublishPipeline,
+    ScrapeJob,
+    run_jobs,
+    start_system_sampler,
+    sys_scrape,
+)
 
 
 def parse_command_line(str_input=None):
@@ -80,6 +92,156 @@ def parse_command_line(str_input=None):
         default=60,
         type=int,
     )
+    parser.add_argument(
+        "-m",
+        "--sysperiod",
+        dest="sysperiod",
+        help="Sampling period for the compute system info in seconds.",
+        default=5.0,
+        type=float,
+    )
+    parser.add_argument(
+        "-x",
+        "--telemetry",
+        dest="telemetry",
+        help="Comma separated groups of extended host telemetry, from "
+        "percore, loadavg, soc, network, diskio and processes. Empty turns it off.",
+        default="percore,loadavg,soc,network,diskio",
+        type=str,
+    )
+    parser.add_argument(
+        "-d",
+        "--devices",
+        dest="devices",
+        help="yaml file with the inventory of BME280 sensors, see weathercheck.devices. "
+        "Empty reads the one sensor at 0x77 on bus 1.",
+        default="",
+        type=str,
+    )
+    parser.add_argument(
+        "-n",
+        "--burst",
+        dest="burst",
+        help="Number of BME280 samples reduced into each published reading.",
+        default=1,
+        type=int,
+    )
+    parser.add_argument(
+        "-o",
+        "--oversampling",
+        dest="oversampling",
+        help="BME280 oversampling, 1, 2, 4, 8 or 16.",
+        default=1,
+        type=int,
+    )
+    parser.add_argument(
+        "-i",
+        "--iir",
+        dest="iir_filter",
+        help="BME280 IIR filter coefficient, 0 (off), 2, 4, 8 or 16.",
+        default=0,
+        type=int,
+    )
+    parser.add_argument(
+        "-t",
+        "--tickbudget",
+        dest="tick_budget",
+        help="Longest time in seconds one BME280 burst can take.",
+        default=2.0,
+        type=float,
+    )
+    parser.add_argument(
+        "-k",
+        "--batch",
+        dest="batch",
+        help="Readings per MQTT message, 1 publishes every reading on its own.",
+        default=1,
+        type=int,
+    )
+    parser.add_argument(
+        "--batchbytes",
+        dest="batch_bytes",
+        help="Most bytes of JSON readings in one batch.",
+        default=65536,
+        type=int,
+    )
+    parser.add_argument(
+        "-l",
+        "--batchlatency",
+        dest="batch_latency",
+        help="Longest time in seconds a reading waits in a batch.",
+        default=3600.0,
+        type=float,
+    )
+    parser.add_argument(
+        "-f",
+        "--codec",
+        dest="codec",
+        help="Payload format, json or binary (schema packed, see mqtt_tools).",
+        default="json",
+        type=str,
+    )
+    parser.add_argument(
+        "-z",
+        "--compression",
+        dest="compression",
+        help="Compression for batches, zlib, zstd or none.",
+        default="zlib",
+        type=str,
+    )
+    parser.add_argument(
+        "-q",
+        "--qos",
+        dest="qos",
+        help="MQTT QoS, one level for all topics or per topic as "
+        "BME280reading:1,compute_status:0.",
+        default="0",
+        type=str,
+    )
+    parser.add_argument(
+        "--inflight",
+        dest="inflight",
+        help="Most QoS 1/2 messages waiting for the broker's ack.",
+        default=20,
+        type=int,
+    )
+    parser.add_argument(
+        "-w",
+        "--spool",
+        dest="spool",
+        help="SQLite file that keeps messages while the broker can not be reached. "
+        "Empty turns it off.",
+        default="~/.weathercheck_spool.sqlite",
+        type=str,
+    )
+    parser.add_argument(
+        "--spoolmb",
+        dest="spool_mb",
+        help="Most MB kept in the spool, the oldest messages are dropped beyond it.",
+        default=64.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--spoolrate",
+        dest="spool_rate",
+        help="Messages per second sent from the spool once the broker is back.",
+        default=20.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--timeout",
+        dest="job_timeout",
+        help="Longest time in seconds one scrape can take before the others go on.",
+        default=30.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--pollperiod",
+        dest="poll_period",
+        help="Seconds between checks for late batches and spooled messages.",
+        default=5.0,
+        type=float,
+    )
     parser.add_argument(
         "-c",
         "--certfolder",
@@ -93,44 +255,71 @@ def parse_command_line(str_input=None):
     return parser.parse_args(str_input)
 
 
-BME_FAIL_COUNT = 0
 SYS_FAIL_COUNT = 0
 
 
-def get_certs(certfolder=""):
-    if not certfolder:
-        return None, None, None
-        # ca_certs_in = None
-        # certfile_in = None
-        # keyfile_in = None
-
-    cert_path = Path(certfolder)
-    cert_path.expanduser()
-    ca_certs_in = str(cert_path.join("ca.pem"))
-    certfile_in = str(cert_path.join("client.pen"))
-    keyfile_in = str(cert_path.join("client.key"))
-    return ca_certs_in, certfile_in, keyfile_in
-
-
-def bme_scrape_cont(client):
-    global BME_FAIL_COUNT
-    result = bme280_scrape(client)
-    if result:
-        BME_FAIL_COUNT = 0
-    else:
-        BME_FAIL_COUNT += 1
-
-
-def sys_scrape_cont(client):
+def sys_status(result):
     global SYS_FAIL_COUNT
-    result = sys_scrape(client)
     if result:
         SYS_FAIL_COUNT = 0
     else:
         SYS_FAIL_COUNT += 1
 
 
-def scraper_main(broker, port, enrevisit, sysrevisit, certfolder=""):
+def batch_status(inventory, topic, result, n_records):
+    """Feeds the delivery status of a batch into the failure counts."""
+    if topic.endswith("/BME280reading"):
+        device = inventory.device_for_topic(topic)
+        if device is not None:
+            device.publish_status(result)
+    else:
+        sys_status(result)
+
+
+def bme_scrape_cont(client, inventory):
+    for device, result in inventory_scrape(client, inventory):
+        # A batched reading only counts once its batch has been sent.
+        if not result or not isinstance(client, BatchPublisher):
+            device.publish_status(result)
+
+
+def sys_scrape_cont(client, pipeline=None, inventory=None):
+    extra = {}
+    if pipeline is not None:
+        extra.update(pipeline.stats())
+    if inventory is not None:
+        extra.update(inventory.stats())
+    result = sys_scrape(client, extra=extra)
+    if not result or not isinstance(client, BatchPublisher):
+        sys_status(result)
+
+
+def scraper_main(
+    broker,
+    port,
+    enrevisit,
+    sysrevisit,
+    sysperiod=5.0,
+    telemetry="percore,loadavg,soc,network,diskio",
+    devices="",
+    burst=1,
+    oversampling=1,
+    iir_filter=0,
+    tick_budget=2.0,
+    batch=1,
+    batch_bytes=65536,
+    batch_latency=3600.0,
+    codec="json",
+    compression="zlib",
+    qos="0",
+    inflight=20,
+    spool="~/.weathercheck_spool.sqlite",
+    spool_mb=64.0,
+    spool_rate=20.0,
+    job_timeout=30.0,
+    poll_period=5.0,
+    certfolder="",
+):
     """Runs the Scraper function.
 
     Parameters
@@ -143,27 +332,134 @@ def scraper_main(broker, port, enrevisit, sysrevisit, certfolder=""):
         Number of seconds for revisting the sensor.
     sysrevist : int
         Number of seconds for checking the system info.
+    sysperiod : float
+        Number of seconds between samples of the system info in the background.
+    telemetry : str
+        Comma separated groups of extended host telemetry, see HostTelemetry.
+    devices : str
+        yaml file with the inventory of BME280 sensors, empty reads the one
+        sensor at 0x77 on bus 1.
+    burst : int
+        Number of BME280 samples reduced into each published reading.
+    oversampling : int
+        BME280 oversampling, 1, 2, 4, 8 or 16.
+    iir_filter : int
+        BME280 IIR filter coefficient, 0 (off), 2, 4, 8 or 16.
+    tick_budget : float
+        Longest time in seconds one BME280 burst can take.
+    batch : int
+        Readings per MQTT message, 1 publishes every reading on its own.
+    batch_bytes : int
+        Most bytes of JSON readings in one batch.
+    batch_latency : float
+        Longest time in seconds a reading waits in a batch.
+    codec : str
+        Payload format, json or binary.
+    compression : str
+        Compression for batches, zlib, zstd or none.
+    qos : str
+        MQTT QoS, one level for all topics or per topic as
+        BME280reading:1,compute_status:0.
+    inflight : int
+        Most QoS 1/2 messages waiting for the broker's ack.
+    spool : str
+        SQLite file that keeps messages while the broker can not be reached,
+        empty turns it off. With a spool the scrapers are never cancelled.
+    spool_mb : float
+        Most MB kept in the spool.
+    spool_rate : float
+        Messages per second sent from the spool once the broker is back.
+    job_timeout : float
+        Longest time in seconds one scrape can take before the others go on.
+    poll_period : float
+        Seconds between checks for late batches and spooled messages.
     certfolder : int
         The folder holding the certs.
     """
-    global SYS_FAIL_COUNT, BME_FAIL_COUNT
-    client = connect_mqtt(broker, port)
-
-    env_job = schedule.every(enrevisit).seconds.do(bme_scrape_cont, client=client)
-    sys_job = schedule.every(sysrevisit).seconds.do(sys_scrape_cont, client=client)
-    sys_fail = False
-    env_fail = False
-
-    while True:
-        schedule.run_pending()
-        if SYS_FAIL_COUNT > 3:
-            schedule.cancel_job(sys_job)
-            sys_fail = True
-        if BME_FAIL_COUNT > 3:
-            schedule.cancel_job(env_job)
-        if sys_fail and env_fail:
-            raise Exception("Both scrapers failed.")
-        time.sleep(1)
+    ca_certs_in, certfile_in, keyfile_in = get_certs(certfolder)
+    # Connects and reconnects in the background. Readings wait in its memory
+    # queue meanwhile, or with a spool go straight to disk so a restart
+    # does not lose them.
+    connection = MQTTConnection(
+        broker,
+        port,
+        ca_certs_in=ca_certs_in,
+        certfile_in=certfile_in,
+        keyfile_in=keyfile_in,
+        queue_size=0 if spool else 1000,
+    ).start()
+    client = connection
+    default_qos, topic_qos = parse_qos(qos)
+    pipeline = None
+    if default_qos or any(topic_qos.values()):
+        # Acks are tracked in paho's callback, the jobs never wait on them.
+        pipeline = PublishPipeline(client, topic_qos, default_qos, inflight)
+        client = pipeline
+    inventory = load_inventory(
+        devices or None,
+        oversampling=oversampling,
+        iir_filter=iir_filter,
+        burst=burst,
+        time_budget=tick_budget,
+    )
+    publisher = client
+    msg_spool = None
+    if spool:
+        msg_spool = Spool(spool, max_bytes=int(spool_mb * 2**20), rate=spool_rate)
+        if len(msg_spool):
+            print(f"{len(msg_spool)} spooled messages waiting to be sent.")
+    if batch > 1 or codec != "json" or msg_spool is not None:
+        publisher = BatchPublisher(
+            client,
+            max_records=batch,
+            codec=codec,
+            max_bytes=batch_bytes,
+            max_latency=batch_latency,
+            compression=None if compression == "none" else compression,
+            on_status=functools.partial(batch_status, inventory),
+            spool=msg_spool,
+        )
+    telemetry_fields = [ifield for ifield in telemetry.split(",") if ifield]
+    start_system_sampler(sysperiod, telemetry_fields)
+
+    # Each job runs on its own fixed deadlines with the blocking work in
+    # threads. With a spool failed readings are kept, so the scrapers keep going.
+    jobs = [
+        ScrapeJob(
+            "bme280",
+            bme_scrape_cont,
+            enrevisit,
+            timeout=job_timeout,
+            stop_when=lambda: msg_spool is None and inventory.failing,
+            kwargs=dict(client=publisher, inventory=inventory),
+        ),
+        ScrapeJob(
+            "system",
+            sys_scrape_cont,
+            sysrevisit,
+            timeout=job_timeout,
+            stop_when=lambda: msg_spool is None and SYS_FAIL_COUNT > 3,
+            kwargs=dict(client=publisher, pipeline=pipeline, inventory=inventory),
+        ),
+    ]
+    if publisher is not client:
+        jobs.append(
+            ScrapeJob(
+                "publish", publisher.poll, poll_period, job_timeout, essential=False
+            )
+        )
+    try:
+        asyncio.run(run_jobs(jobs))
+    finally:
+        # Send the batches still waiting, into the spool if the broker is away.
+        if publisher is not client:
+            publisher.flush()
+        # Commit what is in the spool so it survives the restart.
+        if msg_spool is not None:
+            msg_spool.close()
+        connection.stop(timeout=5)
+        inventory.close()
+    raise Exception("Both scrapers failed.")
 
 
 if __name__ == "__main__":
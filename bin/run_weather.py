@@ -6,13 +6,18 @@ import time
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
-import matplotlib
-import pandas as pd
+from weathercheck.bme280_basic import BME280_COLUMNS, bme280_dict
+from weathercheck.column_buffer import ColumnBuffer
 
-from weathercheck import get_bme280_data, mkdf, sys_stats
 
-matplotlib.use("Agg")
-import matplotlib.pyplot as plt
+def get_pyplot():
+    """Imports pyplot with the Agg backend, only done once a plot is needed."""
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    return plt
 
 
 def parse_command_line(str_input=None):
@@ -102,6 +107,7 @@ def plot_and_save(df_in, plotpath, datapath):
         The location of the saved data.
 
     """
+    plt = get_pyplot()
     fig, ax = plt.subplots(1, 1, figsize=(8, 10))
     df_in.plot(y="Temperature in F", ax=ax)
     ax.grid(True)
@@ -138,21 +144,28 @@ def save_to_pandas(revisit_time, plot_revist, plotdir, datadir):
     datapath = Path(datadir)
     td = timedelta(seconds=revisit_time)
     plt_revist = timedelta(seconds=plot_revist)
-    df_w, last_ts = mkdf()
+    buf_w = ColumnBuffer(BME280_COLUMNS)
+    dfdict = bme280_dict()
+    buf_w.append_dict(dfdict)
+    last_ts = dfdict["Time"]
     next_read = last_ts + td
     next_plot = last_ts + plt_revist
     now = datetime.now().astimezone(timezone.utc)
 
     while True:
-        # add to the dataframe
+        # add to the buffer
         if now > next_read:
-            df_i, last_ts = mkdf()
+            dfdict = bme280_dict()
+            buf_w.append_dict(dfdict)
+            last_ts = dfdict["Time"]
             next_read = last_ts + td
-            df_w = pd.concat([df_w, df_i])
         # save out the dataframe
         if now > next_plot:
-            plot_and_save(df_w, plotpath, datapath)
-            df_w, last_ts = mkdf()
+            plot_and_save(buf_w.to_dataframe(), plotpath, datapath)
+            buf_w.clear()
+            dfdict = bme280_dict()
+            buf_w.append_dict(dfdict)
+            last_ts = dfdict["Time"]
             next_read = last_ts + td
             next_plot = last_ts + plt_revist
         time.sleep(1)
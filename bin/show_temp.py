@@ -3,12 +3,13 @@
 
 import time
 
-from weathercheck import get_bme280_data
+from weathercheck import BME280Reader
 
 if __name__ == "__main__":
+    reader = BME280Reader()
     while True:
         try:
-            temp_c, temp_f, dewpoint, dewpoint_f, hum, pres, ts = get_bme280_data()
+            temp_c, temp_f, dewpoint, dewpoint_f, hum, pres, ts = reader.read()
 
             # Print the readings
             print("Time of reading: {0}".format(ts.replace(microsecond=0)))
@@ -20,6 +21,7 @@ if __name__ == "__main__":
             time.sleep(2)
         except KeyboardInterrupt:
             print("Program stopped")
+            reader.close()
             break
         except Exception as e:
             print("An unexpected error occurred:", str(e))
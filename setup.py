@@ -28,6 +28,8 @@ scripts = [
     "bin/show_temp.py",
     "bin/run_schedule.py",
     "bin/run_scraper.py",
+    "bin/run_ingest.py",
+    "bin/run_loadgen.py",
 ]
 
 
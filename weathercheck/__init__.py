@@ -1,6 +1,67 @@
-from .bme280_basic import get_bme280_data, mkdf
-from .email_tools import send_email
-from .gps_tools import get_gps
-from .mqtt_scraper import bme280_scrape, sys_scrape
-from .mqtt_tools import connect_mqtt, publish_dict
-from .systeminfo import get_disk_use, get_system_dict, sys_stats
+"""Weather and system monitoring over MQTT.
+
+Submodules and the libraries behind them are imported on first use (PEP 562)
+so that importing the package does not touch hardware or load pandas, paho,
+psutil and the like.
+"""
+
+import importlib
+
+_LAZY_ATTRS = {
+    "load_backend_config": "backends",
+    "select_backend": "backends",
+    "BME280Reader": "bme280_basic",
+    "get_bme280_data": "bme280_basic",
+    "get_reader": "bme280_basic",
+    "mkdf": "bme280_basic",
+    "ColumnBuffer": "column_buffer",
+    "DeviceInventory": "devices",
+    "load_inventory": "devices",
+    "SensorDevice": "devices",
+    "IngestService": "ingest",
+    "send_email": "email_tools",
+    "get_gps": "gps_tools",
+    "GPSReader": "gps_tools",
+    "bme280_scrape": "mqtt_scraper",
+    "inventory_scrape": "mqtt_scraper",
+    "sys_scrape": "mqtt_scraper",
+    "BatchPublisher": "mqtt_tools",
+    "BinaryCodec": "mqtt_tools",
+    "connect_mqtt": "mqtt_tools",
+    "decode_batch": "mqtt_tools",
+    "decode_rows": "mqtt_tools",
+    "DecoderPipeline": "mqtt_tools",
+    "get_certs": "mqtt_tools",
+    "JSONCodec": "mqtt_tools",
+    "MQTTConnection": "mqtt_tools",
+    "parse_qos": "mqtt_tools",
+    "PublishPipeline": "mqtt_tools",
+    "publish_dict": "mqtt_tools",
+    "publish_record": "mqtt_tools",
+    "register_schema": "mqtt_tools",
+    "subscribe": "mqtt_tools",
+    "Spool": "spool",
+    "run_jobs": "runtime",
+    "ScrapeJob": "runtime",
+    "get_disk_use": "systeminfo",
+    "get_system_dict": "systeminfo",
+    "HostTelemetry": "systeminfo",
+    "start_system_sampler": "systeminfo",
+    "SystemSampler": "systeminfo",
+    "sys_stats": "systeminfo",
+}
+
+__all__ = list(_LAZY_ATTRS)
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRS:
+        module = importlib.import_module("." + _LAZY_ATTRS[name], __name__)
+        obj = getattr(module, name)
+        globals()[name] = obj
+        return obj
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,84 @@
+"""Deferred imports so that importing weathercheck stays cheap.
+
+Heavy or hardware specific libraries are bound at module scope with
+lazy_import and only executed the first time one of their attributes is used.
+"""
+
+import importlib.util
+import sys
+import threading
+import types
+
+
+class _LazyModule(types.ModuleType):
+    """Module whose code is executed, under its own lock, when an attribute is first used.
+
+    The module stays lazy until its code has run, other threads wait on the
+    lock and the thread executing the code reads straight through, so no
+    thread ever sees it half executed.
+    """
+
+    def __getattribute__(self, attr):
+        attrs = types.ModuleType.__getattribute__(self, "__dict__")
+        if attrs.get("__lazy_thread__") == threading.get_ident():
+            return types.ModuleType.__getattribute__(self, attr)
+        with attrs["__lazy_lock__"]:
+            if types.ModuleType.__getattribute__(self, "__class__") is _LazyModule:
+                attrs["__lazy_thread__"] = threading.get_ident()
+                try:
+                    attrs["__spec__"].loader.exec_module(self)
+                    self.__class__ = types.ModuleType
+                finally:
+                    attrs["__lazy_thread__"] = None
+        return getattr(self, attr)
+
+
+class _MissingModule(object):
+    """Stand in for a library that is not installed, fails when it is used."""
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        raise ImportError(
+            f"{self._name} is needed for this feature but it is not installed."
+        )
+
+
+def lazy_import(name):
+    """Returns a module that is only executed when first used.
+
+    Parameters
+    ----------
+    name : str
+        Full name of the module, e.g. "paho.mqtt.client".
+
+    Returns
+    -------
+    module : module
+        The lazily loaded module, or a placeholder that raises ImportError on use
+        if the module can not be found.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    try:
+        spec = importlib.util.find_spec(name)
+    except ModuleNotFoundError:
+        spec = None
+    if spec is None:
+        return _MissingModule(name)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    if type(module) is not types.ModuleType:
+        # Extension modules are made by their loader and can not wait.
+        spec.loader.exec_module(module)
+        return module
+    module.__lazy_lock__ = threading.RLock()
+    module.__lazy_thread__ = None
+    module.__class__ = _LazyModule
+    return module
+
+
+def available(module):
+    """True if a module from lazy_import is installed."""
+    return not isinstance(module, _MissingModule)
@@ -0,0 +1,192 @@
+"""Registry for the hardware backends behind the sensor and system readers.
+
+Each kind of device, "bme280", "gps" and "system", has a set of named backends.
+The "hardware" backend talks to the real device and "sim" swaps in the
+deterministic simulators from weathercheck.simulators. The backend is chosen,
+in order of precedence, by the environment variables
+WEATHERCHECK_<KIND>_BACKEND and WEATHERCHECK_BACKEND, by select_backend or by
+a yaml config file such as::
+
+    backends:
+      bme280:
+        name: sim
+        latency: 0.005
+        fault_rate: 0.01
+      gps: sim
+      system: hardware
+
+The config file can be loaded with load_backend_config or pointed to by the
+WEATHERCHECK_BACKEND_CONFIG environment variable.
+"""
+
+import importlib
+import os
+from pathlib import Path
+
+from ._lazy import lazy_import
+
+yaml = lazy_import("yaml")
+
+# Factories are stored as "module:attribute" strings so nothing is imported
+# until a backend is actually built.
+BACKENDS = {
+    "bme280": {
+        "hardware": "weathercheck.bme280_basic:BME280Reader",
+        "sim": "weathercheck.simulators:SimBME280Reader",
+    },
+    "gps": {
+        "hardware": "weathercheck.gps_tools:open_gps_serial",
+        "sim": "weathercheck.simulators:SimGPSSerial",
+    },
+    "system": {
+        "hardware": "weathercheck.systeminfo:psutil_backend",
+        "sim": "weathercheck.simulators:SimSystemStats",
+    },
+}
+DEFAULT_BACKEND = "hardware"
+
+_SELECTED = {}
+_INSTANCES = {}
+_ENV_CONFIG_LOADED = False
+
+
+def register_backend(kind, name, factory):
+    """Adds a backend to the registry.
+
+    Parameters
+    ----------
+    kind : str
+        Type of device, e.g. "bme280".
+    name : str
+        Name the backend will be selected by.
+    factory : callable or str
+        Callable that builds the backend or a "module:attribute" string pointing to it.
+    """
+    BACKENDS.setdefault(kind, {})[name] = factory
+
+
+def select_backend(kind, name, **options):
+    """Chooses the backend for a kind of device.
+
+    Parameters
+    ----------
+    kind : str
+        Type of device, e.g. "bme280".
+    name : str
+        Name of a registered backend.
+    options : dict
+        Keyword arguments that will be handed to the factory.
+    """
+    if name not in BACKENDS.get(kind, {}):
+        raise ValueError(f"Unknown {kind} backend {name!r}.")
+    _SELECTED[kind] = (name, options)
+    _INSTANCES.pop(kind, None)
+
+
+def load_backend_config(config):
+    """Selects backends from a config file or dictionary.
+
+    Parameters
+    ----------
+    config : str or dict
+        Path to a yaml file or a dictionary, either with a "backends" entry
+        that maps each kind to a name or to a dictionary with a name and options.
+    """
+    if not isinstance(config, dict):
+        with open(Path(config).expanduser(), "r") as file:
+            config = yaml.safe_load(file)
+    for kind, entry in config.get("backends", {}).items():
+        if isinstance(entry, str):
+            select_backend(kind, entry)
+        else:
+            entry = dict(entry)
+            name = entry.pop("name", DEFAULT_BACKEND)
+            select_backend(kind, name, **entry)
+
+
+def reset_backends():
+    """Clears all selections and cached instances."""
+    global _ENV_CONFIG_LOADED
+    _SELECTED.clear()
+    _INSTANCES.clear()
+    _ENV_CONFIG_LOADED = False
+
+
+def _resolve(factory):
+    if isinstance(factory, str):
+        modname, attr = factory.split(":")
+        factory = getattr(importlib.import_module(modname), attr)
+    return factory
+
+
+def get_backend(kind):
+    """Finds the backend that is currently selected for a kind of device.
+
+    Parameters
+    ----------
+    kind : str
+        Type of device, e.g. "bme280".
+
+    Returns
+    -------
+    name : str
+        Name of the backend.
+    factory : callable
+        Callable that builds the backend.
+    options : dict
+        Keyword arguments for the factory.
+    """
+    global _ENV_CONFIG_LOADED
+    if not _ENV_CONFIG_LOADED:
+        _ENV_CONFIG_LOADED = True
+        envconfig = os.environ.get("WEATHERCHECK_BACKEND_CONFIG")
+        if envconfig:
+            load_backend_config(envconfig)
+    name, options = _SELECTED.get(kind, (DEFAULT_BACKEND, {}))
+    envname = os.environ.get(
+        f"WEATHERCHECK_{kind.upper()}_BACKEND", os.environ.get("WEATHERCHECK_BACKEND")
+    )
+    if envname and envname != name:
+        name, options = envname, {}
+    if name not in BACKENDS.get(kind, {}):
+        raise ValueError(f"Unknown {kind} backend {name!r}.")
+    return name, _resolve(BACKENDS[kind][name]), dict(options)
+
+
+def create_backend(kind, **kwargs):
+    """Builds a new backend object for a kind of device.
+
+    Parameters
+    ----------
+    kind : str
+        Type of device, e.g. "bme280".
+    kwargs : dict
+        Keyword arguments for the factory, these override the configured options.
+
+    Returns
+    -------
+    : object
+        Whatever the factory returns, a reader, serial port or stats callable.
+    """
+    name, factory, options = get_backend(kind)
+    options.update(kwargs)
+    return factory(**options)
+
+
+def backend_instance(kind):
+    """Gets a shared backend object for a kind of device, creating it once.
+
+    Parameters
+    ----------
+    kind : str
+        Type of device, e.g. "system".
+
+    Returns
+    -------
+    : object
+        The shared backend object.
+    """
+    name = get_backend(kind)[0]
+    if kind not in _INSTANCES or _INSTANCES[kind][0] != name:
+        _INSTANCES[kind] = (name, create_backend(kind))
+    return _INSTANCES[kind][1]
@@ -2,38 +2,356 @@ import math
 import time
 from datetime import datetime, timezone
 
-import bme280
-import pandas as pd
-import smbus2
+from ._lazy import lazy_import
+from .backends import create_backend, get_backend
+from .derived import celsius_to_fahrenheit, dewpoint
 
-# Initialize I2C bus
-bus = smbus2.SMBus(1)
+bme280 = lazy_import("bme280")
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+smbus2 = lazy_import("smbus2")
 
+# Register codes for the oversampling and IIR filter settings, keyed by the multiplier.
+OVERSAMPLING_CODES = {1: 1, 2: 2, 4: 3, 8: 4, 16: 5}
+IIR_CODES = {0: 0, 2: 1, 4: 2, 8: 3, 16: 4}
+CONFIG_REGISTER = 0xF5
+REDUCERS = ("median", "trimmed", "mean")
 
-def celsius_to_fahrenheit(celsius):
-    """Convert degrees C to degrees F for those animals in America.
+
+def trimmed_mean(values, trim=0.2):
+    """Mean after dropping a fraction of the lowest and highest values.
 
     Parameters
     ----------
-    celsius : float
-        Input in degrees C.
+    values : array_like
+        One dimensional array of samples.
+    trim : float
+        Fraction cut from each end.
 
     Returns
     -------
     : float
-        In degrees F.
+        The trimmed mean.
+    """
+    values = np.sort(np.asarray(values, dtype=float))
+    ncut = int(trim * len(values))
+    if ncut > 0 and len(values) > 2 * ncut:
+        values = values[ncut:-ncut]
+    return float(values.mean())
+
+
+class BME280Reader(object):
+    """Reads a BME280 sensor while holding on to the bus and calibration.
+
+    The I2C bus is opened on the first read and the calibration block is
+    read from the sensor once, after that each sample is a single forced
+    measurement. For less noisy readings the sensor's oversampling and IIR
+    filter can be turned on and each reading can be made from a burst of
+    samples that are reduced to one value. The spread of the burst is kept
+    in the quality attribute.
+
+    Parameters
+    ----------
+    bus_num : int
+        Number of the I2C bus, 1 is /dev/i2c-1.
+    address : int
+        Integer address for the I2C input.
+    bus : smbus2.SMBus
+        An already opened bus object. If None the bus is opened on the first read.
+    oversampling : int
+        Oversampling of each measurement, 1, 2, 4, 8 or 16.
+    iir_filter : int
+        Coefficient of the sensor's IIR filter, 0 (off), 2, 4, 8 or 16.
+    burst : int
+        Number of samples taken for each reading.
+    reducer : str
+        How a burst is turned into one reading, "median", "trimmed" or "mean".
+    time_budget : float
+        Longest time in seconds a burst can take, samples that would go over it
+        are skipped. If None the whole burst is always taken.
     """
-    return (celsius * 9 / 5) + 32
+
+    def __init__(
+        self,
+        bus_num=1,
+        address=0x77,
+        bus=None,
+        oversampling=1,
+        iir_filter=0,
+        burst=1,
+        reducer="median",
+        time_budget=None,
+    ):
+        self.bus_num = bus_num
+        self.address = address
+        self._bus = bus
+        self._calibration = None
+        self.quality = {}
+        self.configure(oversampling, iir_filter, burst, reducer, time_budget)
+
+    def configure(
+        self,
+        oversampling=None,
+        iir_filter=None,
+        burst=None,
+        reducer=None,
+        time_budget=None,
+    ):
+        """Changes the acquisition settings, arguments left as None are not changed.
+
+        Parameters
+        ----------
+        oversampling : int
+            Oversampling of each measurement, 1, 2, 4, 8 or 16.
+        iir_filter : int
+            Coefficient of the sensor's IIR filter, 0 (off), 2, 4, 8 or 16.
+        burst : int
+            Number of samples taken for each reading.
+        reducer : str
+            How a burst is turned into one reading, "median", "trimmed" or "mean".
+        time_budget : float
+            Longest time in seconds a burst can take.
+        """
+        if oversampling is not None:
+            if oversampling not in OVERSAMPLING_CODES:
+                raise ValueError(
+                    f"Oversampling must be one of {list(OVERSAMPLING_CODES)}."
+                )
+            self.oversampling = oversampling
+        if iir_filter is not None:
+            if iir_filter not in IIR_CODES:
+                raise ValueError(f"IIR filter must be one of {list(IIR_CODES)}.")
+            self.iir_filter = iir_filter
+        if burst is not None:
+            self.burst = max(1, int(burst))
+        if reducer is not None:
+            if reducer not in REDUCERS:
+                raise ValueError(f"Reducer must be one of {REDUCERS}.")
+            self.reducer = reducer
+        if time_budget is not None:
+            self.time_budget = time_budget
+        elif not hasattr(self, "time_budget"):
+            self.time_budget = None
+        self._configured = False
+
+    @property
+    def bus(self):
+        """The SMBus object, opened on first use."""
+        if self._bus is None:
+            self._bus = smbus2.SMBus(self.bus_num)
+        return self._bus
+
+    @property
+    def calibration(self):
+        """The calibration parameters, read from the sensor on first use."""
+        if self._calibration is None:
+            self._calibration = bme280.load_calibration_params(self.bus, self.address)
+        return self._calibration
+
+    def sample(self):
+        """Takes a raw measurement from the sensor, errors are passed up to the caller.
+
+        Returns
+        -------
+        temp_c : float
+            Temperature in C.
+        hum : float
+            Humidity in percentage.
+        pres : float
+            Presure in hPa.
+        ts : datetime
+            Timestamp of measurement.
+        """
+        if not self._configured:
+            # The filter setting is only written while the sensor sleeps, which
+            # it does between forced measurements.
+            self.bus.write_byte_data(
+                self.address, CONFIG_REGISTER, IIR_CODES[self.iir_filter] << 2
+            )
+            self._configured = True
+        data = bme280.sample(
+            self.bus,
+            self.address,
+            self.calibration,
+            OVERSAMPLING_CODES[self.oversampling],
+        )
+        return data.temperature, data.humidity, data.pressure, data.timestamp
+
+    def _reduce(self, values):
+        if self.reducer == "median":
+            return float(np.median(values))
+        if self.reducer == "trimmed":
+            return trimmed_mean(values)
+        return float(np.mean(values))
+
+    def acquire(self):
+        """Takes a burst of samples within the time budget and reduces them.
+
+        A sample is only started if, going by the slowest sample so far, it
+        will finish inside the time budget. Failed samples are dropped and the
+        error is only raised if none of them worked.
+
+        Returns
+        -------
+        temp_c : float
+            Temperature in C.
+        hum : float
+            Humidity in percentage.
+        pres : float
+            Presure in hPa.
+        ts : datetime
+            Timestamp of the middle sample.
+        """
+        samples = []
+        error = None
+        t0 = time.monotonic()
+        slowest = 0.0
+        for _ in range(self.burst):
+            t_start = time.monotonic()
+            if (
+                self.time_budget is not None
+                and t_start - t0 + slowest > self.time_budget
+            ):
+                break
+            try:
+                samples.append(self.sample())
+            except Exception as e:
+                error = e
+            slowest = max(slowest, time.monotonic() - t_start)
+        if not samples:
+            raise error
+        temps, hums, press, times = zip(*samples)
+        spreads = [float(np.std(temps)), float(np.std(hums)), float(np.std(press))]
+        self.quality = dict(zip(BME280_QUALITY_COLUMNS, spreads + [len(samples)]))
+        ts = times[len(times) // 2]
+        return self._reduce(temps), self._reduce(hums), self._reduce(press), ts
+
+    def read(self):
+        """Takes a single reading from the sensor, or a reduced burst if burst is above 1.
+
+        Returns
+        -------
+        temp_c : float
+            Temperature in C.
+        temp_f : float
+            Temperature in F.
+        dewpoint : float
+            Dewpoint in degrees C.
+        dewpoint_f : float
+            Dewpoint in degrees F.
+        hum : float
+            Humidity in percentage.
+        pres : float
+            Presure in hPa.
+        ts : datetime
+            Timestamp of measurement.
+        """
+        try:
+            # Read sensor data
+            if self.burst > 1:
+                temp_c, hum, pres, ts = self.acquire()
+            else:
+                temp_c, hum, pres, ts = self.sample()
+
+            # Convert temperature to Fahrenheit
+            temp_f = celsius_to_fahrenheit(temp_c)
+            dewpoint_c = dewpoint(temp_c, hum)
+            dewpoint_f = celsius_to_fahrenheit(dewpoint_c)
+        except Exception as e:
+            print("An unexpected error occurred:", str(e))
+            temp_c = math.nan
+            temp_f = math.nan
+            dewpoint_c = math.nan
+            dewpoint_f = math.nan
+            hum = math.nan
+            pres = math.nan
+            ts = datetime.now().astimezone(timezone.utc)
+            if self.burst > 1:
+                spreads = [math.nan, math.nan, math.nan]
+                self.quality = dict(zip(BME280_QUALITY_COLUMNS, spreads + [0]))
+
+        return temp_c, temp_f, dewpoint_c, dewpoint_f, hum, pres, ts
+
+    def read_many(self, n):
+        """Takes a number of readings back to back.
+
+        Parameters
+        ----------
+        n : int
+            Number of readings.
+
+        Returns
+        -------
+        : list
+            List of tuples in the same form as the output of read.
+        """
+        return [self.read() for _ in range(n)]
+
+    def close(self):
+        """Closes the bus if it was opened."""
+        if self._bus is not None:
+            self._bus.close()
+            self._bus = None
+
+    def reset(self):
+        """Closes the bus and forgets the calibration and settings written to
+        the sensor, so all of it is done again on the next read."""
+        self.close()
+        self._calibration = None
+        self._configured = False
+
+
+_READERS = {}
+
+BME280_COLUMNS = [
+    "Temperature in C",
+    "Temperature in F",
+    "Dewpoint in C",
+    "Dewpoint in F",
+    "Humidity",
+    "Pressure",
+]
+BME280_QUALITY_COLUMNS = [
+    "Temperature spread",
+    "Humidity spread",
+    "Pressure spread",
+    "Samples",
+]
+
+
+def get_reader(bus_num=1, address=0x77):
+    """Gets the shared reader for a bus and address, creating it if needed.
+
+    The reader comes from the selected bme280 backend, see weathercheck.backends.
+
+    Parameters
+    ----------
+    bus_num : int
+        Number of the I2C bus.
+    address : int
+        Integer address for the I2C input.
+
+    Returns
+    -------
+    : BME280Reader
+        The reader for that bus and address.
+    """
+    key = (get_backend("bme280")[0], bus_num, address)
+    if key not in _READERS:
+        _READERS[key] = create_backend("bme280", bus_num=bus_num, address=address)
+    return _READERS[key]
 
 
 # BME280 sensor address (default address)
-def get_bme280_data(address=0x77):
+def get_bme280_data(address=0x77, bus_num=1):
     """Reads the info from the BME280 sensor.
 
     Parameters
     ----------
     address : int
         Integer address for the I2C input.
+    bus_num : int
+        Number of the I2C bus.
 
     Returns
     -------
@@ -52,64 +370,41 @@ def get_bme280_data(address=0x77):
     ts : datetime
         Timestamp of measurement.
     """
-    # Load calibration parameters
-    calibration_params = bme280.load_calibration_params(bus, address)
-    b = 17.62
-    c = 243.12
-
-    try:
-        # Read sensor data
-        data = bme280.sample(bus, address, calibration_params)
-
-        ts = data.timestamp
-        # Extract temperature, pressure, and humidity
-        temp_c = data.temperature
-        pres = data.pressure
-        hum = data.humidity
-
-        # Convert temperature to Fahrenheit
-        temp_f = celsius_to_fahrenheit(temp_c)
-        gamma = (b * temp_c / (c + temp_c)) + math.log(hum / 100.0)
-        dewpoint = (c * gamma) / (b - gamma)
-        dewpoint_f = celsius_to_fahrenheit(dewpoint)
-    except Exception as e:
-        print("An unexpected error occurred:", str(e))
-        temp_c = math.nan
-        temp_f = math.nan
-        dewpoint = math.nan
-        dewpoint_f = math.nan
-        hum = math.nan
-        pres = math.nan
-        ts = datetime.now().astimezone(timezone.utc)
-
-    return temp_c, temp_f, dewpoint, dewpoint_f, hum, pres, ts
-
-
-def bme280_dict():
+    return get_reader(bus_num=bus_num, address=address).read()
+
+
+def bme280_dict(reader=None):
     """Puts the b280 data into a dictionary.
 
+    Parameters
+    ----------
+    reader : BME280Reader
+        Reader for the sensor, if None the shared default reader is used.
+
     Returns
     -------
     dfdict : dict
-        Puts the data from the bme280 call to a dictionary.
+        Puts the data from the bme280 call to a dictionary. If the reader takes
+        bursts the spread of each measurement and the number of samples are included.
     """
-    colsw = [
-        "Temperature in C",
-        "Temperature in F",
-        "Dewpoint in C",
-        "Dewpoint in F",
-        "Humidity",
-        "Pressure",
-        "Time",
-    ]
-    data_init = get_bme280_data()
+    colsw = BME280_COLUMNS + ["Time"]
+    if reader is None:
+        reader = get_reader()
+    data_init = reader.read()
     dfdict = {icol: idata for icol, idata in zip(colsw, data_init)}
+    if reader.burst > 1:
+        dfdict.update(reader.quality)
     return dfdict
 
 
-def mkdf():
+def mkdf(reader=None):
     """Calls the bme280 measurment function and places the data into a single row data frame that can be concatenated.
 
+    Parameters
+    ----------
+    reader : BME280Reader
+        Reader for the sensor, if None the shared default reader is used.
+
     Returns
     -------
     df_w : pd.DataFrame
@@ -117,7 +412,7 @@ def mkdf():
     ts1 : Datetime.Datetime
         The datetime object from the measurement.
     """
-    dfdict = bme280_dict()
+    dfdict = bme280_dict(reader)
     ts1 = dfdict["Time"]
     del dfdict["Time"]
     df_w = pd.DataFrame(dfdict, index=[ts1])
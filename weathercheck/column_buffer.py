@@ -0,0 +1,120 @@
+"""Growable columnar storage for readings that are collected one at a time."""
+
+from datetime import datetime
+
+from ._lazy import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+
+class ColumnBuffer(object):
+    """Time stamped rows of float measurements kept in preallocated NumPy arrays.
+
+    Appending a row writes into the next free slot and the arrays double in
+    size when they fill up, so appends are amortized O(1) instead of copying
+    the whole data set like pd.concat does. A DataFrame is only made when it
+    is asked for and it is a view on the stored values. Rows that have been
+    written are never changed, clearing the buffer starts new arrays, so a
+    DataFrame that was handed out stays valid.
+
+    Parameters
+    ----------
+    columns : list
+        Names of the measurements.
+    capacity : int
+        Number of rows to allocate at the start.
+    """
+
+    def __init__(self, columns, capacity=1024):
+        self.columns = list(columns)
+        self._colind = {icol: i for i, icol in enumerate(self.columns)}
+        self._capacity = max(1, capacity)
+        self._n = 0
+        self._alloc(self._capacity)
+
+    def _alloc(self, capacity):
+        self._times = np.empty(capacity, dtype=np.int64)
+        self._values = np.full((capacity, len(self.columns)), np.nan)
+
+    def _grow(self):
+        times = self._times
+        values = self._values
+        self._alloc(2 * len(times))
+        self._times[: self._n] = times[: self._n]
+        self._values[: self._n] = values[: self._n]
+
+    def __len__(self):
+        return self._n
+
+    @staticmethod
+    def _to_ns(ts):
+        if isinstance(ts, datetime):
+            ts = ts.timestamp()
+        return round(ts * 1e6) * 1000
+
+    def append(self, ts, values):
+        """Adds a row.
+
+        Parameters
+        ----------
+        ts : datetime or float
+            Time of the row as a datetime or a UTC timestamp in seconds.
+        values : dict or sequence
+            Either a dictionary keyed by column name, missing columns are NaN
+            and unknown keys are ignored, or a sequence in column order.
+        """
+        if self._n == len(self._times):
+            self._grow()
+        row = self._values[self._n]
+        if isinstance(values, dict):
+            for ikey, iobj in values.items():
+                icol = self._colind.get(ikey)
+                if icol is not None:
+                    row[icol] = iobj
+        else:
+            row[:] = values
+        self._times[self._n] = self._to_ns(ts)
+        self._n += 1
+
+    def append_dict(self, datadict, time_key="Time"):
+        """Adds a row from a dictionary like the output of bme280_dict.
+
+        Parameters
+        ----------
+        datadict : dict
+            Dictionary of measurements, it is not changed.
+        time_key : str
+            Key holding the time of the row.
+        """
+        self.append(datadict[time_key], datadict)
+
+    def last(self, column):
+        """Gets the most recent value of a column, NaN if the buffer is empty."""
+        if self._n == 0:
+            return np.nan
+        return self._values[self._n - 1, self._colind[column]]
+
+    def times(self):
+        """The time stamps as a UTC DatetimeIndex."""
+        return pd.DatetimeIndex(self._times[: self._n].view("datetime64[ns]"), tz="UTC")
+
+    def to_dataframe(self):
+        """Makes a DataFrame of the rows, the values are a view and not a copy.
+
+        Returns
+        -------
+        df : pd.DataFrame
+            Data frame indexed by UTC time with one column per measurement.
+        """
+        return pd.DataFrame(
+            self._values[: self._n],
+            index=self.times(),
+            columns=self.columns,
+            copy=False,
+        )
+
+    def clear(self):
+        """Empties the buffer, earlier DataFrames keep their data."""
+        self._n = 0
+        self._alloc(self._capacity)
@@ -0,0 +1,286 @@
+"""Derived meteorological quantities.
+
+Every function works element wise with NumPy, so the inputs can be floats,
+arrays or DataFrame columns. Pandas Series come back as Series with the same
+index, arrays as arrays and scalars as floats. Temperatures are in degrees C,
+humidity in percent and pressures in hPa unless noted.
+"""
+
+from ._lazy import lazy_import
+
+np = lazy_import("numpy")
+
+# Magnus coefficients over water from Sonntag 1990, same as the BME280 code used.
+MAGNUS_B = 17.62
+MAGNUS_C = 243.12
+MAGNUS_E0 = 6.112
+
+
+def _wrap(like, result):
+    """Gives the result the same container type as the input."""
+    if hasattr(like, "index") and hasattr(like, "to_numpy"):
+        return type(like)(result, index=like.index)
+    if np.ndim(result) == 0:
+        return float(result)
+    return result
+
+
+def celsius_to_fahrenheit(celsius):
+    """Convert degrees C to degrees F for those animals in America.
+
+    Parameters
+    ----------
+    celsius : float or array_like
+        Input in degrees C.
+
+    Returns
+    -------
+    : float or array_like
+        In degrees F.
+    """
+    t = np.asarray(celsius, dtype=float)
+    return _wrap(celsius, (t * 9 / 5) + 32)
+
+
+def fahrenheit_to_celsius(fahrenheit):
+    """Convert degrees F to degrees C.
+
+    Parameters
+    ----------
+    fahrenheit : float or array_like
+        Input in degrees F.
+
+    Returns
+    -------
+    : float or array_like
+        In degrees C.
+    """
+    t = np.asarray(fahrenheit, dtype=float)
+    return _wrap(fahrenheit, (t - 32) * 5 / 9)
+
+
+def saturation_vapor_pressure(temp_c):
+    """Saturation vapor pressure over water from the Magnus formula.
+
+    Parameters
+    ----------
+    temp_c : float or array_like
+        Temperature in C.
+
+    Returns
+    -------
+    : float or array_like
+        Saturation vapor pressure in hPa.
+    """
+    t = np.asarray(temp_c, dtype=float)
+    return _wrap(temp_c, MAGNUS_E0 * np.exp(MAGNUS_B * t / (MAGNUS_C + t)))
+
+
+def vapor_pressure(temp_c, hum):
+    """Actual vapor pressure of the air.
+
+    Parameters
+    ----------
+    temp_c : float or array_like
+        Temperature in C.
+    hum : float or array_like
+        Relative humidity in percent.
+
+    Returns
+    -------
+    : float or array_like
+        Vapor pressure in hPa.
+    """
+    t = np.asarray(temp_c, dtype=float)
+    h = np.asarray(hum, dtype=float)
+    e_s = MAGNUS_E0 * np.exp(MAGNUS_B * t / (MAGNUS_C + t))
+    return _wrap(temp_c, e_s * (h / 100.0))
+
+
+def dewpoint(temp_c, hum):
+    """Dewpoint from the Magnus formula.
+
+    Parameters
+    ----------
+    temp_c : float or array_like
+        Temperature in C.
+    hum : float or array_like
+        Relative humidity in percent.
+
+    Returns
+    -------
+    : float or array_like
+        Dewpoint in C, NaN where the humidity is zero or missing.
+    """
+    t = np.asarray(temp_c, dtype=float)
+    h = np.asarray(hum, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        gamma = (MAGNUS_B * t / (MAGNUS_C + t)) + np.log(h / 100.0)
+        dew = (MAGNUS_C * gamma) / (MAGNUS_B - gamma)
+    return _wrap(temp_c, dew)
+
+
+def absolute_humidity(temp_c, hum):
+    """Mass of water vapor per volume of air.
+
+    Parameters
+    ----------
+    temp_c : float or array_like
+        Temperature in C.
+    hum : float or array_like
+        Relative humidity in percent.
+
+    Returns
+    -------
+    : float or array_like
+        Absolute humidity in g/m^3.
+    """
+    t = np.asarray(temp_c, dtype=float)
+    h = np.asarray(hum, dtype=float)
+    e = MAGNUS_E0 * np.exp(MAGNUS_B * t / (MAGNUS_C + t)) * (h / 100.0)
+    # e in Pa over the water vapor gas constant 461.5 J/(kg K), times 1000 for grams.
+    return _wrap(temp_c, 216.68 * e / (t + 273.15))
+
+
+def heat_index(temp_c, hum):
+    """NWS heat index using the Rothfusz regression with the standard adjustments.
+
+    Below about 80 F the simple Steadman form is used, as the NWS does.
+
+    Parameters
+    ----------
+    temp_c : float or array_like
+        Temperature in C.
+    hum : float or array_like
+        Relative humidity in percent.
+
+    Returns
+    -------
+    : float or array_like
+        Heat index in C.
+    """
+    t = np.asarray(temp_c, dtype=float) * 9 / 5 + 32
+    h = np.asarray(hum, dtype=float)
+    simple = 0.5 * (t + 61.0 + (t - 68.0) * 1.2 + h * 0.094)
+    full = (
+        -42.379
+        + 2.04901523 * t
+        + 10.14333127 * h
+        - 0.22475541 * t * h
+        - 6.83783e-3 * t * t
+        - 5.481717e-2 * h * h
+        + 1.22874e-3 * t * t * h
+        + 8.5282e-4 * t * h * h
+        - 1.99e-6 * t * t * h * h
+    )
+    with np.errstate(invalid="ignore"):
+        dry = (h < 13) & (t > 80) & (t < 112)
+        dry_adj = (13 - h) / 4 * np.sqrt(np.clip(17 - np.abs(t - 95.0), 0, None) / 17)
+        wet = (h > 85) & (t > 80) & (t < 87)
+        wet_adj = (h - 85) / 10 * (87 - t) / 5
+        full = full - np.where(dry, dry_adj, 0.0) + np.where(wet, wet_adj, 0.0)
+        hi_f = np.where((simple + t) / 2 >= 80.0, full, simple)
+    return _wrap(temp_c, (hi_f - 32) * 5 / 9)
+
+
+def humidex(temp_c, hum):
+    """Canadian humidex, the warm weather counterpart of the wind chill.
+
+    Parameters
+    ----------
+    temp_c : float or array_like
+        Temperature in C.
+    hum : float or array_like
+        Relative humidity in percent.
+
+    Returns
+    -------
+    : float or array_like
+        Humidex in C.
+    """
+    t = np.asarray(temp_c, dtype=float)
+    h = np.asarray(hum, dtype=float)
+    e = MAGNUS_E0 * np.exp(MAGNUS_B * t / (MAGNUS_C + t)) * (h / 100.0)
+    return _wrap(temp_c, t + 0.5555 * (e - 10.0))
+
+
+def wind_chill(temp_c, wind_kmh):
+    """Wind chill index used by the NWS and Environment Canada.
+
+    Only defined at or below 10 C and above 4.8 km/h, elsewhere the air temperature is returned.
+
+    Parameters
+    ----------
+    temp_c : float or array_like
+        Temperature in C.
+    wind_kmh : float or array_like
+        Wind speed at 10 m in km/h.
+
+    Returns
+    -------
+    : float or array_like
+        Wind chill in C.
+    """
+    t = np.asarray(temp_c, dtype=float)
+    v = np.asarray(wind_kmh, dtype=float)
+    with np.errstate(invalid="ignore"):
+        v16 = np.power(v, 0.16)
+        wc = 13.12 + 0.6215 * t - 11.37 * v16 + 0.3965 * t * v16
+        wc = np.where((t <= 10.0) & (v > 4.8), wc, t)
+    return _wrap(temp_c, wc)
+
+
+def sea_level_pressure(pres, altitude_m, temp_c):
+    """Reduces station pressure to sea level with the hypsometric formula.
+
+    Parameters
+    ----------
+    pres : float or array_like
+        Station pressure in hPa.
+    altitude_m : float or array_like
+        Station altitude in meters.
+    temp_c : float or array_like
+        Temperature at the station in C.
+
+    Returns
+    -------
+    : float or array_like
+        Sea level pressure in hPa.
+    """
+    p = np.asarray(pres, dtype=float)
+    z = np.asarray(altitude_m, dtype=float)
+    t = np.asarray(temp_c, dtype=float)
+    lapse = 0.0065 * z
+    return _wrap(pres, p * np.power(1.0 - lapse / (t + lapse + 273.15), -5.257))
+
+
+def add_derived(df, altitude_m=None):
+    """Fills in the derived columns of a data frame of BME280 readings.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Needs the "Temperature in C" and "Humidity" columns, and "Pressure" if altitude_m is given.
+    altitude_m : float
+        Station altitude in meters, if given a "Sea level pressure" column is added.
+
+    Returns
+    -------
+    df : pd.DataFrame
+        The same data frame with the derived columns added or overwritten.
+    """
+    temp_c = df["Temperature in C"]
+    hum = df["Humidity"]
+    dew = dewpoint(temp_c, hum)
+    df["Temperature in F"] = celsius_to_fahrenheit(temp_c)
+    df["Dewpoint in C"] = dew
+    df["Dewpoint in F"] = celsius_to_fahrenheit(dew)
+    df["Heat index in C"] = heat_index(temp_c, hum)
+    df["Humidex"] = humidex(temp_c, hum)
+    df["Absolute humidity"] = absolute_humidity(temp_c, hum)
+    df["Vapor pressure"] = vapor_pressure(temp_c, hum)
+    if altitude_m is not None:
+        df["Sea level pressure"] = sea_level_pressure(
+            df["Pressure"], altitude_m, temp_c
+        )
+    return df
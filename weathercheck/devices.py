@@ -0,0 +1,291 @@
+"""Inventory of the BME280 sensors on a station.
+
+A station can have several sensors, e.g. two BME280s at 0x76 and 0x77 on each
+of a few I2C buses. They are listed in a yaml config, which can be the same
+file as the backend config::
+
+    devices:
+      - name: inside
+        bus: 1
+        address: 0x77
+      - name: outside
+        bus: 1
+        address: 0x76
+        burst: 4
+      - name: mast
+        bus: 3
+        address: 0x77
+
+Each device gets its own reader from the selected bme280 backend. Devices on
+different buses are read in parallel, one thread per bus, while the devices on
+one bus take turns under that bus's lock. Every device keeps its own counts of
+failed reads and publishes and publishes to its own topic,
+<station>/<name>/BME280reading.
+"""
+
+import concurrent.futures
+import math
+import threading
+import time
+from pathlib import Path
+
+from ._lazy import lazy_import
+from .bme280_basic import bme280_dict, get_reader
+
+yaml = lazy_import("yaml")
+
+_BUS_LOCKS = {}
+_BUS_LOCKS_LOCK = threading.Lock()
+
+
+def bus_lock(bus_num):
+    """Gets the lock shared by everything that talks on an I2C bus.
+
+    Parameters
+    ----------
+    bus_num : int
+        Number of the I2C bus.
+
+    Returns
+    -------
+    : threading.Lock
+        The lock for that bus.
+    """
+    with _BUS_LOCKS_LOCK:
+        if bus_num not in _BUS_LOCKS:
+            _BUS_LOCKS[bus_num] = threading.Lock()
+        return _BUS_LOCKS[bus_num]
+
+
+class SensorDevice(object):
+    """One sensor on a bus along with its health.
+
+    Parameters
+    ----------
+    name : str
+        Name of the device, used in its topic. If None the device publishes
+        to the plain <station>/BME280reading topic.
+    bus_num : int
+        Number of the I2C bus.
+    address : int
+        Integer address for the I2C input.
+    reader : BME280Reader
+        Reader for the sensor, if None the shared reader for the bus and
+        address is used.
+    max_failures : int
+        Failed reads in a row before the device is marked as failed and its
+        bus is reopened.
+    reader_options : dict
+        Acquisition settings handed to the reader's configure.
+    """
+
+    def __init__(
+        self,
+        name,
+        bus_num=1,
+        address=0x77,
+        reader=None,
+        max_failures=3,
+        **reader_options,
+    ):
+        self.name = name
+        self.bus_num = bus_num
+        self.address = address
+        self.reader = reader
+        if self.reader is None:
+            self.reader = get_reader(bus_num=bus_num, address=address)
+        if reader_options:
+            self.reader.configure(**reader_options)
+        self.max_failures = max_failures
+        self.reads = 0
+        self.read_errors = 0
+        self.consecutive_errors = 0
+        self.publish_failures = 0
+        self.last_ok = None
+        self.last_duration = None
+
+    def __repr__(self):
+        return f"SensorDevice({self.name!r}, bus {self.bus_num}, address {self.address:#04x})"
+
+    @property
+    def state(self):
+        """ "ok", or "failed" after max_failures failed reads in a row."""
+        return "failed" if self.consecutive_errors >= self.max_failures else "ok"
+
+    def topic(self, sys_name, topic_suf="BME280reading"):
+        """Topic the device publishes to."""
+        if self.name is None:
+            return sys_name + "/" + topic_suf
+        return sys_name + "/" + self.name + "/" + topic_suf
+
+    def read(self):
+        """Takes a reading while holding the bus, see bme280_dict.
+
+        A reading with a NaN temperature counts as a failed read.
+        """
+        t0 = time.monotonic()
+        with bus_lock(self.bus_num):
+            dfdict = bme280_dict(self.reader)
+            failed = math.isnan(dfdict["Temperature in C"])
+            if failed and self.consecutive_errors + 1 == self.max_failures:
+                # Start again from a fresh bus and calibration next time.
+                self.reader.reset()
+        self.last_duration = time.monotonic() - t0
+        self.reads += 1
+        if failed:
+            self.read_errors += 1
+            self.consecutive_errors += 1
+            if self.consecutive_errors == self.max_failures:
+                print(f"{self!r} failed {self.max_failures} reads in a row.")
+        else:
+            if self.state == "failed":
+                print(f"{self!r} is back.")
+            self.consecutive_errors = 0
+            self.last_ok = dfdict["Time"]
+        return dfdict
+
+    def publish_status(self, result):
+        """Keeps count of the publishes that failed in a row."""
+        if result:
+            self.publish_failures = 0
+        else:
+            self.publish_failures += 1
+
+    def health(self):
+        """Dictionary of the device's state and counts."""
+        return {
+            "bus": self.bus_num,
+            "address": self.address,
+            "state": self.state,
+            "reads": self.reads,
+            "read_errors": self.read_errors,
+            "consecutive_errors": self.consecutive_errors,
+            "publish_failures": self.publish_failures,
+            "last_ok": self.last_ok,
+            "last_duration": self.last_duration,
+        }
+
+
+class DeviceInventory(object):
+    """The sensors of a station, read with one thread per bus.
+
+    Parameters
+    ----------
+    devices : list
+        List of SensorDevice objects, names have to be unique.
+    """
+
+    def __init__(self, devices):
+        self.devices = list(devices)
+        names = [idev.name for idev in self.devices]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Device names have to be unique, got {names}.")
+        self._buses = {}
+        for idev in self.devices:
+            self._buses.setdefault(idev.bus_num, []).append(idev)
+        self._executor = None
+
+    def __len__(self):
+        return len(self.devices)
+
+    def __iter__(self):
+        return iter(self.devices)
+
+    @staticmethod
+    def _read_bus(devices):
+        return [(idev, idev.read()) for idev in devices]
+
+    def read_all(self):
+        """Reads every device, the buses in parallel.
+
+        Returns
+        -------
+        readings : list
+            List of (SensorDevice, dict) pairs, in the order of the devices.
+        """
+        if len(self._buses) == 1:
+            readings = self._read_bus(self.devices)
+        else:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=len(self._buses), thread_name_prefix="i2c"
+                )
+            futures = [
+                self._executor.submit(self._read_bus, idevs)
+                for idevs in self._buses.values()
+            ]
+            readings = [ipair for ifut in futures for ipair in ifut.result()]
+        order = {id(idev): i for i, idev in enumerate(self.devices)}
+        readings.sort(key=lambda ipair: order[id(ipair[0])])
+        return readings
+
+    def device_for_topic(self, topic):
+        """Finds the device that publishes to a topic, None if there is none."""
+        parts = topic.split("/")
+        name = parts[-2] if len(parts) > 2 else None
+        for idev in self.devices:
+            if idev.name == name:
+                return idev
+        return None
+
+    @property
+    def failing(self):
+        """True if every device has had more than max_failures failed publishes in a row."""
+        return all(idev.publish_failures > idev.max_failures for idev in self.devices)
+
+    def health(self):
+        """Dictionary of the health of each device keyed by its name."""
+        return {idev.name: idev.health() for idev in self.devices}
+
+    def stats(self):
+        """Failed reads in a row per device, to publish with the system stats."""
+        return {
+            f"{idev.name or 'bme280'} read errors": idev.consecutive_errors
+            for idev in self.devices
+        }
+
+    def close(self):
+        """Stops the bus threads and closes the readers."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        for idev in self.devices:
+            idev.reader.close()
+
+
+def load_inventory(config=None, **reader_options):
+    """Makes the inventory from a config file or dictionary.
+
+    Parameters
+    ----------
+    config : str or dict
+        Path to a yaml file or a dictionary with a "devices" list, each entry
+        with a name, bus, address and optionally max_failures and the reader
+        settings oversampling, iir_filter, burst, reducer and time_budget.
+        Addresses can be integers or strings like "0x76". If None or there is
+        no "devices" entry the inventory is the one sensor at 0x77 on bus 1,
+        publishing to the plain BME280reading topic.
+    reader_options : dict
+        Reader settings for all devices, the ones in the config take precedence.
+
+    Returns
+    -------
+    : DeviceInventory
+        The inventory.
+    """
+    if config is not None and not isinstance(config, dict):
+        with open(Path(config).expanduser(), "r") as file:
+            config = yaml.safe_load(file) or {}
+    entries = (config or {}).get("devices") or [{"name": None}]
+    devices = []
+    for entry in entries:
+        entry = dict(entry)
+        options = dict(reader_options)
+        options.update(entry)
+        name = options.pop("name", None)
+        bus_num = int(options.pop("bus", 1))
+        address = options.pop("address", 0x77)
+        if isinstance(address, str):
+            address = int(address, 0)
+        devices.append(SensorDevice(name, bus_num, address, **options))
+    return DeviceInventory(devices)
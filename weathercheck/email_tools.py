@@ -1,7 +1,9 @@
 import smtplib
 from email.message import EmailMessage
 
-import filetype
+from ._lazy import lazy_import
+
+filetype = lazy_import("filetype")
 
 
 def send_email(username, passkey, subject_text, messagetxt, receiverlist, files):
@@ -4,15 +4,74 @@
 # Simple GPS module demonstration.
 # Will wait for a fix and print a message every second with the current location
 # and other details.
+import io
+import os
+import threading
 import time
+from collections import namedtuple
+from datetime import UTC, datetime
 from pathlib import Path
-import adafruit_gps
-import serial
-import yaml
 
+from ._lazy import lazy_import
+from .backends import create_backend
 
-def get_gps(configfile="~/keys/serialports.yaml"):
-    """This gets the GPS object and starts it running.
+adafruit_gps = lazy_import("adafruit_gps")
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+serial = lazy_import("serial")
+yaml = lazy_import("yaml")
+
+
+def nmea_checksum(body):
+    """Computes the NMEA checksum of a sentence body.
+
+    Parameters
+    ----------
+    body : bytes
+        The sentence between the leading $ and the *, e.g. b"GPGGA,...".
+
+    Returns
+    -------
+    checksum : int
+        XOR of all of the bytes.
+    """
+    checksum = 0
+    for char in body:
+        checksum ^= char
+    return checksum
+
+
+# Order of the sentence switches in the PMTK314 command, the rest are reserved.
+PMTK314_SENTENCES = ("GLL", "RMC", "VTG", "GGA", "GSA", "GSV")
+
+
+def pmtk314_command(sentences=("GGA", "RMC"), every=1):
+    """Builds the PMTK314 command that picks which NMEA sentences the receiver sends.
+
+    Parameters
+    ----------
+    sentences : list
+        Sentence types to turn on, from GLL, RMC, VTG, GGA, GSA and GSV.
+    every : int
+        Send the sentences once every this many fixes.
+
+    Returns
+    -------
+    : bytes
+        The command without the $ or checksum, ready for send_command.
+    """
+    unknown = set(sentences) - set(PMTK314_SENTENCES)
+    if unknown:
+        raise ValueError(f"Unknown NMEA sentences {sorted(unknown)}.")
+    switches = [
+        str(every) if isent in sentences else "0" for isent in PMTK314_SENTENCES
+    ]
+    switches += ["0"] * 13
+    return ("PMTK314," + ",".join(switches)).encode("ascii")
+
+
+def open_gps_serial(configfile="~/keys/serialports.yaml"):
+    """Opens the serial port of the GPS receiver, this is the hardware gps backend.
 
     Parameters
     ----------
@@ -21,8 +80,8 @@ def get_gps(configfile="~/keys/serialports.yaml"):
 
     Returns
     -------
-    gps : adafruit_obj
-        This is the gps object that you can grab data from.
+    uart : serial.Serial
+        The open serial port.
     """
     # Create a serial connection for the GPS connection using default speed and
     # a slightly higher timeout (GPS modules typically update once a second).
@@ -38,6 +97,33 @@ def get_gps(configfile="~/keys/serialports.yaml"):
     with open(configfile, "r") as file:
         serialconfig = yaml.safe_load(file)
     uart = serial.Serial(serialconfig["gps"], baudrate=9600, timeout=10)
+    return uart
+
+
+def get_gps(
+    configfile="~/keys/serialports.yaml", update_ms=1000, sentences=("GGA", "RMC")
+):
+    """This gets the GPS object and starts it running.
+
+    The serial port comes from the selected gps backend, see weathercheck.backends.
+
+    Parameters
+    ----------
+    configfile : str
+        This is a file that has the name of the serial objects that are needed to run programs including the gps receiver.
+    update_ms : int
+        Time between fixes in milliseconds, sent as PMTK220. Don't go much below
+        500 or data is lost while parsing, and raise the UART timeout above 1000.
+    sentences : list
+        NMEA sentences the receiver sends, see pmtk314_command. GGA and RMC are
+        what you typically want, add VTG for speed in km/h.
+
+    Returns
+    -------
+    gps : adafruit_obj
+        This is the gps object that you can grab data from.
+    """
+    uart = create_backend("gps", configfile=configfile)
     # Create a GPS module instance.
     gps = adafruit_gps.GPS(uart, debug=False)  # Use UART/pyserial
     # gps = adafruit_gps.GPS_GtopI2C(i2c, debug=False)  # Use I2C interface
@@ -48,90 +134,403 @@ def get_gps(configfile="~/keys/serialports.yaml"):
     # the GPS module behavior:
     #   https://cdn-shop.adafruit.com/datasheets/PMTK_A11.pdf
 
-    # Turn on the basic GGA and RMC info (what you typically want)
-    gps.send_command(b"PMTK314,0,1,0,1,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0")
-    # Turn on the basic GGA and RMC info + VTG for speed in km/h
-    # gps.send_command(b"PMTK314,0,1,1,1,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0")
-    # Turn on just minimum info (RMC only, location):
-    # gps.send_command(b'PMTK314,0,1,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0')
-    # Turn off everything:
-    # gps.send_command(b'PMTK314,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0')
-    # Turn on everything (not all of it is parsed!)
-    # gps.send_command(b'PMTK314,1,1,1,1,1,1,0,0,0,0,0,0,0,0,0,0,0,0,0')
-
-    # Set update rate to once a second (1hz) which is what you typically want.
-    gps.send_command(b"PMTK220,1000")
-    # Or decrease to once every two seconds by doubling the millisecond value.
-    # Be sure to also increase your UART timeout above!
-    # gps.send_command(b'PMTK220,2000')
-    # You can also speed up the rate, but don't go too fast or else you can lose
-    # data during parsing.  This would be twice a second (2hz, 500ms delay):
-    # gps.send_command(b'PMTK220,500')
+    gps.send_command(pmtk314_command(sentences))
+    gps.send_command(f"PMTK220,{int(update_ms)}".encode("ascii"))
     return gps
 
 
-# Create a serial connection for the GPS connection using default speed and
-# a slightly higher timeout (GPS modules typically update once a second).
-# These are the defaults you should use for the GPS FeatherWing.
-# Connect UART rx to GPS module TX, and UART tx to GPS module RX.
-# tx = board.TX  # Use board.GP4 or other UART TX on Raspberry Pi Pico boards.
-# rx = board.RX  # Use board.GP5 or other UART RX on Raspberry Pi Pico boards.
-# uart = busio.UART(tx, rx, baudrate=9600, timeout=10)
-# for a computer, use the pyserial library for uart access
+GPSFix = namedtuple(
+    "GPSFix",
+    [
+        "time",
+        "latitude",
+        "longitude",
+        "altitude_m",
+        "hdop",
+        "satellites",
+        "fix_quality",
+        "has_fix",
+        "received",
+    ],
+)
+GPSFix.__doc__ = """Snapshot of the latest GPS fix.
+
+time is the UTC datetime of the fix, received is the time.monotonic() when it
+was parsed. Values the receiver has not reported are None.
+"""
+NO_FIX = GPSFix(None, None, None, None, None, None, 0, False, None)
+
+
+class GPSReader(object):
+    """Owns the GPS serial port and parses sentences continuously in a daemon thread.
+
+    Any job can read the latest fix without blocking, the snapshot is an
+    immutable GPSFix that is swapped in whole on every update.
+
+    Parameters
+    ----------
+    configfile : str
+        File with the names of the serial ports, see get_gps.
+    update_ms : int
+        Time between fixes in milliseconds.
+    sentences : list
+        NMEA sentences the receiver sends.
+    gps : adafruit_gps.GPS
+        An already set up GPS object. If None get_gps is called when the reader starts.
+    """
+
+    def __init__(
+        self,
+        configfile="~/keys/serialports.yaml",
+        update_ms=1000,
+        sentences=("GGA", "RMC"),
+        gps=None,
+    ):
+        self.configfile = configfile
+        self.update_ms = update_ms
+        self.sentences = tuple(sentences)
+        self.gps = gps
+        self.latest = NO_FIX
+        self.updates = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _snapshot(self):
+        gps = self.gps
+        fix_time = None
+        tutc = gps.timestamp_utc
+        if tutc is not None and tutc.tm_year > 0:
+            fix_time = datetime(*tutc[:6], tzinfo=UTC)
+        return GPSFix(
+            fix_time,
+            gps.latitude,
+            gps.longitude,
+            gps.altitude_m,
+            gps.horizontal_dilution,
+            gps.satellites,
+            gps.fix_quality or 0,
+            gps.has_fix,
+            time.monotonic(),
+        )
+
+    def _run(self):
+        # Poll a few times per fix period, each update parses at most one sentence.
+        idle = min(0.05, self.update_ms / 4000.0)
+        while not self._stop.is_set():
+            try:
+                if self.gps.update():
+                    self.updates += 1
+                    self.latest = self._snapshot()
+                    continue
+            except Exception as e:
+                print("An unexpected error occurred:", str(e))
+            self._stop.wait(idle)
+
+    def start(self):
+        """Opens the GPS if needed and starts the thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return self
+        if self.gps is None:
+            self.gps = get_gps(self.configfile, self.update_ms, self.sentences)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="GPSReader", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops the thread and closes the serial port."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self.gps is not None:
+            self.gps._uart.close()
+            self.gps = None
+
+
+# Bulk parsing of NMEA logs. Framing and checksums are done with NumPy over
+# whole chunks of the file and the fields of each sentence type are handed to
+# the pandas C parser in one go, nothing is looped over per sentence in Python.
+NMEA_DTYPES = {
+    "GGA": [
+        ("time", "f8"),
+        ("latitude", "f8"),
+        ("longitude", "f8"),
+        ("fix_quality", "i1"),
+        ("satellites", "i2"),
+        ("hdop", "f4"),
+        ("altitude_m", "f4"),
+        ("geoid_m", "f4"),
+    ],
+    "RMC": [
+        ("timestamp", "f8"),
+        ("valid", "?"),
+        ("latitude", "f8"),
+        ("longitude", "f8"),
+        ("speed_knots", "f4"),
+        ("track_deg", "f4"),
+    ],
+    "VTG": [
+        ("track_deg", "f4"),
+        ("track_mag_deg", "f4"),
+        ("speed_knots", "f4"),
+        ("speed_kmh", "f4"),
+    ],
+}
+# Columns kept from each sentence body, counted after the sentence id.
+_NMEA_COLUMNS = {
+    "GGA": [0, 1, 2, 3, 4, 5, 6, 7, 8, 10],
+    "RMC": [0, 1, 2, 3, 4, 5, 6, 7, 8],
+    "VTG": [0, 2, 4, 6],
+}
+
+
+def _hex_table():
+    table = np.full(256, -1, dtype=np.int16)
+    for i, char in enumerate(b"0123456789ABCDEF"):
+        table[char] = i
+    for i, char in enumerate(b"abcdef"):
+        table[char] = 10 + i
+    return table
+
+
+def _nmea_degrees(value, hemi, negative):
+    """ddmm.mmmm and a hemisphere letter to signed decimal degrees."""
+    deg = np.floor(value / 100.0)
+    out = deg + (value - 100.0 * deg) / 60.0
+    return np.where(hemi == negative, -out, out)
+
+
+def _seconds_of_day(hhmmss):
+    hours = np.floor(hhmmss / 10000.0)
+    minutes = np.floor(hhmmss / 100.0) - 100.0 * hours
+    return 3600.0 * hours + 60.0 * minutes + (hhmmss - 100.0 * np.floor(hhmmss / 100.0))
+
+
+def _fields(body, kind):
+    """Runs the comma separated bodies of one sentence type through pandas."""
+    cols = _NMEA_COLUMNS[kind]
+    df = pd.read_csv(
+        io.BytesIO(body),
+        header=None,
+        names=list(range(max(cols) + 1)),
+        index_col=False,
+        usecols=cols,
+        dtype={icol: "float64" for icol in cols} | _NMEA_TEXT_COLUMNS[kind],
+        engine="c",
+        on_bad_lines="skip",
+        skip_blank_lines=True,
+    )
+    return df
+
+
+_NMEA_TEXT_COLUMNS = {
+    "GGA": {2: "str", 4: "str"},
+    "RMC": {1: "str", 3: "str", 5: "str"},
+    "VTG": {},
+}
+
+
+def _to_structured(df, kind):
+    out = np.empty(len(df), dtype=NMEA_DTYPES[kind])
+    if kind == "GGA":
+        out["time"] = _seconds_of_day(df[0].to_numpy())
+        out["latitude"] = _nmea_degrees(df[1].to_numpy(), df[2].to_numpy(), "S")
+        out["longitude"] = _nmea_degrees(df[3].to_numpy(), df[4].to_numpy(), "W")
+        out["fix_quality"] = np.nan_to_num(df[5].to_numpy(), nan=0)
+        out["satellites"] = np.nan_to_num(df[6].to_numpy(), nan=0)
+        out["hdop"] = df[7].to_numpy()
+        out["altitude_m"] = df[8].to_numpy()
+        out["geoid_m"] = df[10].to_numpy()
+    elif kind == "RMC":
+        date = np.nan_to_num(df[8].to_numpy(), nan=0).astype(np.int64)
+        yy = date % 100
+        year = np.where(yy >= 80, 1900 + yy, 2000 + yy)
+        months = (year - 1970) * 12 + (date // 100) % 100 - 1
+        days = months.astype("datetime64[M]").astype("datetime64[D]").astype(np.int64)
+        days += date // 10000 - 1
+        stamp = 86400.0 * days + _seconds_of_day(df[0].to_numpy())
+        out["timestamp"] = np.where(date > 0, stamp, np.nan)
+        out["valid"] = df[1].to_numpy() == "A"
+        out["latitude"] = _nmea_degrees(df[2].to_numpy(), df[3].to_numpy(), "S")
+        out["longitude"] = _nmea_degrees(df[4].to_numpy(), df[5].to_numpy(), "W")
+        out["speed_knots"] = df[6].to_numpy()
+        out["track_deg"] = df[7].to_numpy()
+    else:
+        out["track_deg"] = df[0].to_numpy()
+        out["track_mag_deg"] = df[2].to_numpy()
+        out["speed_knots"] = df[4].to_numpy()
+        out["speed_kmh"] = df[6].to_numpy()
+    return out
+
+
+def parse_nmea_buffer(chunk):
+    """Parses the complete lines in a block of NMEA text.
+
+    Parameters
+    ----------
+    chunk : bytes
+        NMEA sentences, one per line. Anything after the last newline is ignored.
+
+    Returns
+    -------
+    arrays : dict
+        Structured arrays keyed by "GGA", "RMC" and "VTG", with the dtypes in NMEA_DTYPES.
+    counts : dict
+        Number of "lines", "sentences" and "bad_checksum" lines in the chunk.
+    """
+    buf = np.frombuffer(chunk, dtype=np.uint8)
+    ends = np.flatnonzero(buf == 10)
+    starts = np.empty_like(ends)
+    starts[:1] = 0
+    starts[1:] = ends[:-1] + 1
+    counts = {"lines": len(ends), "sentences": 0, "bad_checksum": 0}
+    # Drop carriage returns and anything too short to be "$GPxxx,*hh".
+    ends = ends - (buf[np.maximum(ends - 1, 0)] == 13)
+    ok = (ends - starts >= 10) & (buf[starts] == ord("$"))
+    starts, ends = starts[ok], ends[ok]
+    stars = ends - 3
+    ok = buf[stars] == ord("*")
+    starts, stars = starts[ok], stars[ok]
+    counts["sentences"] = len(starts)
+
+    # XOR of the bytes between the $ and the * from a running XOR of the chunk.
+    cum = np.bitwise_xor.accumulate(buf)
+    actual = cum[stars - 1] ^ cum[starts]
+    table = _hex_table()
+    expected = table[buf[stars + 1]] * 16 + table[buf[stars + 2]]
+    good = actual == expected
+    counts["bad_checksum"] = int((~good).sum())
+    starts, stars = starts[good], stars[good]
+
+    kinds = (
+        buf[starts + 3].astype(np.int32) << 16
+        | buf[starts + 4].astype(np.int32) << 8
+        | buf[starts + 5]
+    )
+    out = buf.copy()
+    out[stars] = 10
+    arrays = {}
+    for kind in NMEA_DTYPES:
+        code = kind.encode("ascii")
+        sel = kinds == (code[0] << 16 | code[1] << 8 | code[2])
+        # Gather the bodies after "$GPxxx," up to and including the * turned newline.
+        first = starts[sel] + 7
+        lens = stars[sel] + 1 - first
+        offsets = np.cumsum(lens) - lens
+        idx = np.arange(lens.sum()) + np.repeat(first - offsets, lens)
+        body = out[idx].tobytes()
+        if body:
+            arrays[kind] = _to_structured(_fields(body, kind), kind)
+        else:
+            arrays[kind] = np.empty(0, dtype=NMEA_DTYPES[kind])
+    return arrays, counts
+
+
+def _parse_segment(args):
+    """Parses the lines that start between two byte offsets of a file."""
+    path, begin, end, chunk_size = args
+    parts = {kind: [] for kind in NMEA_DTYPES}
+    counts = {"lines": 0, "sentences": 0, "bad_checksum": 0}
+    with open(path, "rb") as file:
+        if begin > 0:
+            # The line that straddles the start belongs to the previous segment.
+            file.seek(begin - 1)
+            file.readline()
+        pos = file.tell()
+        tail = b""
+        while pos < end:
+            block = file.read(min(chunk_size, end - pos))
+            if not block:
+                break
+            pos += len(block)
+            block = tail + block
+            cut = block.rfind(b"\n") + 1
+            if pos >= end:
+                # Finish the last line even if it runs past the end of the segment.
+                if not block.endswith(b"\n"):
+                    block += file.readline()
+                if not block.endswith(b"\n"):
+                    block += b"\n"
+                cut = len(block)
+            tail = block[cut:]
+            arrays, icounts = parse_nmea_buffer(block[:cut])
+            for kind, arr in arrays.items():
+                parts[kind].append(arr)
+            for ikey in counts:
+                counts[ikey] += icounts[ikey]
+    arrays = {
+        kind: np.concatenate(arrs) if arrs else np.empty(0, NMEA_DTYPES[kind])
+        for kind, arrs in parts.items()
+    }
+    return arrays, counts
+
+
+def parse_nmea_log(path, chunk_size=1 << 24, processes=1):
+    """Parses an NMEA log into NumPy structured arrays.
+
+    The file is streamed in large chunks, checksums are checked and the GGA,
+    RMC and VTG sentences are decoded. Sentences from any talker (GP, GN, GL...)
+    are accepted. GGA times are seconds of the UTC day since the sentence has
+    no date, RMC times are full UTC timestamps. RMC has a two digit year,
+    80 to 99 are taken as 1980 to 1999 and the rest as 2000 to 2079.
+
+    Parameters
+    ----------
+    path : str
+        Location of the log.
+    chunk_size : int
+        Bytes read at a time.
+    processes : int
+        Number of worker processes, each takes an equal byte range of the file.
+
+    Returns
+    -------
+    arrays : dict
+        Structured arrays keyed by "GGA", "RMC" and "VTG", with the dtypes in NMEA_DTYPES.
+    counts : dict
+        Number of "lines", "sentences" and "bad_checksum" lines in the log.
+    """
+    path = str(Path(path).expanduser())
+    size = os.path.getsize(path)
+    processes = max(1, min(processes, size // chunk_size + 1))
+    bounds = [size * i // processes for i in range(processes + 1)]
+    jobs = [(path, bounds[i], bounds[i + 1], chunk_size) for i in range(processes)]
+    if processes == 1:
+        results = [_parse_segment(jobs[0])]
+    else:
+        import multiprocessing
+
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.map(_parse_segment, jobs)
+    arrays = {
+        kind: np.concatenate([res[0][kind] for res in results]) for kind in NMEA_DTYPES
+    }
+    counts = {ikey: sum(res[1][ikey] for res in results) for ikey in results[0][1]}
+    return arrays, counts
+
 
 if __name__ == "__main__":
-    gps = get_gps()
+    reader = GPSReader().start()
     # Main loop runs forever printing the location, etc. every second.
-    last_print = time.monotonic()
     while True:
-        # Make sure to call gps.update() every loop iteration and at least twice
-        # as fast as data comes from the GPS unit (usually every second).
-        # This returns a bool that's true if it parsed new data (you can ignore it
-        # though if you don't care and instead look at the has_fix property).
-        gps.update()
-        # Every second print out current location details if there's a fix.
-        current = time.monotonic()
-        if current - last_print >= 1.0:
-            last_print = current
-            if not gps.has_fix:
-                # Try again if we don't have a fix yet.
-                print("Waiting for fix...")
-                continue
-            # We have a fix! (gps.has_fix is true)
-            # Print out details about the fix like location, date, etc.
-            print("=" * 40)  # Print a separator line.
-            print(
-                "Fix timestamp: {}/{}/{} {:02}:{:02}:{:02}".format(  # noqa: UP032
-                    gps.timestamp_utc.tm_mon,  # Grab parts of the time from the
-                    gps.timestamp_utc.tm_mday,  # struct_time object that holds
-                    gps.timestamp_utc.tm_year,  # the fix time.  Note you might
-                    gps.timestamp_utc.tm_hour,  # not get all data like year, day,
-                    gps.timestamp_utc.tm_min,  # month!
-                    gps.timestamp_utc.tm_sec,
-                )
-            )
-            print(f"Latitude: {gps.latitude:.6f} degrees")
-            print(f"Longitude: {gps.longitude:.6f} degrees")
-            print(
-                f"Precise Latitude: {gps.latitude_degrees} degs, {gps.latitude_minutes:2.4f} mins"
-            )
-            print(
-                f"Precise Longitude: {gps.longitude_degrees} degs, {gps.longitude_minutes:2.4f} mins"
-            )
-            print(f"Fix quality: {gps.fix_quality}")
-            # Some attributes beyond latitude, longitude and timestamp are optional
-            # and might not be present.  Check if they're None before trying to use!
-            if gps.satellites is not None:
-                print(f"# satellites: {gps.satellites}")
-            if gps.altitude_m is not None:
-                print(f"Altitude: {gps.altitude_m} meters")
-            if gps.speed_knots is not None:
-                print(f"Speed: {gps.speed_knots} knots")
-            if gps.speed_kmh is not None:
-                print(f"Speed: {gps.speed_kmh} km/h")
-            if gps.track_angle_deg is not None:
-                print(f"Track angle: {gps.track_angle_deg} degrees")
-            if gps.horizontal_dilution is not None:
-                print(f"Horizontal dilution: {gps.horizontal_dilution}")
-            if gps.height_geoid is not None:
-                print(f"Height geoid: {gps.height_geoid} meters")
+        time.sleep(1.0)
+        fix = reader.latest
+        if not fix.has_fix:
+            # Try again if we don't have a fix yet.
+            print("Waiting for fix...")
+            continue
+        # We have a fix! Print out details about the fix like location, date, etc.
+        print("=" * 40)  # Print a separator line.
+        print(f"Fix timestamp: {fix.time}")
+        print(f"Latitude: {fix.latitude:.6f} degrees")
+        print(f"Longitude: {fix.longitude:.6f} degrees")
+        print(f"Fix quality: {fix.fix_quality}")
+        # Some attributes beyond latitude, longitude and timestamp are optional
+        # and might not be present.  Check if they're None before trying to use!
+        if fix.satellites is not None:
+            print(f"# satellites: {fix.satellites}")
+        if fix.altitude_m is not None:
+            print(f"Altitude: {fix.altitude_m} meters")
+        if fix.hdop is not None:
+            print(f"Horizontal dilution: {fix.hdop}")
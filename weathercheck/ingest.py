@@ -0,0 +1,301 @@
+"""Consumes what the scrapers publish and hands it to a sink.
+
+The paho network thread only puts (topic, payload) pairs into a bounded queue
+and never waits, if the queue is full the message is dropped and counted.
+Worker threads, or worker processes fed in chunks, decode the payloads and
+write the readings to their own sink, grouped by topic.
+"""
+
+import json
+import multiprocessing
+import os
+import queue
+import threading
+
+from .mqtt_tools import decode_batch
+
+INGEST_TOPICS = ("+/BME280reading", "+/+/BME280reading", "+/compute_status")
+
+
+class StatsSink(object):
+    """Sink that only counts the readings, for testing and benchmarks."""
+
+    def __init__(self, index=0):
+        self.records = 0
+
+    def write(self, topic, records):
+        self.records += len(records)
+
+    def close(self):
+        pass
+
+
+class JSONLinesSink(object):
+    """Sink that appends the readings to a file, one JSON object per line.
+
+    Each reading gets "station" and "kind" keys taken from the first and last
+    parts of its topic, and a "device" key from the middle part if it has one.
+
+    Parameters
+    ----------
+    path : str
+        File to append to.
+    index : int
+        Worker number, added to the file name for workers after the first so
+        that processes never share a file.
+    """
+
+    def __init__(self, path, index=0):
+        path = os.path.expanduser(path)
+        if index:
+            root, ext = os.path.splitext(path)
+            path = f"{root}-{index}{ext}"
+        self.path = path
+        self._file = open(path, "a", buffering=2**20)
+
+    def write(self, topic, records):
+        parts = topic.split("/")
+        lines = []
+        for irec in records:
+            irec["station"] = parts[0]
+            irec["kind"] = parts[-1]
+            if len(parts) > 2:
+                irec["device"] = parts[1]
+            lines.append(json.dumps(irec))
+        self._file.write("\n".join(lines) + "\n")
+
+    def close(self):
+        self._file.close()
+
+
+def process_chunk(chunk, sink, decoder=decode_batch):
+    """Decodes a chunk of messages and writes the readings to the sink.
+
+    Parameters
+    ----------
+    chunk : list
+        List of (topic, payload) pairs.
+    sink : object
+        Has a write(topic, records) method.
+    decoder : callable
+        Called as decoder(payload, topic), returns a list of reading
+        dictionaries, e.g. a DecoderPipeline.
+
+    Returns
+    -------
+    nrecords : int
+        Number of readings written.
+    nerrors : int
+        Number of messages that could not be decoded.
+    """
+    by_topic = {}
+    nerrors = 0
+    for topic, payload in chunk:
+        try:
+            records = decoder(payload, topic)
+        except Exception:
+            nerrors += 1
+            continue
+        by_topic.setdefault(topic, []).extend(records)
+    nrecords = 0
+    for topic, records in by_topic.items():
+        sink.write(topic, records)
+        nrecords += len(records)
+    return nrecords, nerrors
+
+
+def _process_worker(chunks, sink_factory, index, counts, decoder):
+    # Runs in a worker process, counts is a shared array of
+    # [messages, records, errors].
+    sink = sink_factory(index)
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                break
+            nrecords, nerrors = process_chunk(chunk, sink, decoder)
+            with counts.get_lock():
+                counts[0] += len(chunk)
+                counts[1] += nrecords
+                counts[2] += nerrors
+    finally:
+        sink.close()
+
+
+class IngestService(object):
+    """Subscribes to the scraper topics and feeds a pool of workers.
+
+    Parameters
+    ----------
+    client : MQTTConnection or mqtt.client
+        Connection to subscribe with, an MQTTConnection keeps the
+        subscriptions across reconnects.
+    sink_factory : callable
+        Called as sink_factory(index) once per worker to make its sink, an
+        object with write(topic, records) and close() methods. For processes
+        it must be picklable, e.g. a class or functools.partial.
+    topics : list
+        Topic filters to subscribe to.
+    workers : int
+        Number of workers.
+    mode : str
+        "thread" or "process". Decoding holds the GIL, so processes are needed
+        to use more than one core.
+    queue_size : int
+        Most messages waiting for the workers, more are dropped.
+    chunk_size : int
+        Most messages a worker takes at once.
+    qos : int
+        QoS of the subscriptions.
+    decoder : callable
+        Called as decoder(payload, topic), if None the default DecoderPipeline
+        is used. It has to be picklable for processes.
+    """
+
+    def __init__(
+        self,
+        client,
+        sink_factory=StatsSink,
+        topics=INGEST_TOPICS,
+        workers=2,
+        mode="thread",
+        queue_size=100000,
+        chunk_size=500,
+        qos=0,
+        decoder=None,
+    ):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Unknown mode {mode!r}, use thread or process.")
+        self.client = client
+        self.sink_factory = sink_factory
+        self.topics = list(topics)
+        self.workers = max(1, workers)
+        self.mode = mode
+        self.chunk_size = chunk_size
+        self.qos = qos
+        self.decoder = decode_batch if decoder is None else decoder
+        self.received = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._threads = []
+        self._procs = []
+        self._chunks = None
+        self._counts = None
+        self._count_lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def on_message(self, client, userdata, msg):
+        """paho callback, queues the message without waiting."""
+        try:
+            self._queue.put_nowait((msg.topic, msg.payload))
+            self.received += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def _get_chunk(self):
+        try:
+            chunk = [self._queue.get(timeout=0.5)]
+        except queue.Empty:
+            return None
+        get = self._queue.get_nowait
+        try:
+            while len(chunk) < self.chunk_size:
+                chunk.append(get())
+        except queue.Empty:
+            pass
+        return chunk
+
+    def _thread_worker(self, index):
+        sink = self.sink_factory(index)
+        try:
+            while not self._stop.is_set() or not self._queue.empty():
+                chunk = self._get_chunk()
+                if chunk is None:
+                    continue
+                nrecords, nerrors = process_chunk(chunk, sink, self.decoder)
+                with self._count_lock:
+                    self._counts[0] += len(chunk)
+                    self._counts[1] += nrecords
+                    self._counts[2] += nerrors
+        finally:
+            sink.close()
+
+    def _dispatcher(self):
+        while not self._stop.is_set() or not self._queue.empty():
+            chunk = self._get_chunk()
+            if chunk is not None:
+                # Blocks when the processes fall behind, the paho queue then fills.
+                self._chunks.put(chunk)
+        for _ in self._procs:
+            self._chunks.put(None)
+
+    def start(self):
+        """Starts the workers and subscribes."""
+        self._stop.clear()
+        if self.mode == "thread":
+            self._counts = [0, 0, 0]
+            for i in range(self.workers):
+                thread = threading.Thread(
+                    target=self._thread_worker,
+                    args=(i,),
+                    name=f"IngestWorker{i}",
+                    daemon=True,
+                )
+                thread.start()
+                self._threads.append(thread)
+        else:
+            self._counts = multiprocessing.Array("q", 3)
+            self._chunks = multiprocessing.Queue(maxsize=4 * self.workers)
+            for i in range(self.workers):
+                proc = multiprocessing.Process(
+                    target=_process_worker,
+                    args=(
+                        self._chunks,
+                        self.sink_factory,
+                        i,
+                        self._counts,
+                        self.decoder,
+                    ),
+                    name=f"IngestWorker{i}",
+                    daemon=True,
+                )
+                proc.start()
+                self._procs.append(proc)
+            thread = threading.Thread(
+                target=self._dispatcher, name="IngestDispatcher", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+        # MQTTConnection keeps the paho client as .client.
+        paho = getattr(self.client, "client", self.client)
+        paho.on_message = self.on_message
+        for itopic in self.topics:
+            self.client.subscribe(itopic, self.qos)
+        return self
+
+    def stop(self, timeout=None):
+        """Stops taking messages, lets the workers finish the queue and closes the sinks."""
+        paho = getattr(self.client, "client", self.client)
+        paho.on_message = None
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        for proc in self._procs:
+            proc.join(timeout)
+        self._threads = []
+        self._procs = []
+
+    def stats(self):
+        """Dictionary of the message counts and the queue depth."""
+        if self._counts is None:
+            messages = records = errors = 0
+        else:
+            messages, records, errors = self._counts[:]
+        return {
+            "received": self.received,
+            "dropped": self.dropped,
+            "queued": self._queue.qsize(),
+            "messages": messages,
+            "records": records,
+            "errors": errors,
+        }
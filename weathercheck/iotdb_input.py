@@ -1,17 +1,276 @@
-import json
-import sys
+import atexit
+import itertools
+import math
+import numbers
+import re
+import threading
+import time
+import zlib
 from datetime import UTC, datetime
 
-from iotdb.dbapi import connect
-from iotdb.Session import Session
 from iotdb.utils.IoTDBConstants import Compressor, TSDataType, TSEncoding
-from paho.mqtt import client as mqtt_client
+
+from ._lazy import lazy_import
+from .bme280_basic import BME280_COLUMNS, BME280_QUALITY_COLUMNS
+from .mqtt_tools import subscribe as mqtt_subscribe
+
+iotdb_bitmap = lazy_import("iotdb.utils.BitMap")
+iotdb_dbapi = lazy_import("iotdb.dbapi")
+iotdb_errors = lazy_import("iotdb.utils.exception")
+iotdb_session_module = lazy_import("iotdb.Session")
+iotdb_tablet = lazy_import("iotdb.utils.NumpyTablet")
+mqtt_client = lazy_import("paho.mqtt.client")
+np = lazy_import("numpy")
 
 # def get_iotdb_datatype(data_obj):
 
 
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError, OverflowError):
+        # NaN and inf can not be stored as integers.
+        return None
+
+
+def _to_bool(value):
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return bool(value)
+
+
+def _to_text(value):
+    return value if isinstance(value, str) else str(value)
+
+
+# Turns a value from a reading into what a data type needs, None marks a
+# value that can not be written and is left out. NaN is kept for floats.
+CONVERTERS = {
+    TSDataType.BOOLEAN: _to_bool,
+    TSDataType.INT32: _to_int,
+    TSDataType.INT64: _to_int,
+    TSDataType.FLOAT: _to_float,
+    TSDataType.DOUBLE: _to_float,
+    TSDataType.TEXT: _to_text,
+    TSDataType.STRING: _to_text,
+}
+_TIMESTAMP = object()
+_UNSEEN = object()
+
+# Encoding of a measurement by its data type. Weather readings change slowly
+# so floats XOR well against the previous value, counts and integer readings
+# step by small amounts.
+DEFAULT_ENCODINGS = {
+    TSDataType.BOOLEAN: TSEncoding.RLE,
+    TSDataType.INT32: TSEncoding.TS_2DIFF,
+    TSDataType.INT64: TSEncoding.TS_2DIFF,
+    TSDataType.FLOAT: TSEncoding.GORILLA,
+    TSDataType.DOUBLE: TSEncoding.GORILLA,
+    TSDataType.TEXT: TSEncoding.PLAIN,
+    TSDataType.STRING: TSEncoding.PLAIN,
+}
+DEFAULT_COMPRESSOR = Compressor.LZ4
+
+_NUMBER_ENCODINGS = (
+    TSEncoding.PLAIN,
+    TSEncoding.RLE,
+    TSEncoding.TS_2DIFF,
+    TSEncoding.GORILLA,
+    TSEncoding.CHIMP,
+    TSEncoding.SPRINTZ,
+    TSEncoding.RLBE,
+)
+# Encodings the server accepts for each data type.
+SUPPORTED_ENCODINGS = {
+    TSDataType.BOOLEAN: (TSEncoding.PLAIN, TSEncoding.RLE),
+    TSDataType.INT32: _NUMBER_ENCODINGS + (TSEncoding.ZIGZAG,),
+    TSDataType.INT64: _NUMBER_ENCODINGS + (TSEncoding.ZIGZAG,),
+    TSDataType.FLOAT: _NUMBER_ENCODINGS,
+    TSDataType.DOUBLE: _NUMBER_ENCODINGS,
+    TSDataType.TEXT: (TSEncoding.PLAIN, TSEncoding.DICTIONARY),
+    TSDataType.STRING: (TSEncoding.PLAIN, TSEncoding.DICTIONARY),
+}
+
+
+def _per_measurement(option, measurements, enum_type):
+    """Spreads an encoding or compressor option over the measurements.
+
+    The option can be None, one value for all, a list with one value per
+    measurement or a dictionary keyed by measurement name. Values can be
+    enum members or their names, e.g. "GORILLA". None is left where there is
+    no value so the default is used.
+    """
+    if option is None or isinstance(option, (str, enum_type)):
+        option = [option] * len(measurements)
+    elif isinstance(option, dict):
+        unknown = set(option) - set(measurements)
+        if unknown:
+            raise ValueError(f"Not measurements: {sorted(unknown)}.")
+        option = [option.get(iname) for iname in measurements]
+    elif len(option) != len(measurements):
+        raise ValueError(f"Need one {enum_type.__name__} per measurement.")
+    return [enum_type[ival] if isinstance(ival, str) else ival for ival in option]
+
+
+def _exists_error(err):
+    """True if a schema call failed only because what it creates is there."""
+    return isinstance(
+        err, iotdb_errors.StatementExecutionException
+    ) and "already" in str(err)
+
+
+class MeasurementSchema(object):
+    """The measurements of a time series compiled for turning readings into rows.
+
+    Each measurement name maps to its column, data type and converter, and
+    the way every key seen in a reading is handled is kept, so mapping a
+    reading is one dictionary lookup per key. Keys holding "timestamp" give
+    the time of the row and keys that are not measurements are skipped.
+
+    The schema also holds how each measurement is stored, its encoding and
+    compressor, used when its time series is created. Names that are not
+    plain IoTDB node names, like "Temperature in C", are sent to the server
+    backquoted, nodes holds every name as it is sent, see path_node.
+
+    Parameters
+    ----------
+    measurements : list
+        Names of the measurements.
+    data_types : list
+        TSDataType of each measurement.
+    encodings : TSEncoding, list or dict
+        One encoding for all, one per measurement or a dictionary keyed by
+        measurement name, names like "GORILLA" are allowed. Measurements
+        without one get the one for their data type in DEFAULT_ENCODINGS.
+    compressors : Compressor, list or dict
+        Same for the compressors, DEFAULT_COMPRESSOR where there is none.
+    """
+
+    def __init__(self, measurements, data_types, encodings=None, compressors=None):
+        self.measurements = list(measurements)
+        self.nodes = [path_node(iname) for iname in self.measurements]
+        self.data_types = list(data_types)
+        if len(self.measurements) != len(self.data_types):
+            raise ValueError("Need one data type per measurement.")
+        self.encodings = [
+            DEFAULT_ENCODINGS.get(itype, TSEncoding.PLAIN) if ienc is None else ienc
+            for itype, ienc in zip(
+                self.data_types,
+                _per_measurement(encodings, self.measurements, TSEncoding),
+            )
+        ]
+        for iname, itype, ienc in zip(
+            self.measurements, self.data_types, self.encodings
+        ):
+            if ienc not in SUPPORTED_ENCODINGS.get(itype, (ienc,)):
+                raise ValueError(
+                    f"{iname!r} is {itype.name}, it can not be {ienc.name}."
+                )
+        self.compressors = [
+            DEFAULT_COMPRESSOR if icomp is None else icomp
+            for icomp in _per_measurement(compressors, self.measurements, Compressor)
+        ]
+        self.columns = {
+            iname: (i, itype, CONVERTERS.get(itype, lambda value: value))
+            for i, (iname, itype) in enumerate(zip(self.measurements, self.data_types))
+        }
+        self.numeric = [
+            isinstance(itype.np_dtype(), np.dtype) for itype in self.data_types
+        ]
+        self._keys = {}
+
+    def __len__(self):
+        return len(self.measurements)
+
+    def _lookup(self, key):
+        if "timestamp" in key:
+            entry = _TIMESTAMP
+        else:
+            entry = self.columns.get(key)
+        if len(self._keys) < 10000:
+            self._keys[key] = entry
+        return entry
+
+    def map(self, datadict):
+        """Puts the values of a reading into the columns of a row.
+
+        Parameters
+        ----------
+        datadict : dict
+            The reading.
+
+        Returns
+        -------
+        timestamp : float
+            Value of the timestamp key, None if there is none.
+        values : list
+            Value for each measurement, None where the reading has none or it
+            could not be converted.
+        """
+        values = [None] * len(self.measurements)
+        timestamp = None
+        keys = self._keys
+        for ikey, iobj in datadict.items():
+            entry = keys.get(ikey, _UNSEEN)
+            if entry is _UNSEEN:
+                entry = self._lookup(ikey)
+            if entry is None or iobj is None:
+                continue
+            if entry is _TIMESTAMP:
+                timestamp = iobj
+            else:
+                values[entry[0]] = entry[2](iobj)
+        return timestamp, values
+
+
 class iotdb_session(object):
-    """Ties the MQTT Topics to the"""
+    """Ties the MQTT Topics to the IoTDB time series.
+
+    By default every insert_data is its own insert_aligned_record call. With
+    batch_size above 1 the rows are kept in a buffer per device and a
+    background thread writes them as NumpyTablets, all due devices in one
+    call, once a device has batch_size rows or its oldest row is max_age
+    seconds old. insert_data then never waits on the server. close, which is
+    also called at exit, writes what is left. If the call fails each tablet
+    is sent on its own, so a device the server rejects does not hold back
+    the others. Rows that fail to be written are put back and their device
+    waits max_age before it is tried again, twice as long after every
+    further failure. After max_failures failures in a row the rows of the
+    device are dropped.
+
+    If the session was opened here and a call fails with a lost connection,
+    the session is opened again and the call made once more.
+
+    Parameters
+    ----------
+    ts_name : str
+        Name of the time series under store_group that is created and
+        written by default. If None nothing is created and insert_data needs
+        a device and a schema.
+    store_group : str
+        Storage group, if None it is not set.
+    batch_size : int
+        Rows per device in a tablet, 1 writes every row on its own.
+    max_age : float
+        Longest time in seconds a row waits in the buffer.
+    max_buffer : int
+        Most rows kept per device, the oldest are dropped beyond this.
+    max_failures : int
+        Failed writes in a row after which the rows of a device are dropped.
+    sesh : Session
+        An already opened session. If None one is opened.
+    encodings : TSEncoding, list or dict
+        Encoding of each measurement of ts_name, see MeasurementSchema.
+    compressors : Compressor, list or dict
+        Compressor of each measurement of ts_name.
+    """
 
     def __init__(
         self,
@@ -27,66 +286,687 @@ class iotdb_session(object):
         fetch_size=1024,
         zone_id="UTC",
         enable_redirection=False,
+        batch_size=1,
+        max_age=5.0,
+        max_buffer=100000,
+        max_failures=5,
+        sesh=None,
+        encodings=None,
+        compressors=None,
     ):
-        self.sesh = Session(ip, port_, username_, password_, fetch_size, zone_id)
-        self.sesh.open(False)
-        self.sesh.set_storage_group(store_group)
+        self._session_args = None
+        if sesh is None:
+            self._session_args = (ip, port_, username_, password_, fetch_size, zone_id)
+            sesh = iotdb_session_module.Session(*self._session_args)
+            sesh.open(False)
+        self.sesh = sesh
         self.ts_name = ts_name
         self.store_group = store_group
+        self.device = None
+        self.schema = None
+        if ts_name is not None:
+            self.device = store_group + "." + ts_name
+            self.schema = MeasurementSchema(
+                measurements_list_, data_type_list_, encodings, compressors
+            )
         self.measurements = measurements_list_
         self.datatypes = data_type_list_
-        encoding_lst_ = [TSEncoding.PLAIN for _ in range(len(data_type_list_))]
-        compressor_lst_ = [Compressor.SNAPPY for _ in range(len(data_type_list_))]
-        self.sesh.create_aligned_time_series(
-            store_group + "." + ts_name,
-            measurements_list_,
-            data_type_list_,
-            encoding_lst_,
-            compressor_lst_,
-        )
+        self.batch_size = max(1, batch_size)
+        self.max_age = max_age
+        self.max_buffer = max_buffer
+        self.max_failures = max(1, max_failures)
+        self.rows_written = 0
+        self.dropped = 0
+        self.failed_writes = 0
+        self.reconnects = 0
+        self._buffers = {}
+        self._oldest = {}
+        self._failures = {}
+        self._retry_at = {}
+        self._schemas = {}
+        self._lock = threading.Lock()
+        # The session is not thread safe.
+        self._send_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        if store_group is not None:
+            try:
+                self.call("set_storage_group", store_group)
+            except iotdb_errors.StatementExecutionException as e:
+                if not _exists_error(e):
+                    raise
+        if ts_name is not None:
+            self.call(
+                "create_aligned_time_series",
+                self.device,
+                self.schema.nodes,
+                self.schema.data_types,
+                self.schema.encodings,
+                self.schema.compressors,
+            )
+        if self.batch_size > 1:
+            self.start()
 
-    def insert_data(self, datadict):
-        meas_list = []
-        d_list = []
-        val_list = []
-        cur_ts = None
-        for ikey, iobj in datadict.items():
-            if "timestamp" in ikey:
-                cur_ts = iobj
-
-            elif ikey in self.measurements:
-                cur_ind = self.measurements.index(ikey)
-                meas_list.append(ikey)
-                d_list.append(self.datatypes[cur_ind])
-                val_list.append(iobj)
+    def reconnect(self):
+        """Closes the session and opens a new one.
+
+        Returns
+        -------
+        : bool
+            False if the session was handed in and can not be reopened here.
+        """
+        if self._session_args is None:
+            return False
+        try:
+            self.sesh.close()
+        except Exception:
+            pass
+        sesh = iotdb_session_module.Session(*self._session_args)
+        sesh.open(False)
+        self.sesh = sesh
+        self.reconnects += 1
+        print(f"Reconnected to IoTDB at {self._session_args[0]}.")
+        return True
+
+    def call(self, method, *args):
+        """Calls a method of the session, reconnecting once if the connection is lost.
+
+        Parameters
+        ----------
+        method : str
+            Name of the Session method.
+        args : list
+            Its arguments.
+        """
+        with self._send_lock:
+            try:
+                return getattr(self.sesh, method)(*args)
+            except iotdb_errors.IoTDBConnectionException as e:
+                print("Lost the IoTDB connection:", str(e))
+                if not self.reconnect():
+                    raise
+            return getattr(self.sesh, method)(*args)
+
+    def insert_data(self, datadict, device=None, schema=None):
+        """Writes a reading, or adds it to the buffer if batch_size is above 1.
+
+        Parameters
+        ----------
+        datadict : dict
+            The reading, keys other than the measurements and the timestamp
+            are left out.
+        device : str
+            Device path to write to, by default store_group.ts_name.
+        schema : MeasurementSchema
+            Measurements of the device, by default those of ts_name.
+        """
+        if device is None:
+            device = self.device
+        if schema is None:
+            schema = self._schemas.get(device, self.schema)
+        elif device not in self._schemas:
+            self._schemas[device] = schema
+        cur_ts, values = schema.map(datadict)
         if cur_ts is None:
             cur_ts = int(datetime.now(UTC).timestamp())
-        self.sesh.insert_aligned_record(
-            self.store_group + "." + self.ts_name,
-            int(cur_ts * 1e3),  # time stamps are for millisecondss
-            meas_list,
-            d_list,
-            val_list,
+        # time stamps are for millisecondss
+        cur_ms = int(cur_ts * 1e3)
+        if self.batch_size == 1:
+            meas_list = []
+            d_list = []
+            val_list = []
+            for imeas, itype, ival in zip(schema.nodes, schema.data_types, values):
+                if ival is not None:
+                    meas_list.append(imeas)
+                    d_list.append(itype)
+                    val_list.append(ival)
+            self.call(
+                "insert_aligned_record", device, cur_ms, meas_list, d_list, val_list
+            )
+            self.rows_written += 1
+            return
+        with self._lock:
+            rows = self._buffers.setdefault(device, [])
+            if not rows:
+                self._oldest[device] = time.monotonic()
+            rows.append((cur_ms, values))
+            if len(rows) > self.max_buffer:
+                del rows[0]
+                self.dropped += 1
+            full = len(rows) >= self.batch_size
+        if full:
+            self._wake.set()
+
+    def pending(self):
+        """Number of rows waiting in the buffers."""
+        with self._lock:
+            return sum(len(irows) for irows in self._buffers.values())
+
+    def make_tablet(self, device, rows, schema=None):
+        """Puts rows of one device into a NumpyTablet.
+
+        Parameters
+        ----------
+        device : str
+            Device path.
+        rows : list
+            List of (timestamp in ms, values) pairs, the values in the order
+            of the measurements with None where there is none, see
+            MeasurementSchema.map.
+        schema : MeasurementSchema
+            Measurements of the device, by default the one it was written with.
+
+        Returns
+        -------
+        : NumpyTablet
+            One column per measurement that has a value in any row, missing
+            values are marked in the column's bitmap.
+        """
+        # NumpyTablet sorts the values by time but not the bitmaps.
+        rows = sorted(rows, key=lambda irow: irow[0])
+        times = np.array([irow[0] for irow in rows], dtype=np.int64)
+        names = []
+        types = []
+        values = []
+        bitmaps = []
+        if schema is None:
+            schema = self._schemas.get(device, self.schema)
+        columns = zip(*[irow[1] for irow in rows])
+        for imeas, itype, numeric, column in zip(
+            schema.nodes, schema.data_types, schema.numeric, columns
+        ):
+            missing = [i for i, ival in enumerate(column) if ival is None]
+            if len(missing) == len(rows):
+                continue
+            bitmap = None
+            if missing:
+                column = list(column)
+                bitmap = iotdb_bitmap.BitMap(len(rows))
+                fill = 0 if numeric else ""
+                for i in missing:
+                    bitmap.mark(i)
+                    column[i] = fill
+            if numeric:
+                column = np.array(column, dtype=itype.np_dtype())
+            else:
+                column = np.array(column, dtype=object)
+            names.append(imeas)
+            types.append(itype)
+            values.append(column)
+            bitmaps.append(bitmap)
+        if not any(ibit is not None for ibit in bitmaps):
+            bitmaps = None
+        return iotdb_tablet.NumpyTablet(device, names, types, values, times, bitmaps)
+
+    def flush(self, due_only=False):
+        """Writes the buffered rows, at most batch_size rows per device in each call.
+
+        Parameters
+        ----------
+        due_only : bool
+            Only write the devices with batch_size rows or rows older than
+            max_age, and not those waiting after a failed write.
+
+        Returns
+        -------
+        nrows : int
+            Number of rows written.
+        """
+        nrows = 0
+        # Devices that failed are not tried again in the same flush.
+        failed = set()
+        while True:
+            nwritten = self._write_batch(due_only, failed)
+            if not nwritten:
+                return nrows
+            nrows += nwritten
+
+    def _write_batch(self, due_only, failed):
+        now = time.monotonic()
+        with self._lock:
+            batches = {}
+            for device, rows in self._buffers.items():
+                if not rows or device in failed:
+                    continue
+                if due_only and (
+                    now < self._retry_at.get(device, 0.0)
+                    or (
+                        len(rows) < self.batch_size
+                        and now - self._oldest[device] < self.max_age
+                    )
+                ):
+                    continue
+                batches[device] = rows[: self.batch_size]
+                del rows[: self.batch_size]
+        if not batches:
+            return 0
+        errors = {}
+        try:
+            tablets = [self.make_tablet(idev, irows) for idev, irows in batches.items()]
+            if len(tablets) == 1:
+                self.call("insert_aligned_tablet", tablets[0])
+            else:
+                self.call("insert_aligned_tablets", tablets)
+        except Exception as e:
+            if len(batches) == 1:
+                errors = dict.fromkeys(batches, e)
+            else:
+                # Find the devices that fail, the others are written.
+                for device, rows in batches.items():
+                    try:
+                        tablet = self.make_tablet(device, rows)
+                        self.call("insert_aligned_tablet", tablet)
+                    except Exception as e:
+                        errors[device] = e
+        nrows = 0
+        with self._lock:
+            for device, rows in batches.items():
+                if device in errors:
+                    self._put_back(device, rows, now, errors[device])
+                    failed.add(device)
+                else:
+                    self._failures.pop(device, None)
+                    self._retry_at.pop(device, None)
+                    nrows += len(rows)
+            self.rows_written += nrows
+        return nrows
+
+    def _put_back(self, device, rows, now, error):
+        # Called with the lock held.
+        self.failed_writes += 1
+        failures = self._failures.get(device, 0) + 1
+        rows = rows + self._buffers.get(device, [])
+        if failures >= self.max_failures:
+            print(
+                f"Writing {device} to IoTDB failed {failures} times, "
+                f"dropping {len(rows)} rows:",
+                str(error),
+            )
+            self.dropped += len(rows)
+            self._buffers[device] = []
+            self._failures.pop(device, None)
+            self._retry_at.pop(device, None)
+            return
+        print(f"Writing {device} to IoTDB failed:", str(error))
+        if len(rows) > self.max_buffer:
+            self.dropped += len(rows) - self.max_buffer
+            rows = rows[-self.max_buffer :]
+        self._buffers[device] = rows
+        self._failures[device] = failures
+        self._retry_at[device] = now + self.max_age * 2 ** (failures - 1)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.max_age / 4)
+            self._wake.clear()
+            self.flush(due_only=True)
+
+    def start(self):
+        """Starts the thread that writes the buffers."""
+        if self._thread is not None and self._thread.is_alive():
+            return self
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="IoTDBFlusher", daemon=True
         )
+        self._thread.start()
+        atexit.register(self.close)
+        return self
+
+    def close(self):
+        """Stops the thread, writes what is in the buffers and closes the session."""
+        if self._thread is not None:
+            atexit.unregister(self.close)
+            self._stop.set()
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        nleft = self.pending()
+        if nleft:
+            print(f"{nleft} rows could not be written to IoTDB.")
+        self.sesh.close()
+
+
+_PLAIN_NODE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+
+def path_node(name):
+    """Quotes a name with backquotes if it is not a plain IoTDB node name."""
+    if _PLAIN_NODE.fullmatch(name):
+        return name
+    return "`" + name.replace("`", "``") + "`"
+
+
+def device_path(store_group, topic):
+    """Device path of a topic, store_group.<station>[.<device>].<kind>."""
+    return ".".join([store_group] + [path_node(i) for i in topic.split("/")])
+
+
+def default_schemas():
+    """Schemas of the topic kinds the scrapers publish with fixed measurements.
+
+    Returns
+    -------
+    : dict
+        MeasurementSchema keyed by the last part of the topic.
+    """
+    columns = BME280_COLUMNS + BME280_QUALITY_COLUMNS
+    types = [TSDataType.DOUBLE] * len(columns)
+    types[columns.index("Samples")] = TSDataType.INT32
+    return {"BME280reading": MeasurementSchema(columns, types)}
+
+
+def infer_schema(datadict):
+    """Makes a schema from the keys and values of a reading.
+
+    Numbers become DOUBLE, True and False BOOLEAN and strings TEXT. Keys
+    holding "timestamp" and values of other types, e.g. None or lists, are
+    left out.
+
+    Parameters
+    ----------
+    datadict : dict
+        The reading.
+
+    Returns
+    -------
+    : MeasurementSchema
+        The schema, None if no key could be used.
+    """
+    measurements = []
+    types = []
+    for ikey, iobj in datadict.items():
+        if "timestamp" in ikey:
+            continue
+        if isinstance(iobj, (bool, np.bool_)):
+            itype = TSDataType.BOOLEAN
+        elif isinstance(iobj, numbers.Real):
+            itype = TSDataType.DOUBLE
+        elif isinstance(iobj, str):
+            itype = TSDataType.TEXT
+        else:
+            continue
+        measurements.append(ikey)
+        types.append(itype)
+    if not measurements:
+        return None
+    return MeasurementSchema(measurements, types)
+
+
+class IoTDBPool(object):
+    """Writes the readings of many stations through a pool of sessions.
+
+    Every topic gets its own aligned time series,
+    store_group.<station>[.<device>].<kind>, with the measurements of the
+    schema for its kind. The series is created the first time the topic is
+    seen and the devices already created are kept so that no schema call is
+    made twice. Each session is an iotdb_session, which buffers when
+    batch_size is above 1 and reconnects when its connection is lost. The
+    pool has write and close so it can be an ingest sink.
+
+    Parameters
+    ----------
+    ip : str
+        Address of the IoTDB server.
+    port_ : str
+        Port of the server.
+    username_ : str
+        User name.
+    password_ : str
+        Password.
+    store_group : str
+        Storage group the series are created under.
+    schemas : dict
+        MeasurementSchema keyed by the last part of the topic, readings of
+        kinds set to None are skipped. By default see default_schemas.
+    infer_schemas : bool
+        Make the schema of other kinds from their first reading, see
+        infer_schema, keys that reading does not have are not written. If
+        False their readings are skipped.
+    nsessions : int
+        Number of sessions.
+    routing : str
+        "hash" writes each device through the same session, keeping its rows
+        in one buffer, "round_robin" takes the sessions in turn.
+    batch_size : int
+        Rows per device in a tablet, see iotdb_session.
+    max_age : float
+        Longest time in seconds a row waits in a buffer.
+    max_buffer : int
+        Most rows kept per device.
+    max_failures : int
+        Failed writes in a row after which the rows of a device are dropped.
+    sessions : list
+        Already opened sessions, used instead of opening nsessions.
+    """
+
+    def __init__(
+        self,
+        ip,
+        port_="6667",
+        username_="root",
+        password_="root",
+        store_group="root.weathercheck",
+        schemas=None,
+        infer_schemas=True,
+        nsessions=2,
+        routing="hash",
+        fetch_size=1024,
+        zone_id="UTC",
+        batch_size=1,
+        max_age=5.0,
+        max_buffer=100000,
+        max_failures=5,
+        sessions=None,
+    ):
+        if routing not in ("hash", "round_robin"):
+            raise ValueError(f"Unknown routing {routing!r}, use hash or round_robin.")
+        self.store_group = store_group
+        self.schemas = default_schemas() if schemas is None else dict(schemas)
+        self.infer_schemas = infer_schemas
+        self.routing = routing
+        self.max_age = max_age
+        if sessions is None:
+            sessions = [None] * nsessions
+        self.writers = []
+        for i, isesh in enumerate(sessions):
+            self.writers.append(
+                iotdb_session(
+                    ip,
+                    port_,
+                    username_,
+                    password_,
+                    None,
+                    None,
+                    None,
+                    store_group if i == 0 else None,
+                    None,
+                    fetch_size,
+                    zone_id,
+                    batch_size=batch_size,
+                    max_age=max_age,
+                    max_buffer=max_buffer,
+                    max_failures=max_failures,
+                    sesh=isesh,
+                )
+            )
+        self.series_created = 0
+        self.failed_registrations = 0
+        self.skipped = 0
+        self._known = set()
+        self._retry_at = {}
+        self._topics = {}
+        self._register_lock = threading.Lock()
+        self._turn = itertools.count()
+
+    def writer_for(self, device):
+        """The iotdb_session a device is written through."""
+        if self.routing == "hash":
+            index = zlib.crc32(device.encode())
+        else:
+            index = next(self._turn)
+        return self.writers[index % len(self.writers)]
+
+    def device_for(self, topic, datadict=None):
+        """Device path and schema of a topic, the schema is None if the kind has none.
+
+        Parameters
+        ----------
+        topic : str
+            Topic the readings come in on.
+        datadict : dict
+            A reading, the schema of a kind not seen before is made from it.
+        """
+        entry = self._topics.get(topic)
+        if entry is None:
+            device = device_path(self.store_group, topic)
+            kind = topic.rsplit("/", 1)[-1]
+            if kind not in self.schemas:
+                if datadict is None:
+                    return device, None
+                self._add_kind(kind, datadict)
+            entry = (device, self.schemas[kind])
+            self._topics[topic] = entry
+        return entry
+
+    def _add_kind(self, kind, datadict):
+        with self._register_lock:
+            if kind in self.schemas:
+                return
+            schema = infer_schema(datadict) if self.infer_schemas else None
+            if schema is None:
+                print(f"No IoTDB schema for {kind} readings, they are skipped.")
+            else:
+                print(
+                    f"Made an IoTDB schema for {kind} readings with "
+                    f"{len(schema)} measurements."
+                )
+            self.schemas[kind] = schema
+
+    def register(self, device, schema):
+        """Creates the aligned time series of a device unless it was already.
+
+        A failed attempt is printed and tried again after max_age, the rows
+        are written anyway and left to the server's automatic schema.
 
+        Parameters
+        ----------
+        device : str
+            Device path.
+        schema : MeasurementSchema
+            Its measurements.
 
-def db_connect(dbname="root.db", username="root", password="root"):
+        Returns
+        -------
+        : bool
+            True if the device is known to exist.
+        """
+        if device in self._known:
+            return True
+        with self._register_lock:
+            if device in self._known:
+                return True
+            if time.monotonic() < self._retry_at.get(device, 0.0):
+                return False
+            try:
+                self.writer_for(device).call(
+                    "create_aligned_time_series",
+                    device,
+                    schema.nodes,
+                    schema.data_types,
+                    schema.encodings,
+                    schema.compressors,
+                )
+                self.series_created += 1
+            except Exception as e:
+                if not _exists_error(e):
+                    print(f"Creating {device} in IoTDB failed:", str(e))
+                    self.failed_registrations += 1
+                    self._retry_at[device] = time.monotonic() + self.max_age
+                    return False
+            self._known.add(device)
+            self._retry_at.pop(device, None)
+            return True
+
+    def insert_data(self, datadict, topic):
+        """Writes a reading to the device of its topic.
+
+        Parameters
+        ----------
+        datadict : dict
+            The reading.
+        topic : str
+            Topic it came in on, e.g. station/BME280reading.
+        """
+        self.write(topic, [datadict])
+
+    def write(self, topic, records):
+        """Writes the readings of a topic, as an ingest sink."""
+        if not records:
+            return
+        device, schema = self.device_for(topic, records[0])
+        if schema is None:
+            self.skipped += len(records)
+            return
+        self.register(device, schema)
+        for irec in records:
+            self.writer_for(device).insert_data(irec, device, schema)
+
+    def stats(self):
+        """Dictionary of the counts summed over the sessions."""
+        out = {
+            "devices": len(self._known),
+            "series_created": self.series_created,
+            "failed_registrations": self.failed_registrations,
+            "skipped": self.skipped,
+        }
+        for iname in ("rows_written", "dropped", "failed_writes", "reconnects"):
+            out[iname] = sum(getattr(iwr, iname) for iwr in self.writers)
+        out["pending"] = sum(iwr.pending() for iwr in self.writers)
+        return out
+
+    def close(self):
+        """Writes what is buffered and closes every session."""
+        for iwr in self.writers:
+            iwr.close()
+
+
+def db_connect(
+    dbname="root.db",
+    username="root",
+    password="root",
+    host="eclipse-control.haystack.mit.edu",
+    port="6667",
+    zone_id="UTC+8",
+    fetch_size=1024,
+):
+    """Opens a DB-API connection, for history see iotdb_query.HistoryQuery.
+
+    Returns
+    -------
+    conn : Connection
+        The connection.
+    cursor : Cursor
+        A cursor on it.
+    """
     print("connecting to db,user:", dbname, username)
 
     try:
-        conn = connect(
-            "eclipse-control.haystack.mit.edu",
-            "6667",
+        conn = iotdb_dbapi.connect(
+            host,
+            port,
             username,
             password,
-            fetch_size=1024,
-            zone_id="UTC+8",
+            fetch_size=fetch_size,
+            zone_id=zone_id,
             sqlalchemy_mode=False,
         )  # open a connection
     except Exception as eobj:
         print("Error - connect fails:", eobj)
         print("Is the IoTDB server running?\n")
-        sys.exit()
+        raise
     # end exception
 
     cursor = conn.cursor()  # Open a cursor to perform database operations
@@ -94,13 +974,25 @@ def db_connect(dbname="root.db", username="root", password="root"):
     return conn, cursor
 
 
-def subscribe(client: mqtt_client, topic: str):
-    def on_message(client, userdata, msg_in):
-        msg_decode = msg_in.payload.decode()
-        try:
-            msg_dejson = json.loads(msg_decode)
-        except:
-            msg_dejson = None
+def subscribe(client: mqtt_client, topic: str, session: iotdb_session):
+    """Subscribes to a topic and inserts every reading into IoTDB.
+
+    Unless the session buffers, with batch_size above 1, each insert is a
+    round trip to the server from the paho network thread. For volume use
+    ingest.IngestService.
+
+    Parameters
+    ----------
+    client : mqtt.client or MQTTConnection
+        The client to subscribe with.
+    topic : str
+        Topic filter, may hold + and # wildcards.
+    session : iotdb_session
+        Where the readings go.
+    """
+
+    def on_records(topic_in, records):
+        for irec in records:
+            session.insert_data(irec)
 
-        client.subscribe(topic)
-        client.on_message = on_message
+    mqtt_subscribe(client, topic, on_records)
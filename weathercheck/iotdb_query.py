@@ -0,0 +1,337 @@
+"""Pulls the history of a station out of IoTDB.
+
+A query names a station, its measurements, a time range and optionally an
+aggregation window. With a window the aggregation is done by the server with
+GROUP BY ([start, end), window), so only one row per window comes back.
+Results are read fetch_size rows at a time as DataFrames built from the
+server's column blocks, no Python tuple is made per row, and can be handed
+on as they come or joined into one DataFrame or one NumPy array per column.
+Finished queries are kept in a small LRU cache so that a dashboard asking
+the same thing again does not go back to the server.
+"""
+
+import collections
+import re
+import threading
+import time
+from datetime import UTC, datetime
+
+from ._lazy import lazy_import
+from .iotdb_input import device_path, path_node
+
+iotdb_errors = lazy_import("iotdb.utils.exception")
+iotdb_session_module = lazy_import("iotdb.Session")
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+AGGREGATIONS = (
+    "AVG",
+    "COUNT",
+    "EXTREME",
+    "FIRST_VALUE",
+    "LAST_VALUE",
+    "MAX_TIME",
+    "MAX_VALUE",
+    "MIN_TIME",
+    "MIN_VALUE",
+    "SUM",
+)
+_WINDOW = re.compile(r"(\d+(ns|us|ms|mo|s|m|h|d|w|y))+")
+
+
+def to_ms(when):
+    """Turns a time into milliseconds since the epoch.
+
+    Parameters
+    ----------
+    when : datetime, str, int or float
+        A datetime, naive ones are taken as UTC, an ISO 8601 string or
+        seconds since the epoch.
+
+    Returns
+    -------
+    : int
+        Milliseconds since the epoch.
+    """
+    if isinstance(when, str):
+        when = datetime.fromisoformat(when)
+    if isinstance(when, datetime):
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=UTC)
+        when = when.timestamp()
+    return int(round(when * 1e3))
+
+
+def window_literal(window):
+    """Window of a GROUP BY, seconds as a number or an IoTDB duration like "10m"."""
+    if isinstance(window, str):
+        if not _WINDOW.fullmatch(window):
+            raise ValueError(f"{window!r} is not a duration like 30s, 10m or 1h.")
+        return window
+    if window <= 0:
+        raise ValueError("The window has to be longer than 0.")
+    return f"{int(round(window * 1e3))}ms"
+
+
+class _LRUCache(object):
+    """Least recently used cache whose entries expire after ttl seconds."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class HistoryQuery(object):
+    """Reads the readings of stations back from IoTDB.
+
+    The session is not thread safe so one query runs at a time, a chunk
+    iterator holds the session until it is used up or closed.
+
+    Parameters
+    ----------
+    ip : str
+        Address of the IoTDB server.
+    port_ : str
+        Port of the server.
+    username_ : str
+        User name.
+    password_ : str
+        Password.
+    store_group : str
+        Storage group the stations are under, see iotdb_input.IoTDBPool.
+    fetch_size : int
+        Rows in each chunk read from the server.
+    zone_id : str
+        Time zone of the session.
+    cache_size : int
+        Most query results kept, 0 turns the cache off.
+    cache_ttl : float
+        Seconds a result is kept. Results of ranges that end in the past
+        do not change, but the newest readings can still be on their way.
+    sesh : Session
+        An already opened session. If None one is opened.
+    """
+
+    def __init__(
+        self,
+        ip,
+        port_="6667",
+        username_="root",
+        password_="root",
+        store_group="root.weathercheck",
+        fetch_size=10000,
+        zone_id="UTC",
+        cache_size=32,
+        cache_ttl=60.0,
+        sesh=None,
+    ):
+        self._session_args = None
+        if sesh is None:
+            self._session_args = (ip, port_, username_, password_, fetch_size, zone_id)
+            sesh = iotdb_session_module.Session(*self._session_args)
+            sesh.open(False)
+        self.sesh = sesh
+        self.store_group = store_group
+        self.fetch_size = fetch_size
+        self.cache = _LRUCache(cache_size, cache_ttl)
+        self._lock = threading.Lock()
+
+    def sql(
+        self,
+        station,
+        measurements,
+        start,
+        end,
+        window=None,
+        aggregation="AVG",
+        device=None,
+        kind="BME280reading",
+    ):
+        """Builds the query.
+
+        Parameters
+        ----------
+        station : str
+            Name of the station.
+        measurements : list
+            Names of the measurements.
+        start : datetime, str or float
+            Start of the range, included, see to_ms.
+        end : datetime, str or float
+            End of the range, left out.
+        window : float or str
+            Aggregation window in seconds or an IoTDB duration like "10m". If
+            None the raw readings are returned.
+        aggregation : str or list
+            Aggregation function, or several, applied to every measurement,
+            see AGGREGATIONS.
+        device : str
+            Name of the sensor for stations with several.
+        kind : str
+            Last part of the topic the readings came in on.
+
+        Returns
+        -------
+        sql : str
+            The query.
+        labels : list
+            Name of each column after the time, the measurement or e.g.
+            "AVG(Humidity)".
+        """
+        start_ms, end_ms = to_ms(start), to_ms(end)
+        if end_ms <= start_ms:
+            raise ValueError("The end of the range has to be after its start.")
+        parts = [station, kind] if device is None else [station, device, kind]
+        path = device_path(self.store_group, "/".join(parts))
+        if isinstance(measurements, str):
+            measurements = [measurements]
+        if window is None:
+            labels = list(measurements)
+            select = ", ".join(path_node(imeas) for imeas in measurements)
+            return (
+                f"SELECT {select} FROM {path} "
+                f"WHERE time >= {start_ms} AND time < {end_ms}"
+            ), labels
+        if isinstance(aggregation, str):
+            aggregation = [aggregation]
+        aggregation = [iagg.upper() for iagg in aggregation]
+        unknown = [iagg for iagg in aggregation if iagg not in AGGREGATIONS]
+        if unknown:
+            raise ValueError(f"Unknown aggregations {unknown}, see AGGREGATIONS.")
+        labels = [f"{iagg}({imeas})" for imeas in measurements for iagg in aggregation]
+        select = ", ".join(
+            f"{iagg}({path_node(imeas)})"
+            for imeas in measurements
+            for iagg in aggregation
+        )
+        return (
+            f"SELECT {select} FROM {path} "
+            f"GROUP BY ([{start_ms}, {end_ms}), {window_literal(window)})"
+        ), labels
+
+    def _execute(self, sql):
+        try:
+            return self.sesh.execute_query_statement(sql)
+        except iotdb_errors.IoTDBConnectionException as e:
+            if self._session_args is None:
+                raise
+            print("Lost the IoTDB connection:", str(e))
+            try:
+                self.sesh.close()
+            except Exception:
+                pass
+            self.sesh = iotdb_session_module.Session(*self._session_args)
+            self.sesh.open(False)
+        return self.sesh.execute_query_statement(sql)
+
+    @staticmethod
+    def _arrays(frame):
+        """One NumPy array per column, with NaN where a number is missing."""
+        arrays = {}
+        for iname in frame.columns:
+            column = frame[iname]
+            if pd.api.types.is_extension_array_dtype(column.dtype):
+                if pd.api.types.is_bool_dtype(column.dtype):
+                    arrays[iname] = column.to_numpy(dtype=object, na_value=None)
+                else:
+                    arrays[iname] = column.to_numpy(dtype=np.float64, na_value=np.nan)
+            else:
+                arrays[iname] = column.to_numpy()
+        return arrays
+
+    def chunks(self, *args, as_arrays=False, **kwargs):
+        """Reads a query fetch_size rows at a time, arguments as sql.
+
+        Parameters
+        ----------
+        as_arrays : bool
+            Yield dictionaries of NumPy arrays instead of DataFrames.
+
+        Yields
+        ------
+        : DataFrame or dict
+            Up to fetch_size rows, a "Time" column in milliseconds since the
+            epoch followed by the labels of sql.
+        """
+        sql, labels = self.sql(*args, **kwargs)
+        with self._lock:
+            dataset = self._execute(sql)
+            try:
+                while dataset.has_next_df():
+                    frame = dataset.next_df()
+                    if frame is None:
+                        break
+                    frame.columns = ["Time"] + labels
+                    yield self._arrays(frame) if as_arrays else frame
+            finally:
+                dataset.close_operation_handle()
+
+    def query(self, *args, as_arrays=False, use_cache=True, **kwargs):
+        """Reads a whole query, arguments as sql.
+
+        Results come from the cache when the same query was made less than
+        cache_ttl seconds ago. They are shared with the cache and should not
+        be changed in place.
+
+        Parameters
+        ----------
+        as_arrays : bool
+            Return a dictionary of NumPy arrays instead of a DataFrame.
+        use_cache : bool
+            Look in and add to the cache.
+
+        Returns
+        -------
+        : DataFrame or dict
+            "Time" in milliseconds since the epoch and a column per label.
+        """
+        sql, labels = self.sql(*args, **kwargs)
+        key = (sql, as_arrays)
+        if use_cache:
+            result = self.cache.get(key)
+            if result is not None:
+                return result
+        frames = list(self.chunks(*args, **kwargs))
+        if frames:
+            frame = pd.concat(frames, ignore_index=True)
+        else:
+            frame = pd.DataFrame(
+                {iname: np.empty(0) for iname in ["Time"] + labels}
+            ).astype({"Time": np.int64})
+        result = self._arrays(frame) if as_arrays else frame
+        if use_cache:
+            self.cache.put(key, result)
+        return result
+
+    def close(self):
+        """Clears the cache and closes the session."""
+        self.cache.clear()
+        self.sesh.close()
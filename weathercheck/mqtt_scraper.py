@@ -1,23 +1,24 @@
-import json
 import platform
-from datetime import datetime
 
 from .bme280_basic import bme280_dict
-from .mqtt_tools import connect_mqtt, publish_dict
+from .mqtt_tools import connect_mqtt, publish_record
 from .systeminfo import get_system_dict
 
 
-def bme280_scrape(client, sys_name=None, topic_suf="BME280reading"):
+def bme280_scrape(client, sys_name=None, topic_suf="BME280reading", reader=None):
     """Gets current environment measurements from bme280 and publishes them to MQTT.
 
     Parameters
     ----------
-    client : mqtt.client
-        Object to connect to MQTT.
+    client : mqtt.client or BatchPublisher
+        Object to connect to MQTT, a BatchPublisher queues the reading for
+        its next batch.
     sys_name : str
         System name for the mqtt topic
     topic_suf : str
         The final part of the topic
+    reader : BME280Reader
+        Reader for the sensor, if None the shared default reader is used.
 
     Returns
     -------
@@ -28,26 +29,52 @@ def bme280_scrape(client, sys_name=None, topic_suf="BME280reading"):
     if sys_name is None:
         sys_name = platform.node()
     topic = sys_name + "/" + topic_suf
-    bme_data = bme280_dict()
-    for ikey, iobj in bme_data.items():
-        if isinstance(iobj, datetime):
-            bme_data["timestamp"] = iobj.timestamp()
-            del bme_data[ikey]
-    bmejson = json.dumps(bme_data)
-    return publish_dict(client, topic, bmejson)
+    return publish_record(client, topic, bme280_dict(reader))
 
 
-def sys_scrape(client, sys_name=None, topic_suf="compute_status"):
+def inventory_scrape(client, inventory, sys_name=None, topic_suf="BME280reading"):
+    """Reads every sensor in an inventory and publishes each to its own topic.
+
+    Parameters
+    ----------
+    client : mqtt.client or BatchPublisher
+        Object to connect to MQTT, a BatchPublisher queues the readings for
+        its next batch.
+    inventory : DeviceInventory
+        The sensors, read with one thread per bus.
+    sys_name : str
+        System name for the mqtt topic
+    topic_suf : str
+        The final part of the topic
+
+    Returns
+    -------
+    results : list
+        List of (SensorDevice, bool) pairs, was each transmission a success.
+    """
+    if sys_name is None:
+        sys_name = platform.node()
+    results = []
+    for idev, dfdict in inventory.read_all():
+        result = publish_record(client, idev.topic(sys_name, topic_suf), dfdict)
+        results.append((idev, result))
+    return results
+
+
+def sys_scrape(client, sys_name=None, topic_suf="compute_status", extra=None):
     """Gets current systems stats and publishes them to MQTT.
 
     Parameters
     ----------
-    client : mqtt.client
-        Object to connect to MQTT.
+    client : mqtt.client or BatchPublisher
+        Object to connect to MQTT, a BatchPublisher queues the reading for
+        its next batch.
     sys_name : str
         System name for the mqtt topic
     topic_suf : str
         The final part of the topic
+    extra : dict
+        More values to publish with the system stats, e.g. PublishPipeline.stats().
 
     Returns
     -------
@@ -59,9 +86,6 @@ def sys_scrape(client, sys_name=None, topic_suf="compute_status"):
     if sys_name is None:
         sys_name = sys_read_name
     topic = sys_name + "/" + topic_suf
-    for ikey, iobj in sys_data.items():
-        if isinstance(iobj, datetime):
-            sys_data["timestamp"] = iobj.timestamp()
-            del sys_data[ikey]
-    sysjson = json.dumps(sys_data)
-    return publish_dict(client, topic, sysjson)
+    if extra:
+        sys_data.update(extra)
+    return publish_record(client, topic, sys_data)
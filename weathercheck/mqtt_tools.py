@@ -2,13 +2,26 @@
 Derived from https://www.emqx.com/en/blog/how-to-use-mqtt-in-python
 """
 
+import ast
+import bisect
+import collections
 import json
 import logging
+import math
 import random
+import struct
+import threading
 import time
+import zlib
 from datetime import datetime
+from pathlib import Path
 
-from paho.mqtt import client as mqtt_client
+from ._lazy import available, lazy_import
+
+mqtt_client = lazy_import("paho.mqtt.client")
+np = lazy_import("numpy")
+orjson = lazy_import("orjson")
+zstandard = lazy_import("zstandard")
 
 
 def connect_mqtt(
@@ -21,6 +34,10 @@ def connect_mqtt(
     keepalive=2400,
 ):
     """Returns a client object to connect to MQTT.
+
+    The paho network loop is started in its own thread and reconnects by
+    itself, for a connection that queues while it is down use MQTTConnection.
+
     Parameters
     ----------
     broker : str
@@ -52,66 +69,341 @@ def connect_mqtt(
 
     # client.username_pw_set(username, password)
     client.on_connect = on_connect
-    client.connect(broker, port, keepalive)
     client.on_disconnect = on_disconnect
+    client.reconnect_delay_set(FIRST_RECONNECT_DELAY, MAX_RECONNECT_DELAY)
+    client.connect(broker, port, keepalive)
+    client.loop_start()
     return client
 
 
-def subscribe(client: mqtt_client, topic: str):
-    #
-    # ------------------------------
-    # mqtt returns the message here
-    # ------------------------------
-    #
+FIRST_RECONNECT_DELAY = 1
+MAX_RECONNECT_DELAY = 60
+# Result of a publish that was queued while disconnected, rc 0 is success.
+QueuedPublish = collections.namedtuple("QueuedPublish", ["rc", "mid"])
+
+
+class MQTTConnection(object):
+    """MQTT client that keeps itself connected from a background thread.
+
+    The paho network thread, started with loop_start, does all the reading
+    and writing on the socket, so publishes from several threads never write
+    at the same time. When the connection drops paho waits an exponential
+    backoff before connecting again, so neither the paho callbacks nor the
+    caller ever sleep. The first delay is jittered per connection so that a
+    fleet of stations that lost the broker together do not all come back at
+    once. While disconnected,
+    publishes go into a bounded queue that is sent when the connection comes
+    back. When the queue is full publish returns a failure, so a Spool behind
+    a BatchPublisher can take over for long outages. It has the publish
+    method of a paho client so it can be used wherever one is.
+
+    Parameters
+    ----------
+    broker : str
+        Broker IP or address.
+    port : int
+        Port number for the broker.
+    client_id : str
+        Id of the MQTT client.
+    ca_certs_in : str
+        CA certificate file, None for no TLS.
+    certfile_in : str
+        Client certificate file.
+    keyfile_in : str
+        Client key file.
+    keepalive : int
+        Keep alive interval in seconds.
+    min_delay : float
+        Backoff in seconds before the first reconnect attempt, jittered
+        between half and all of it, it doubles with every failed attempt.
+    max_delay : float
+        Largest backoff in seconds.
+    queue_size : int
+        Most messages queued while disconnected.
+    """
+
+    def __init__(
+        self,
+        broker,
+        port,
+        client_id=None,
+        ca_certs_in=None,
+        certfile_in=None,
+        keyfile_in=None,
+        keepalive=60,
+        min_delay=FIRST_RECONNECT_DELAY,
+        max_delay=MAX_RECONNECT_DELAY,
+        queue_size=1000,
+    ):
+        if client_id is None:
+            client_id = f"python-mqtt-{random.randint(0, 1000)}"
+        self.broker = broker
+        self.port = port
+        self.keepalive = keepalive
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.queue_size = queue_size
+        self.state = "disconnected"
+        self.reconnects = 0
+        self.failures = 0
+        self.dropped = 0
+        self._ever_connected = False
+        self._started = False
+        self._subscriptions = {}
+        self._queue = collections.deque()
+        # Reentrant as paho can call back into publish from inside publish.
+        self._lock = threading.RLock()
+        self._connected = threading.Event()
+        self._stop = threading.Event()
+        self.client = mqtt_client.Client(
+            client_id=client_id,
+            callback_api_version=mqtt_client.CallbackAPIVersion.VERSION2,
+        )
+        self.client.reconnect_delay_set(
+            min_delay / 2 + random.uniform(0, min_delay / 2), max_delay
+        )
+        if ca_certs_in is not None:
+            self.client.tls_set(
+                ca_certs=ca_certs_in, certfile=certfile_in, keyfile=keyfile_in
+            )
+        self.client.on_connect = self._on_connect
+        self.client.on_connect_fail = self._on_connect_fail
+        self.client.on_disconnect = self._on_disconnect
+
+    @property
+    def connected(self):
+        return self.state == "connected"
+
+    def wait_connected(self, timeout=None):
+        """Waits for the connection, returns True if it is up."""
+        return self._connected.wait(timeout)
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
+        if reason_code.is_failure:
+            self.failures += 1
+            print(f"Failed to connect to {self.broker}: {reason_code}")
+            return
+        with self._lock:
+            if self._ever_connected:
+                self.reconnects += 1
+            self._ever_connected = True
+            self.state = "connected"
+            self._connected.set()
+            for itopic, iqos in self._subscriptions.items():
+                self.client.subscribe(itopic, iqos)
+            # Send what was queued while the connection was down, in order.
+            while self._queue:
+                result = self.client.publish(*self._queue[0])
+                if result.rc != mqtt_client.MQTT_ERR_SUCCESS:
+                    break
+                self._queue.popleft()
+        print(f"Connected to MQTT Broker {self.broker}!")
+
+    def _on_disconnect(self, client, userdata, flags, reason_code, properties):
+        with self._lock:
+            self.state = "stopped" if self._stop.is_set() else "disconnected"
+            self._connected.clear()
+        logging.info("Disconnected from %s: %s", self.broker, reason_code)
+
+    def _on_connect_fail(self, client, userdata):
+        self.failures += 1
+        logging.error("Connecting to %s failed.", self.broker)
+
+    def start(self):
+        """Starts the network thread, does not wait for the connection."""
+        with self._lock:
+            if self._started:
+                return self
+            self._started = True
+            self._stop.clear()
+            self.state = "connecting"
+        self.client.connect_async(self.broker, self.port, self.keepalive)
+        self.client.loop_start()
+        return self
+
+    def stop(self, timeout=None):
+        """Disconnects and stops the network thread, queued messages are kept.
+
+        Parameters
+        ----------
+        timeout : float
+            Longest time in seconds to wait for the thread, None waits until
+            it has stopped.
+        """
+        self._stop.set()
+        self.client.disconnect()
+        if self._started:
+            # loop_stop has no timeout of its own.
+            stopper = threading.Thread(target=self.client.loop_stop, daemon=True)
+            stopper.start()
+            stopper.join(timeout)
+        with self._lock:
+            self._started = False
+            self._connected.clear()
+            self.state = "stopped"
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        """Publishes now if connected, otherwise queues the message.
+
+        Parameters
+        ----------
+        topic : str
+            The topic string.
+        payload : bytes or str
+            The message.
+        qos : int
+            Quality of service level.
+        retain : bool
+            Should the broker keep it as the last message for the topic.
+
+        Returns
+        -------
+        result : MQTTMessageInfo or QueuedPublish
+            The paho result when it was handed to the client, or a QueuedPublish
+            with rc MQTT_ERR_SUCCESS if it was queued and MQTT_ERR_QUEUE_SIZE if
+            the queue was full. Index 0 is the return code either way. A QoS
+            1/2 message paho got but could not send has rc MQTT_ERR_NO_CONN,
+            paho sends it after reconnecting.
+        """
+        with self._lock:
+            # Queue behind anything not yet sent so the order is kept.
+            direct = self.state == "connected" and not self._queue
+        if direct:
+            # Not under the lock, paho calls _on_connect holding its own
+            # locks, which publish can also take.
+            result = self.client.publish(topic, payload, qos, retain)
+            # paho keeps QoS 1/2 messages it could not send and sends them
+            # after it reconnects, queueing them here as well would double them.
+            if result.rc != mqtt_client.MQTT_ERR_NO_CONN or qos > 0:
+                return result
+        with self._lock:
+            if len(self._queue) >= self.queue_size:
+                self.dropped += 1
+                return QueuedPublish(mqtt_client.MQTT_ERR_QUEUE_SIZE, None)
+            self._queue.append((topic, payload, qos, retain))
+            return QueuedPublish(mqtt_client.MQTT_ERR_SUCCESS, None)
+
+    def queued(self):
+        """Number of messages waiting for the connection."""
+        return len(self._queue)
+
+    def subscribe(self, topic, qos=0):
+        """Subscribes now if connected and again after every reconnect.
+
+        Parameters
+        ----------
+        topic : str
+            Topic filter, may hold + and # wildcards.
+        qos : int
+            Quality of service level.
+        """
+        with self._lock:
+            self._subscriptions[topic] = qos
+            if self.state == "connected":
+                self.client.subscribe(topic, qos)
+
+
+def subscribe(client, topic, on_records=None, qos=0):
+    """Subscribes to a topic and hands the decoded readings to a callback.
+
+    The decoding runs in the paho network thread, so this is for light use,
+    for volume use ingest.IngestService.
+
+    Parameters
+    ----------
+    client : mqtt.client or MQTTConnection
+        The client to subscribe with.
+    topic : str
+        Topic filter, may hold + and # wildcards.
+    on_records : callable
+        Called as on_records(topic, records) with the list of reading
+        dictionaries, if None they are printed.
+    qos : int
+        Quality of service level.
+    """
+
     def on_message(client, userdata, msg_in):
-        msg_decode = msg_in.payload.decode()
         try:
-            msg_dejson = json.loads(msg_decode)
-        except:
-            msg_dejson = None
+            records = decode_batch(msg_in.payload)
+        except Exception as eobj:
+            print(f"Could not decode message from `{msg_in.topic}`:", eobj)
+            return
+        if on_records is None:
+            print(f"Received `{records}` from `{msg_in.topic}` topic")
+        else:
+            on_records(msg_in.topic, records)
+
+    # MQTTConnection keeps the paho client as .client.
+    paho = getattr(client, "client", client)
+    paho.on_message = on_message
+    client.subscribe(topic, qos)
 
-        if msg_dejson == None:
-            msg_dejson = msg_decode
-        # endif no dejson
-        print(f"Received `{msg_dejson}` from `{msg_in.topic}` topic")
 
-        err_f, inDict = mqtt2dict(msg_dejson)
+def get_certs(certfolder=""):
+    """Returns the TLS files kept in a folder.
 
-        if not err_f:
-            err_f = decode_uptime(inDict)
-            # endif
+    Parameters
+    ----------
+    certfolder : str
+        Folder holding ca.pem, client.pem and client.key, empty for no TLS.
 
-        client.subscribe(topic)
-        client.on_message = on_message
+    Returns
+    -------
+    ca_certs_in : str
+        CA certificate file, None if there is no folder.
+    certfile_in : str
+        Client certificate file.
+    keyfile_in : str
+        Client key file.
+    """
+    if not certfolder:
+        return None, None, None
+    cert_path = Path(certfolder).expanduser()
+    ca_certs_in = str(cert_path / "ca.pem")
+    certfile_in = str(cert_path / "client.pem")
+    keyfile_in = str(cert_path / "client.key")
+    return ca_certs_in, certfile_in, keyfile_in
+
+
+LEGACY_PREFIX = b"messages:"
 
 
 def mqtt2dict(msg):
-    """"""
+    """Reads a legacy "messages: {...}" message into a dictionary.
+
+    The text after the prefix is read with ast.literal_eval, which only takes
+    Python literals, so nothing in the message is ever run.
+
+    Parameters
+    ----------
+    msg : str or bytes
+        The message, bytes and memoryviews are read without decoding them first.
+
+    Returns
+    -------
+    err_f : bool
+        True if the message could not be read.
+    respDict : dict
+        The dictionary, None if there was an error.
+    """
     err_f = False  # init return variables
     respDict = None
 
-    keystr = "messages:"  # find known prefix
-    index = msg.find(keystr)
-    if index < 0:
-        emsg = "config: prefix '%s' not found in:'%s'" % (keystr, msg)
-        print(emsg)
-        err_f = True
-    else:
-        evalStr = msg[index + len(keystr) :]  # strip prefix
-        evalStr = evalStr.strip()  # strip whitespace
     try:
-        respDict = eval(evalStr)  # eval dict-as-string to dict
+        respDict = decode_legacy(msg)[0]
     except Exception as eobj:
         print("Exception:", eobj)
-        emsg = "config: dictionary expected: %s" % (evalStr)
+        emsg = "config: dictionary expected after '%s' in: %r" % (
+            LEGACY_PREFIX.decode(),
+            msg,
+        )
         print(emsg)
         err_f = True
-    # end else
 
     return err_f, respDict
 
 
-def publish_dict(client, topic, jsonmsg):
+def publish_dict(client, topic, jsonmsg, qos=None):
     """Publishes a dictionary and will check for datetime objects and change them to timestamps.
 
     Parameters
@@ -122,6 +414,9 @@ def publish_dict(client, topic, jsonmsg):
         The topic string.
     msgdict : dict
         A flat dictionary made of just simple objects.
+    qos : int
+        Quality of service level, None leaves it to the client, which is QoS 0
+        for a paho client and the per topic setting for a PublishPipeline.
 
     Returns
     -------
@@ -133,7 +428,10 @@ def publish_dict(client, topic, jsonmsg):
     #     if isinstance(iobj, datetime):
     #         msgdict[ikey] = iobj.timestamp()
     # jsonmsg = json.dumps(msgdict)
-    result = client.publish(topic, jsonmsg)
+    if qos is None:
+        result = client.publish(topic, jsonmsg)
+    else:
+        result = client.publish(topic, jsonmsg, qos)
     # result: [0, 1]
     status = result[0]
     if status == 0:
@@ -142,27 +440,1070 @@ def publish_dict(client, topic, jsonmsg):
         return False
 
 
-def on_disconnect(client, userdata, flags, reason_code, properties):
-    """The function for disconneting"""
-    # logging.info("Disconnected with result code: %s", rc)
-    FIRST_RECONNECT_DELAY = 1
-    RECONNECT_RATE = 2
-    MAX_RECONNECT_COUNT = 12
-    MAX_RECONNECT_DELAY = 60
-
-    reconnect_count, reconnect_delay = 0, FIRST_RECONNECT_DELAY
-    while reconnect_count < MAX_RECONNECT_COUNT:
-        # logging.info("Reconnecting in %d seconds...", reconnect_delay)
-        time.sleep(reconnect_delay)
+class LatencyHistogram(object):
+    """Histogram of latencies with fixed, roughly logarithmic buckets.
+
+    Adding a value is a bisect and an increment so it is cheap enough for a
+    paho callback. Quantiles are read off the bucket edges.
+
+    Parameters
+    ----------
+    bounds : list
+        Upper edges of the buckets in seconds, anything above the last edge
+        goes in an overflow bucket.
+    """
+
+    BOUNDS = (
+        0.001,
+        0.002,
+        0.005,
+        0.01,
+        0.02,
+        0.05,
+        0.1,
+        0.2,
+        0.5,
+        1.0,
+        2.0,
+        5.0,
+        10.0,
+        30.0,
+    )
+
+    def __init__(self, bounds=BOUNDS):
+        self.bounds = list(bounds)
+        self.reset()
+
+    def reset(self):
+        """Empties the histogram."""
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        """Adds a latency in seconds."""
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        """Adds the counts of another histogram with the same bounds."""
+        if list(other.bounds) != self.bounds:
+            raise ValueError("Histograms with different bounds can not be merged.")
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        return self
+
+    def quantile(self, q):
+        """Upper edge of the bucket holding the q quantile, NaN if empty.
+
+        The edge is capped at the largest value seen.
+        """
+        if not self.count:
+            return math.nan
+        target = q * self.count
+        cum = 0
+        for i, icount in enumerate(self.counts):
+            cum += icount
+            if cum >= target and icount:
+                return (
+                    min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+                )
+        return self.max
+
+    def summary(self, prefix="mqttack"):
+        """Flat dictionary of the count, mean, p50, p99 and max in ms."""
+        mean = self.total / self.count if self.count else math.nan
+        return {
+            f"{prefix}_count": self.count,
+            f"{prefix}_meanms": 1e3 * mean,
+            f"{prefix}_p50ms": 1e3 * self.quantile(0.5),
+            f"{prefix}_p99ms": 1e3 * self.quantile(0.99),
+            f"{prefix}_maxms": 1e3 * self.max,
+        }
+
+
+def parse_qos(qos):
+    """Reads QoS settings like "1" or "0,BME280reading:1,compute_status:0".
+
+    Parameters
+    ----------
+    qos : str
+        Comma separated, a bare level is the default and topic:level sets the
+        QoS of a topic, either the full topic or its last part.
+
+    Returns
+    -------
+    default_qos : int
+        QoS for topics not named.
+    topic_qos : dict
+        QoS per topic, as PublishPipeline takes it.
+    """
+    default_qos = 0
+    topic_qos = {}
+    for item in qos.split(","):
+        if ":" in item:
+            topic, level = item.rsplit(":", 1)
+            topic_qos[topic.strip()] = int(level)
+        elif item.strip():
+            default_qos = int(item)
+    return default_qos, topic_qos
+
+
+class PublishPipeline(object):
+    """Publishes with a QoS per topic and keeps track of the broker acks.
 
+    Messages with QoS 1 or 2 are in flight from the publish until paho calls
+    on_publish for their mid, the time between the two goes into a
+    LatencyHistogram. At most max_inflight are in flight at once, the rest
+    wait in a backlog that is sent as acks come in, so nothing ever waits on
+    wait_for_publish. When the backlog is full publish returns a failure so
+    a Spool can take the message. QoS 0 messages are passed straight on.
+    It has the publish method of a paho client so it can be used wherever
+    one is.
+
+    paho sends the messages in flight again after a reconnect, so their acks
+    normally still come. Those that wait longer than ack_timeout give their
+    place in the window up anyway and are counted as expired.
+
+    Parameters
+    ----------
+    client : mqtt.client or MQTTConnection
+        Where the messages are published.
+    qos : dict
+        QoS per topic, keyed by the full topic or its last part, e.g.
+        {"BME280reading": 1}.
+    default_qos : int
+        QoS for topics not in qos.
+    max_inflight : int
+        Most unacknowledged QoS 1/2 messages.
+    max_backlog : int
+        Most messages waiting for room in the window.
+    ack_timeout : float
+        Seconds to wait for an ack before giving up on it.
+    """
+
+    def __init__(
+        self,
+        client,
+        qos=None,
+        default_qos=0,
+        max_inflight=20,
+        max_backlog=1000,
+        ack_timeout=60.0,
+    ):
+        self.client = client
+        self.qos = dict(qos or {})
+        self.default_qos = default_qos
+        self.max_inflight = max_inflight
+        self.max_backlog = max_backlog
+        self.ack_timeout = ack_timeout
+        self.histogram = LatencyHistogram()
+        self.acked = 0
+        self.rejected = 0
+        self.expired = 0
+        self._inflight = {}
+        self._early = {}
+        self._sending = 0
+        self._backlog = collections.deque()
+        # paho can call on_publish from inside publish, in the same thread.
+        self._lock = threading.RLock()
+        # MQTTConnection keeps the paho client as .client.
+        paho = getattr(client, "client", client)
+        self._chained = paho.on_publish
+        paho.on_publish = self._on_publish
+
+    def topic_qos(self, topic):
+        """QoS to use for a topic."""
+        if topic in self.qos:
+            return self.qos[topic]
+        return self.qos.get(topic.rsplit("/", 1)[-1], self.default_qos)
+
+    @property
+    def inflight(self):
+        """Number of messages waiting for their ack."""
+        return len(self._inflight)
+
+    @property
+    def backlog(self):
+        """Number of messages waiting for room in the window."""
+        return len(self._backlog)
+
+    def publish(self, topic, payload=None, qos=None, retain=False):
+        """Publishes, or holds the message back if the window is full.
+
+        Parameters
+        ----------
+        topic : str
+            The topic string.
+        payload : bytes or str
+            The message.
+        qos : int
+            Quality of service level, None uses the setting for the topic.
+        retain : bool
+            Should the broker keep it as the last message for the topic.
+
+        Returns
+        -------
+        result : MQTTMessageInfo or QueuedPublish
+            Index 0 is the return code, MQTT_ERR_SUCCESS if it was sent or put
+            in the backlog.
+        """
+        if qos is None:
+            qos = self.topic_qos(topic)
+        if qos == 0:
+            return self.client.publish(topic, payload, 0, retain)
+        if self._expire():
+            self._refill()
+        with self._lock:
+            if self._room() and not self._backlog:
+                self._sending += 1
+            elif len(self._backlog) >= self.max_backlog:
+                self.rejected += 1
+                return QueuedPublish(mqtt_client.MQTT_ERR_QUEUE_SIZE, None)
+            else:
+                self._backlog.append((topic, payload, qos, retain))
+                return QueuedPublish(mqtt_client.MQTT_ERR_SUCCESS, None)
+        return self._send(topic, payload, qos, retain)
+
+    def _expire(self):
+        """Drops the messages that waited too long for their ack."""
+        with self._lock:
+            oldest = time.monotonic() - self.ack_timeout
+            stale = [imid for imid, isent in self._inflight.items() if isent < oldest]
+            for imid in stale:
+                del self._inflight[imid]
+            self.expired += len(stale)
+        if stale:
+            logging.warning("Gave up waiting for the acks of %d messages.", len(stale))
+        return len(stale)
+
+    def _room(self):
+        # Called with the lock held, messages being sent count as in flight.
+        return len(self._inflight) + self._sending < self.max_inflight
+
+    def _send(self, topic, payload, qos, retain):
+        # Called without the lock, paho holds its own locks when it calls
+        # on_publish, so holding ours across its publish can deadlock.
+        sent = time.monotonic()
         try:
-            client.reconnect()
-            # logging.info("Reconnected successfully!")
-            return
-        except Exception as err:
-            logging.error("%s. Reconnect failed. Retrying...", err)
+            result = self.client.publish(topic, payload, qos, retain)
+        except Exception:
+            with self._lock:
+                self._sending -= 1
+            raise
+        with self._lock:
+            self._sending -= 1
+            if result[0] == mqtt_client.MQTT_ERR_SUCCESS and result[1] is not None:
+                acked = self._early.pop(result[1], None)
+                if acked is None:
+                    self._inflight[result[1]] = sent
+                else:
+                    # The ack came in before publish returned.
+                    self._ack(sent, acked)
+            if not self._sending:
+                self._early.clear()
+        return result
+
+    def _ack(self, sent, acked=None):
+        if acked is None:
+            acked = time.monotonic()
+        self.histogram.add(acked - sent)
+        self.acked += 1
+
+    def _on_publish(self, client, userdata, mid, reason_code, properties):
+        with self._lock:
+            sent = self._inflight.pop(mid, None)
+            if sent is not None:
+                self._ack(sent)
+            elif self._sending:
+                # Maybe the ack of a message whose publish has not returned,
+                # otherwise a QoS 0 message or one sent from a connection queue.
+                self._early[mid] = time.monotonic()
+        self._expire()
+        self._refill()
+        if self._chained is not None:
+            self._chained(client, userdata, mid, reason_code, properties)
+
+    def _refill(self):
+        # Fill the window from the backlog, one message at a time so a
+        # failure leaves the rest in order.
+        while True:
+            with self._lock:
+                if not self._backlog or not self._room():
+                    break
+                item = self._backlog.popleft()
+                self._sending += 1
+            result = self._send(*item)
+            if result[0] != mqtt_client.MQTT_ERR_SUCCESS:
+                with self._lock:
+                    self._backlog.appendleft(item)
+                break
+
+    def stats(self):
+        """Flat dictionary of the ack latencies and the window, for telemetry."""
+        self._expire()
+        info = self.histogram.summary()
+        info["mqtt_expired"] = self.expired
+        info["mqtt_inflight"] = len(self._inflight)
+        info["mqtt_backlog"] = self.backlog
+        return info
+
+
+def record_timestamps(msgdict):
+    """Returns a copy of a reading with datetime objects changed to timestamps.
+
+    A datetime under any key is stored as a float under "timestamp".
+
+    Parameters
+    ----------
+    msgdict : dict
+        A flat dictionary made of just simple objects.
+
+    Returns
+    -------
+    record : dict
+        Copy of the dictionary that can be serialized as JSON.
+    """
+    record = {}
+    for ikey, iobj in msgdict.items():
+        if isinstance(iobj, datetime):
+            record["timestamp"] = iobj.timestamp()
+        else:
+            record[ikey] = iobj
+    return record
+
+
+def publish_record(client, topic, record):
+    """Publishes one reading, either right away or through a batching publisher.
+
+    Parameters
+    ----------
+    client : mqtt.client or BatchPublisher
+        Anything with a publish_record method is handed the reading, otherwise
+        it is sent as a JSON message on its own.
+    topic : str
+        The topic string.
+    record : dict
+        A flat dictionary made of just simple objects.
+
+    Returns
+    -------
+    : bool
+        Did the publishing (or queuing) succeed.
+    """
+    record = record_timestamps(record)
+    if hasattr(client, "publish_record"):
+        return client.publish_record(topic, record)
+    return publish_dict(client, topic, json.dumps(record))
+
+
+BATCH_VERSION = 1
+ZLIB_MAGIC = b"\x78"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def compress_payload(payload, compression="zlib", level=6):
+    """Compresses a message payload.
+
+    The compressed formats keep their own magic bytes at the start, zlib
+    streams start with 0x78 and zstd frames with 28 b5 2f fd, while a JSON
+    envelope starts with "{", so decode_batch can tell them apart.
+
+    Parameters
+    ----------
+    payload : bytes
+        The message to compress.
+    compression : str
+        "zlib" or "zstd", zstd needs the zstandard package.
+    level : int
+        Compression level.
 
-        reconnect_delay *= RECONNECT_RATE
-        reconnect_delay = min(reconnect_delay, MAX_RECONNECT_DELAY)
-        reconnect_count += 1
-    # logging.info("Reconnect failed after %s attempts. Exiting...", reconnect_count)
+    Returns
+    -------
+    : bytes
+        The compressed payload.
+    """
+    if compression == "zlib":
+        return zlib.compress(payload, level)
+    if compression == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress(payload)
+    raise ValueError(f"Unknown compression {compression!r}, use zlib or zstd.")
+
+
+def decompress_payload(payload):
+    """Undoes compress_payload, payloads that are not compressed come back as is.
+
+    Parameters
+    ----------
+    payload : bytes or memoryview
+        The message from the broker.
+
+    Returns
+    -------
+    : bytes or memoryview
+        The uncompressed payload, the one given if it is not compressed.
+    """
+    if payload[:4] == ZSTD_MAGIC:
+        return zstandard.ZstdDecompressor().decompress(payload)
+    if payload[:1] == ZLIB_MAGIC:
+        return zlib.decompress(payload)
+    return payload
+
+
+BINARY_MAGIC = b"WC"
+BINARY_VERSION = 1
+# magic, format version, flags, schema id, number of records
+BINARY_HEADER = struct.Struct("<2sBBHH")
+FLAG_EXTRAS = 1
+SCHEMAS = {}
+_TOPIC_SCHEMAS = {}
+
+
+class PayloadSchema(object):
+    """Fixed binary layout of the readings for one kind of topic.
+
+    Parameters
+    ----------
+    name : str
+        Last part of the topic the schema is for, e.g. "BME280reading".
+    version : int
+        Version of the schema for that topic, a new layout gets a new version.
+    schema_id : int
+        Id written in the message header, unique over all the schemas.
+    fields : list
+        List of (key, dtype) pairs, dtype is a little endian NumPy type string
+        such as "<f4". Float fields missing from a reading are stored as NaN.
+    """
+
+    def __init__(self, name, version, schema_id, fields):
+        self.name = name
+        self.version = version
+        self.schema_id = schema_id
+        self.keys = [ikey for ikey, _ in fields]
+        self.keyset = frozenset(self.keys)
+        self.fields = list(fields)
+        self._dtype = None
+
+    @property
+    def dtype(self):
+        # Made on first use so registering schemas does not load NumPy.
+        if self._dtype is None:
+            self._dtype = np.dtype(self.fields)
+        return self._dtype
+
+    @property
+    def itemsize(self):
+        return self.dtype.itemsize
+
+    def to_array(self, records):
+        """Packs reading dictionaries into a structured array of this layout."""
+        arr = np.zeros(len(records), dtype=self.dtype)
+        for ikey in self.keys:
+            fill = np.nan if arr.dtype[ikey].kind == "f" else 0
+            arr[ikey] = [irec.get(ikey, fill) for irec in records]
+        return arr
+
+
+def register_schema(name, version, schema_id, fields):
+    """Adds a schema to the registry used by BinaryCodec and decode_batch.
+
+    Parameters
+    ----------
+    name : str
+        Last part of the topic the schema is for.
+    version : int
+        Version of the schema for that topic.
+    schema_id : int
+        Id written in the message header, must not be in use already.
+    fields : list
+        List of (key, dtype) pairs.
+
+    Returns
+    -------
+    schema : PayloadSchema
+        The registered schema.
+    """
+    if schema_id in SCHEMAS:
+        raise ValueError(f"Schema id {schema_id} is already registered.")
+    schema = PayloadSchema(name, version, schema_id, fields)
+    SCHEMAS[schema_id] = schema
+    versions = _TOPIC_SCHEMAS.setdefault(name, [])
+    versions.append(schema)
+    versions.sort(key=lambda ischema: ischema.version)
+    return schema
+
+
+_BME280_FIELDS = [
+    ("timestamp", "<f8"),
+    ("Temperature in C", "<f4"),
+    ("Temperature in F", "<f4"),
+    ("Dewpoint in C", "<f4"),
+    ("Dewpoint in F", "<f4"),
+    ("Humidity", "<f4"),
+    ("Pressure", "<f4"),
+]
+_SYSTEM_FIELDS = [
+    ("timestamp", "<f8"),
+    ("disksizeGB", "<f4"),
+    ("useddiskGB", "<f4"),
+    ("freediskGB", "<f4"),
+    ("uptime", "<f8"),
+    ("cpuuse", "<f4"),
+    ("rampercent", "<f4"),
+    ("ramuseGB", "<f4"),
+]
+register_schema("BME280reading", 1, 1, _BME280_FIELDS)
+register_schema(
+    "BME280reading",
+    2,
+    2,
+    _BME280_FIELDS
+    + [
+        ("Temperature spread", "<f4"),
+        ("Humidity spread", "<f4"),
+        ("Pressure spread", "<f4"),
+        ("Samples", "<u2"),
+    ],
+)
+register_schema("compute_status", 1, 3, _SYSTEM_FIELDS)
+register_schema(
+    "compute_status",
+    2,
+    4,
+    _SYSTEM_FIELDS
+    + [
+        ("load1", "<f4"),
+        ("load5", "<f4"),
+        ("load15", "<f4"),
+        ("soctempC", "<f4"),
+        ("throttled", "<f4"),
+        ("netrxBps", "<f4"),
+        ("nettxBps", "<f4"),
+        ("netrxpps", "<f4"),
+        ("nettxpps", "<f4"),
+    ],
+)
+
+
+class JSONCodec(object):
+    """Serializes readings as JSON, the batch is a JSON envelope.
+
+    The envelope is {"v": 1, "n": <count>, "records": [...]}, a single
+    reading is sent bare as publish_dict always has. Records are serialized
+    when they are packed so a batch only has to join bytes.
+    """
+
+    name = "json"
+
+    def pack(self, topic, record):
+        """Returns the serialized record and its size in bytes."""
+        data = json.dumps(record).encode()
+        return data, len(data) + 1
+
+    def encode(self, topic, items):
+        """Makes the message for a list of packed records."""
+        if len(items) == 1:
+            return items[0]
+        head = b'{"v":%d,"n":%d,"records":[' % (BATCH_VERSION, len(items))
+        return head + b",".join(items) + b"]}"
+
+
+class BinaryCodec(object):
+    """Serializes readings with the registered schema of their topic.
+
+    The message is a BINARY_HEADER, the records as a packed NumPy structured
+    array and, if some readings have keys the schema does not know, a tail
+    holding those as (name, float64) pairs per record. The largest version of
+    the topic's schema whose keys are in every reading is used, so a decoded
+    reading has the keys that were sent and no others. Topics without such a
+    schema, or readings that are not all numbers, fall back to JSON.
+    """
+
+    name = "binary"
+
+    def __init__(self):
+        self._json = JSONCodec()
+
+    def pack(self, topic, record):
+        """Returns the record and a size estimate in bytes."""
+        versions = _TOPIC_SCHEMAS.get(topic.rsplit("/", 1)[-1])
+        size = versions[-1].itemsize if versions else 16 * len(record)
+        return record, size
+
+    def choose_schema(self, topic, items):
+        """Picks the schema for a batch, None if no schema of the topic fits."""
+        versions = _TOPIC_SCHEMAS.get(topic.rsplit("/", 1)[-1])
+        if not versions:
+            return None
+        # Only a schema whose keys every record has, so that decoding never
+        # adds fields that were not sent, the largest one to keep the tail short.
+        best = None
+        for ischema in versions:
+            if all(ischema.keyset <= irec.keys() for irec in items):
+                if best is None or len(ischema.keys) > len(best.keys):
+                    best = ischema
+        return best
+
+    def encode(self, topic, items):
+        """Makes the message for a list of packed records."""
+        schema = self.choose_schema(topic, items)
+        if schema is None:
+            return self._json.encode(
+                topic, [self._json.pack(topic, irec)[0] for irec in items]
+            )
+        try:
+            body = schema.to_array(items).tobytes()
+            tail = self._extras(schema, items)
+        except (TypeError, ValueError):
+            return self._json.encode(
+                topic, [self._json.pack(topic, irec)[0] for irec in items]
+            )
+        flags = FLAG_EXTRAS if tail else 0
+        head = BINARY_HEADER.pack(
+            BINARY_MAGIC, BINARY_VERSION, flags, schema.schema_id, len(items)
+        )
+        return head + body + tail
+
+    @staticmethod
+    def _extras(schema, items):
+        parts = []
+        any_extra = False
+        for irec in items:
+            extra = [
+                (ikey, ival) for ikey, ival in irec.items() if ikey not in schema.keyset
+            ]
+            any_extra = any_extra or bool(extra)
+            parts.append(struct.pack("<B", len(extra)))
+            for ikey, ival in extra:
+                name = ikey.encode()
+                parts.append(
+                    struct.pack("<B", len(name)) + name + struct.pack("<d", float(ival))
+                )
+        return b"".join(parts) if any_extra else b""
+
+
+CODECS = {"json": JSONCodec, "binary": BinaryCodec}
+
+
+def get_codec(codec):
+    """Returns a codec object from its name, codec objects are passed through."""
+    if isinstance(codec, str):
+        try:
+            return CODECS[codec]()
+        except KeyError:
+            raise ValueError(f"Unknown codec {codec!r}, use one of {sorted(CODECS)}.")
+    return codec
+
+
+def decode_rows(payload):
+    """Turns a binary message into a NumPy structured array.
+
+    Keys outside the schema, held in the tail of the message, are left out.
+
+    Parameters
+    ----------
+    payload : bytes
+        An uncompressed binary message from BinaryCodec.
+
+    Returns
+    -------
+    schema : PayloadSchema
+        The schema of the message.
+    rows : ndarray
+        Structured array with a field per schema key, a view on the payload.
+    """
+    magic, version, flags, schema_id, n = BINARY_HEADER.unpack_from(payload)
+    if magic != BINARY_MAGIC or version != BINARY_VERSION:
+        raise ValueError("Not a weathercheck binary message.")
+    try:
+        schema = SCHEMAS[schema_id]
+    except KeyError:
+        raise ValueError(f"Unknown schema id {schema_id}.")
+    rows = np.frombuffer(
+        payload, dtype=schema.dtype, count=n, offset=BINARY_HEADER.size
+    )
+    return schema, rows
+
+
+def _decode_binary(payload):
+    schema, rows = decode_rows(payload)
+    records = [dict(zip(schema.keys, irow)) for irow in rows.tolist()]
+    magic, version, flags, schema_id, n = BINARY_HEADER.unpack_from(payload)
+    if flags & FLAG_EXTRAS:
+        pos = BINARY_HEADER.size + rows.nbytes
+        for irec in records:
+            count = payload[pos]
+            pos += 1
+            for _ in range(count):
+                nlen = payload[pos]
+                name = str(payload[pos + 1 : pos + 1 + nlen], "utf-8")
+                (irec[name],) = struct.unpack_from("<d", payload, pos + 1 + nlen)
+                pos += 9 + nlen
+    return records
+
+
+def decode_json(payload):
+    """Decodes a JSON reading or envelope, with orjson if it is installed.
+
+    json.dumps writes NaN for readings that failed, which orjson does not
+    take, so those messages go through the json module.
+    """
+    msg = None
+    if available(orjson):
+        try:
+            msg = orjson.loads(payload)
+        except orjson.JSONDecodeError:
+            pass
+    if msg is None:
+        msg = json.loads(bytes(payload) if isinstance(payload, memoryview) else payload)
+    if isinstance(msg, dict) and "records" in msg and msg.get("v") == BATCH_VERSION:
+        return msg["records"]
+    if isinstance(msg, list):
+        return msg
+    return [msg]
+
+
+def decode_binary(payload):
+    """Decodes a message from BinaryCodec."""
+    return _decode_binary(payload)
+
+
+def decode_legacy(payload):
+    """Decodes the legacy "messages: {...}" format with ast.literal_eval."""
+    if isinstance(payload, str):
+        text = payload
+    else:
+        text = str(payload, "utf-8")
+    index = text.find(LEGACY_PREFIX.decode())
+    if index < 0:
+        raise ValueError(f"prefix {LEGACY_PREFIX.decode()!r} not found")
+    msg = ast.literal_eval(text[index + len(LEGACY_PREFIX) :].strip())
+    if not isinstance(msg, dict):
+        raise ValueError("dictionary expected")
+    return [msg]
+
+
+# MQTT v5 content types of the formats.
+CONTENT_TYPES = {
+    "application/json": "json",
+    "application/x-weathercheck-binary": "binary",
+    "text/x-weathercheck-legacy": "legacy",
+}
+
+
+class DecoderPipeline(object):
+    """Turns MQTT payloads into lists of reading dictionaries.
+
+    The format of a message is taken, in order, from the format set for its
+    topic, its MQTT v5 content type and finally its first bytes: zlib and
+    zstd are undone first, then "WC" is the binary codec, a payload holding
+    "messages:" is the legacy format and anything else is JSON. Payloads are
+    used as bytes or memoryviews without decoding them to str.
+
+    Parameters
+    ----------
+    topic_formats : dict
+        Format per topic, keyed by the full topic or its last part.
+    decoders : dict
+        Extra or replacement decoders, name -> function(payload) returning a
+        list of dictionaries.
+    """
+
+    def __init__(self, topic_formats=None, decoders=None):
+        self.topic_formats = dict(topic_formats or {})
+        self.decoders = {
+            "json": decode_json,
+            "binary": decode_binary,
+            "legacy": decode_legacy,
+        }
+        self.decoders.update(decoders or {})
+        self.content_types = dict(CONTENT_TYPES)
+
+    def register(self, name, decoder, content_type=None):
+        """Adds a decoder, optionally for an MQTT v5 content type."""
+        self.decoders[name] = decoder
+        if content_type is not None:
+            self.content_types[content_type] = name
+
+    def sniff(self, payload):
+        """Guesses the format from the first bytes of an uncompressed payload."""
+        if payload[:2] == BINARY_MAGIC:
+            return "binary"
+        head = payload[:1]
+        if head == b"{" or head == b"[":
+            return "json"
+        if LEGACY_PREFIX in (payload if isinstance(payload, bytes) else bytes(payload)):
+            return "legacy"
+        return "json"
+
+    def format_for(self, payload, topic=None, content_type=None):
+        """Name of the format of an uncompressed payload."""
+        if topic is not None and self.topic_formats:
+            name = self.topic_formats.get(topic)
+            if name is None:
+                name = self.topic_formats.get(topic.rsplit("/", 1)[-1])
+            if name is not None:
+                return name
+        if content_type:
+            name = self.content_types.get(content_type)
+            if name is not None:
+                return name
+        return self.sniff(payload)
+
+    def decode(self, payload, topic=None, content_type=None):
+        """Decodes a payload.
+
+        Parameters
+        ----------
+        payload : bytes or memoryview
+            The message.
+        topic : str
+            The topic it came on.
+        content_type : str
+            MQTT v5 content type, if the publisher set one.
+
+        Returns
+        -------
+        records : list
+            List of reading dictionaries.
+        """
+        payload = decompress_payload(payload)
+        name = self.format_for(payload, topic, content_type)
+        return self.decoders[name](payload)
+
+    __call__ = decode
+
+    def decode_message(self, msg):
+        """Decodes a paho MQTTMessage, using its content type if it has one."""
+        props = getattr(msg, "properties", None)
+        content_type = getattr(props, "ContentType", None) if props else None
+        return self.decode(msg.payload, msg.topic, content_type)
+
+
+DEFAULT_DECODER = DecoderPipeline()
+
+
+def decode_batch(payload, topic=None):
+    """Turns a message from BatchPublisher back into the list of readings.
+
+    Handles JSON envelopes, binary messages from BinaryCodec, the legacy
+    "messages:" format and any of them compressed, see DecoderPipeline. A
+    plain JSON reading, as sent by publish_dict, comes back as a list of one.
+    Binary float32 fields come back as the nearest double, e.g. 19.01 becomes
+    19.010000228881836.
+
+    Parameters
+    ----------
+    payload : bytes or memoryview
+        The message from the broker.
+    topic : str
+        The topic it came on.
+
+    Returns
+    -------
+    records : list
+        List of reading dictionaries.
+    """
+    return DEFAULT_DECODER.decode(payload, topic)
+
+
+class BatchPublisher(object):
+    """Collects readings per topic and publishes them in batches.
+
+    Each batch goes out as one message made by the codec, a JSON envelope
+    {"v": 1, "n": <count>, "records": [...]} or a schema packed binary
+    message, that is compressed when it holds more than one reading and is
+    larger than compress_threshold. A single reading goes out as the codec
+    makes it, for JSON the bare reading publish_dict sends. A
+    topic is flushed when it reaches max_records readings or max_bytes, and
+    poll flushes the ones whose oldest reading has waited max_latency seconds.
+
+    Parameters
+    ----------
+    client : mqtt.client
+        The client object used to publish.
+    max_records : int
+        Most readings in one batch.
+    max_bytes : int
+        Most bytes of encoded records in one batch, before compression.
+    max_latency : float
+        Longest time in seconds a reading waits before its batch is sent.
+    codec : str or codec
+        "json", "binary" or a codec object with pack and encode methods.
+    compression : str
+        "zlib", "zstd" or None for no compression.
+    compress_threshold : int
+        Batches smaller than this many bytes are sent uncompressed.
+    on_status : callable
+        Called as on_status(topic, success, n_records) after every batch, this
+        is how the delivery status gets back to the caller.
+    spool : Spool
+        If given, batches that fail to publish are kept in it and sent again by
+        poll. While it holds messages new batches queue behind them so the
+        broker gets everything in order.
+    """
+
+    def __init__(
+        self,
+        client,
+        max_records=50,
+        max_bytes=65536,
+        max_latency=60.0,
+        codec="json",
+        compression="zlib",
+        compress_threshold=512,
+        on_status=None,
+        spool=None,
+    ):
+        if compression == "zstd":
+            # Fail now rather than on the first big batch if it is missing.
+            zstandard.ZstdCompressor
+        elif compression not in ("zlib", None):
+            raise ValueError(f"Unknown compression {compression!r}, use zlib or zstd.")
+        self.client = client
+        self.codec = get_codec(codec)
+        self.max_records = max(1, max_records)
+        self.max_bytes = max_bytes
+        self.max_latency = max_latency
+        self.compression = compression
+        self.compress_threshold = compress_threshold
+        self.on_status = on_status
+        self.spool = spool
+        self._batches = {}
+        self._lock = threading.Lock()
+        self.sent_batches = 0
+        self.failed_batches = 0
+
+    def publish_record(self, topic, record):
+        """Adds a reading to the batch for its topic, flushing it if full.
+
+        Parameters
+        ----------
+        topic : str
+            The topic string.
+        record : dict
+            Reading made of simple objects, without datetimes.
+
+        Returns
+        -------
+        : bool
+            False if a batch that was flushed failed to publish, otherwise True.
+        """
+        item, size = self.codec.pack(topic, record)
+        with self._lock:
+            batch = self._batches.get(topic)
+            if batch is None:
+                batch = self._batches[topic] = [time.monotonic(), 0, []]
+            batch[1] += size
+            batch[2].append(item)
+            full = len(batch[2]) >= self.max_records or batch[1] >= self.max_bytes
+            if full:
+                del self._batches[topic]
+        if full:
+            return self._send(topic, batch[2])
+        return True
+
+    def poll(self):
+        """Flushes the batches that have waited longer than max_latency.
+
+        Messages in the spool are also sent, as far as its rate limit allows.
+
+        Returns
+        -------
+        : bool
+            False if any of the flushed batches failed.
+        """
+        now = time.monotonic()
+        with self._lock:
+            due = [
+                itopic
+                for itopic, ibatch in self._batches.items()
+                if now - ibatch[0] >= self.max_latency
+            ]
+            batches = [(itopic, self._batches.pop(itopic)[2]) for itopic in due]
+        if self.spool is not None:
+            self.spool.drain(self._publish)
+        return all([self._send(itopic, irecs) for itopic, irecs in batches])
+
+    def flush(self):
+        """Publishes everything that is waiting.
+
+        Returns
+        -------
+        : bool
+            False if any of the batches failed.
+        """
+        with self._lock:
+            batches = [(itopic, ibatch[2]) for itopic, ibatch in self._batches.items()]
+            self._batches = {}
+        return all([self._send(itopic, irecs) for itopic, irecs in batches])
+
+    def pending(self):
+        """Number of readings waiting to be sent."""
+        with self._lock:
+            return sum(len(ibatch[2]) for ibatch in self._batches.values())
+
+    def encode(self, topic, records):
+        """Makes the message for a list of packed records.
+
+        Parameters
+        ----------
+        topic : str
+            The topic string.
+        records : list
+            Records packed by the codec.
+
+        Returns
+        -------
+        payload : bytes
+            The message, compressed if it is a batch over the threshold.
+        """
+        payload = self.codec.encode(topic, records)
+        if (
+            self.compression
+            and len(records) > 1
+            and len(payload) >= self.compress_threshold
+        ):
+            payload = compress_payload(payload, self.compression)
+        return payload
+
+    def _publish(self, topic, payload, qos=None):
+        try:
+            return publish_dict(self.client, topic, payload, qos)
+        except Exception as e:
+            print("An unexpected error occurred:", str(e))
+            return False
+
+    def _send(self, topic, records):
+        payload = self.encode(topic, records)
+        if self.spool is not None and len(self.spool):
+            self.spool.drain(self._publish)
+        if self.spool is not None and len(self.spool):
+            # Still catching up, wait in line so the order is kept.
+            self.spool.put(topic, payload)
+            success = True
+        else:
+            success = self._publish(topic, payload)
+            if success:
+                self.sent_batches += 1
+            else:
+                self.failed_batches += 1
+                if self.spool is not None:
+                    self.spool.put(topic, payload)
+        if self.on_status is not None:
+            self.on_status(topic, success, len(records))
+        return success
+
+
+def on_disconnect(client, userdata, flags, reason_code, properties):
+    """The function for disconneting.
+
+    It only logs, the paho network loop started by connect_mqtt does the
+    reconnecting with a backoff so the callback never blocks.
+    """
+    logging.info("Disconnected with result code: %s", reason_code)
@@ -0,0 +1,165 @@
+"""asyncio runtime that runs periodic scrape jobs against fixed deadlines.
+
+Each job is a task that sleeps until its next deadline, start + k * period on
+the monotonic clock, so the periods do not drift and nothing wakes up in
+between. The blocking work (I2C, psutil, publishing) runs in a thread pool
+under a per job timeout. A job whose previous run is still stuck in a thread
+skips its turn rather than piling up threads, and the other jobs carry on.
+"""
+
+import asyncio
+import concurrent.futures
+import time
+
+
+class ScrapeJob(object):
+    """A function to call every period seconds.
+
+    Parameters
+    ----------
+    name : str
+        Name used in the stats and messages.
+    func : callable
+        Blocking function, run in the executor with kwargs.
+    period : float
+        Seconds between deadlines.
+    timeout : float
+        Longest time in seconds to wait for one run, None waits for ever.
+    offset : float
+        Seconds after the start of the runtime of the first deadline.
+    stop_when : callable
+        Checked after every run, the job ends when it returns True.
+    essential : bool
+        The runtime ends once every essential job has ended.
+    kwargs : dict
+        Keyword arguments for func.
+    """
+
+    def __init__(
+        self,
+        name,
+        func,
+        period,
+        timeout=None,
+        offset=0.0,
+        stop_when=None,
+        essential=True,
+        kwargs=None,
+    ):
+        self.name = name
+        self.func = func
+        self.period = period
+        self.timeout = timeout
+        self.offset = offset
+        self.stop_when = stop_when
+        self.essential = essential
+        self.kwargs = kwargs or {}
+        self.runs = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.skipped = 0
+        self.max_lag = 0.0
+        self.last_duration = None
+        self.last_result = None
+        self._running = None
+
+    def stats(self):
+        """Dictionary of the run counts and timings."""
+        return {
+            "runs": self.runs,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "skipped": self.skipped,
+            "max_lag": self.max_lag,
+            "last_duration": self.last_duration,
+        }
+
+    async def _run_once(self, executor):
+        loop = asyncio.get_running_loop()
+        t0 = time.monotonic()
+        self._running = executor.submit(self.func, **self.kwargs)
+        try:
+            # Shielded so a timeout leaves the thread be, it is checked next time.
+            self.last_result = await asyncio.wait_for(
+                asyncio.shield(asyncio.wrap_future(self._running, loop=loop)),
+                self.timeout,
+            )
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            print(f"{self.name} took longer than {self.timeout} s.")
+        except Exception as e:
+            self.errors += 1
+            print(f"{self.name} failed:", str(e))
+        self.runs += 1
+        self.last_duration = time.monotonic() - t0
+
+    async def run(self, executor, start):
+        """Runs the job until stop_when says so or the task is cancelled.
+
+        Parameters
+        ----------
+        executor : concurrent.futures.Executor
+            Where the blocking function runs.
+        start : float
+            Monotonic time the deadlines count from.
+        """
+        deadline = start + self.offset
+        while True:
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.max_lag = max(self.max_lag, time.monotonic() - deadline)
+            if self._running is not None and not self._running.done():
+                self.skipped += 1
+            else:
+                await self._run_once(executor)
+                if self.stop_when is not None and self.stop_when():
+                    return
+            deadline += self.period
+            now = time.monotonic()
+            if deadline < now:
+                # Fell behind, skip the missed deadlines but keep the phase.
+                missed = int((now - deadline) // self.period) + 1
+                self.skipped += missed
+                deadline += missed * self.period
+
+
+async def run_jobs(jobs, max_workers=None):
+    """Runs the jobs until every essential one has ended.
+
+    Parameters
+    ----------
+    jobs : list
+        List of ScrapeJob objects.
+    max_workers : int
+        Threads for the blocking work, by default two more than the jobs so a
+        hung job does not take a thread from the others.
+
+    Returns
+    -------
+    jobs : list
+        The jobs, for their stats.
+    """
+    if max_workers is None:
+        max_workers = len(jobs) + 2
+    executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=max_workers, thread_name_prefix="scrape"
+    )
+    start = time.monotonic()
+    tasks = {
+        asyncio.create_task(ijob.run(executor, start), name=ijob.name): ijob
+        for ijob in jobs
+    }
+    essential = [itask for itask, ijob in tasks.items() if ijob.essential]
+    try:
+        if essential:
+            await asyncio.gather(*essential)
+        else:
+            await asyncio.gather(*tasks)
+    finally:
+        for itask in tasks:
+            itask.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Do not wait for threads stuck on a device.
+        executor.shutdown(wait=False, cancel_futures=True)
+    return jobs
@@ -0,0 +1,366 @@
+"""Deterministic stand ins for the BME280, the GPS serial port and the system stats.
+
+These are registered as the "sim" backends in weathercheck.backends so that the
+scrapers, schedulers and ingest code can be run and load tested without any
+hardware. Every simulator is seeded from a seed and a station number so runs
+can be repeated and many virtual stations each get their own weather. All of
+them take a read latency in seconds and a fault rate, the probability that a
+read fails.
+"""
+
+import math
+import random
+import time
+from collections import deque
+from datetime import UTC, datetime, timedelta
+
+from .bme280_basic import BME280Reader
+from .gps_tools import nmea_checksum
+
+
+class _VirtualClock(object):
+    """Wall clock time, or a clock that moves a fixed step on every tick."""
+
+    def __init__(self, start=None, step=None):
+        self.step = step
+        if start is None:
+            start = datetime.now(UTC)
+        self.current = start
+
+    def tick(self):
+        if self.step is None:
+            return datetime.now(UTC)
+        now = self.current
+        self.current = now + timedelta(seconds=self.step)
+        return now
+
+
+class SimBME280Reader(BME280Reader):
+    """BME280 reader driven by a synthetic diurnal weather model.
+
+    The temperature follows a daily cycle peaking mid afternoon local solar
+    time, the dewpoint drifts slowly so the humidity moves opposite to the
+    temperature, and the pressure has a multi day synoptic swing plus the
+    semidiurnal atmospheric tide.
+
+    Parameters
+    ----------
+    bus_num : int
+        Number of the I2C bus, only used to seed the model.
+    address : int
+        Integer address for the I2C input, only used to seed the model.
+    station : int
+        Number of the virtual station.
+    seed : int
+        Seed for the random numbers.
+    latency : float
+        Time in seconds each sample takes.
+    fault_rate : float
+        Probability between 0 and 1 that a sample raises an OSError.
+    mean_temp : float
+        Daily mean temperature in C.
+    temp_amplitude : float
+        Half of the daily temperature swing in C.
+    mean_pres : float
+        Mean pressure in hPa.
+    lon : float
+        Longitude in degrees used to get the local solar time.
+    start : datetime
+        Start of the virtual clock, if None the wall clock is used.
+    step : float
+        Seconds between samples on the virtual clock, if None the wall clock is used.
+    kwargs : dict
+        Acquisition settings handed to BME280Reader, oversampling lowers the noise.
+    """
+
+    def __init__(
+        self,
+        bus_num=1,
+        address=0x77,
+        station=0,
+        seed=0,
+        latency=0.0,
+        fault_rate=0.0,
+        mean_temp=12.0,
+        temp_amplitude=6.0,
+        mean_pres=1013.25,
+        lon=-71.49,
+        start=None,
+        step=None,
+        **kwargs,
+    ):
+        super().__init__(bus_num, address, **kwargs)
+        self.station = station
+        self.latency = latency
+        self.fault_rate = fault_rate
+        self.temp_amplitude = temp_amplitude
+        self.lon = lon
+        self._rng = random.Random(hash((seed, station, bus_num, address)))
+        self.mean_temp = mean_temp + self._rng.uniform(-3.0, 3.0)
+        self.mean_pres = mean_pres + self._rng.uniform(-5.0, 5.0)
+        self._phase = self._rng.uniform(0, 2 * math.pi)
+        self._clock = _VirtualClock(start, step)
+
+    def sample(self):
+        """Takes a simulated measurement.
+
+        Returns
+        -------
+        temp_c : float
+            Temperature in C.
+        hum : float
+            Humidity in percentage.
+        pres : float
+            Presure in hPa.
+        ts : datetime
+            Timestamp of measurement.
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        ts = self._clock.tick()
+        if self._rng.random() < self.fault_rate:
+            raise OSError(121, "Remote I/O error (simulated)")
+        noise = 1.0 / math.sqrt(self.oversampling)
+        days = ts.timestamp() / 86400.0
+        solar_hour = (ts.hour + ts.minute / 60.0 + self.lon / 15.0) % 24
+        temp_c = (
+            self.mean_temp
+            + self.temp_amplitude * math.cos(2 * math.pi * (solar_hour - 15.0) / 24.0)
+            + self._rng.gauss(0, 0.1 * noise)
+        )
+        dew_c = self.mean_temp - 8.0 + 2.0 * math.sin(2 * math.pi * days / 3.0)
+        b = 17.62
+        c = 243.12
+        hum = 100.0 * math.exp(b * dew_c / (c + dew_c) - b * temp_c / (c + temp_c))
+        hum = min(100.0, max(0.0, hum + self._rng.gauss(0, 0.5 * noise)))
+        pres = (
+            self.mean_pres
+            + 8.0 * math.sin(2 * math.pi * days / 4.0 + self._phase)
+            + 0.6 * math.cos(4 * math.pi * solar_hour / 24.0)
+            + self._rng.gauss(0, 0.05 * noise)
+        )
+        return temp_c, hum, pres, ts
+
+
+def _nmea_angle(value, degdigits, hemispheres):
+    """Formats decimal degrees as NMEA ddmm.mmmm and a hemisphere letter."""
+    hemi = hemispheres[0] if value >= 0 else hemispheres[1]
+    value = abs(value)
+    deg = int(value)
+    minutes = (value - deg) * 60.0
+    return f"{deg:0{degdigits}d}{minutes:07.4f}", hemi
+
+
+def nmea_sentence(body):
+    """Wraps a sentence body with the $, checksum and line ending.
+
+    Parameters
+    ----------
+    body : str
+        The sentence without the leading $ or the checksum, e.g. "GPGGA,...".
+
+    Returns
+    -------
+    : bytes
+        The full sentence.
+    """
+    raw = body.encode("ascii")
+    return b"$" + raw + b"*" + f"{nmea_checksum(raw):02X}".encode("ascii") + b"\r\n"
+
+
+class SimGPSSerial(object):
+    """A serial port that plays out NMEA sentences for adafruit_gps.GPS.
+
+    Sentences either come from a recorded NMEA log, which is replayed one fix
+    (starting at each GGA sentence) at a time, or are made up from a receiver
+    wandering a few meters around a fixed position.
+
+    Parameters
+    ----------
+    configfile : str
+        Ignored, only here so the simulator takes the same arguments as the hardware backend.
+    nmea_file : str
+        Path to an NMEA log to replay. If None sentences are synthesized.
+    lat : float
+        Latitude in degrees of the synthesized position.
+    lon : float
+        Longitude in degrees of the synthesized position.
+    alt : float
+        Altitude in meters of the synthesized position.
+    rate : float
+        Fixes per second.
+    realtime : bool
+        If True fixes are paced by the wall clock at the rate, else they are always available.
+    loop : bool
+        Start the log over once it runs out.
+    station : int
+        Number of the virtual station.
+    seed : int
+        Seed for the random numbers.
+    latency : float
+        Time in seconds each readline takes.
+    fault_rate : float
+        Probability between 0 and 1 that a sentence is corrupted so its checksum fails.
+    """
+
+    def __init__(
+        self,
+        configfile=None,
+        nmea_file=None,
+        lat=42.6233,
+        lon=-71.4882,
+        alt=110.0,
+        rate=1.0,
+        realtime=True,
+        loop=True,
+        station=0,
+        seed=0,
+        latency=0.0,
+        fault_rate=0.0,
+    ):
+        self.nmea_file = nmea_file
+        self.rate = rate
+        self.realtime = realtime
+        self.loop = loop
+        self.latency = latency
+        self.fault_rate = fault_rate
+        self.commands = []
+        self._rng = random.Random(hash((seed, station)))
+        self.lat = lat + self._rng.uniform(-0.05, 0.05)
+        self.lon = lon + self._rng.uniform(-0.05, 0.05)
+        self.alt = alt
+        self._pending = deque()
+        self._next_fix = time.monotonic()
+        self._log = None
+        self._carry = None
+        self._exhausted = False
+
+    def _log_fix(self):
+        """Reads the next fix worth of lines from the log."""
+        lines = []
+        if self._carry is not None:
+            lines.append(self._carry)
+            self._carry = None
+        reopened = False
+        while not self._exhausted:
+            if self._log is None:
+                self._log = open(self.nmea_file, "rb")
+                reopened = True
+            line = self._log.readline()
+            if not line:
+                self._log.close()
+                self._log = None
+                self._exhausted = not self.loop
+                if lines or reopened:
+                    break
+                continue
+            if b"GGA," in line[:7] and lines:
+                self._carry = line
+                break
+            lines.append(line.rstrip(b"\r\n") + b"\r\n")
+        return lines
+
+    def _synth_fix(self):
+        """Makes up a GGA and RMC pair for the current time."""
+        now = datetime.now(UTC)
+        self.lat += self._rng.gauss(0, 1e-6)
+        self.lon += self._rng.gauss(0, 1e-6)
+        hms = now.strftime("%H%M%S") + f".{now.microsecond // 10000:02d}"
+        lat, ns = _nmea_angle(self.lat, 2, "NS")
+        lon, ew = _nmea_angle(self.lon, 3, "EW")
+        nsat = self._rng.randint(6, 12)
+        hdop = round(self._rng.uniform(0.7, 1.5), 1)
+        alt = self.alt + self._rng.gauss(0, 0.5)
+        gga = f"GPGGA,{hms},{lat},{ns},{lon},{ew},1,{nsat:02d},{hdop},{alt:.1f},M,-33.0,M,,"
+        rmc = f"GPRMC,{hms},A,{lat},{ns},{lon},{ew},0.01,0.0,{now:%d%m%y},,,A"
+        return [nmea_sentence(gga), nmea_sentence(rmc)]
+
+    def _fill(self):
+        if self._pending:
+            return
+        if self.realtime:
+            now = time.monotonic()
+            if now < self._next_fix:
+                return
+            self._next_fix = max(self._next_fix + 1.0 / self.rate, now)
+        lines = self._log_fix() if self.nmea_file else self._synth_fix()
+        for line in lines:
+            if self._rng.random() < self.fault_rate:
+                pos = self._rng.randrange(1, max(2, len(line) - 5))
+                line = line[:pos] + b"#" + line[pos + 1 :]
+            self._pending.append(line)
+
+    @property
+    def in_waiting(self):
+        """Number of bytes ready to be read."""
+        self._fill()
+        return len(self._pending[0]) if self._pending else 0
+
+    def readline(self):
+        """Returns the next sentence or an empty byte string if none are ready."""
+        if self.latency:
+            time.sleep(self.latency)
+        self._fill()
+        return self._pending.popleft() if self._pending else b""
+
+    def write(self, data):
+        """Keeps track of commands sent to the receiver, only the PMTK220 rate is acted on."""
+        data = bytes(data)
+        self.commands.append(data)
+        if data.startswith(b"PMTK220,"):
+            self.rate = 1000.0 / int(data[8:])
+        return len(data)
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+
+class SimSystemStats(object):
+    """Callable that stands in for psutil when reading the system stats.
+
+    The CPU use is a noisy process around a base load with the odd burst and
+    the RAM use wanders slowly. A fault returns NaN for the CPU and RAM values,
+    what a caller sees when the stats can not be read.
+
+    Parameters
+    ----------
+    station : int
+        Number of the virtual station.
+    seed : int
+        Seed for the random numbers.
+    latency : float
+        Time in seconds each call takes.
+    fault_rate : float
+        Probability between 0 and 1 that a call fails.
+    ram_totalGB : float
+        Size of the virtual RAM in GB.
+    """
+
+    def __init__(self, station=0, seed=0, latency=0.0, fault_rate=0.0, ram_totalGB=1.0):
+        self.latency = latency
+        self.fault_rate = fault_rate
+        self.ram_totalGB = ram_totalGB
+        self._rng = random.Random(f"{seed}-{station}-system")
+        self._boot = time.monotonic() - self._rng.uniform(0, 30 * 86400)
+        self._cpu = self._rng.uniform(5.0, 20.0)
+        self._ram = self._rng.uniform(20.0, 50.0)
+
+    def __call__(self, cpu_interval=None):
+        """Get the simulated system stats, same output as weathercheck.systeminfo.sys_stats.
+
+        The cpu_interval is ignored, the simulated CPU use is always available.
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        uptime = time.monotonic() - self._boot
+        timestamp = datetime.now(UTC).timestamp()
+        if self._rng.random() < self.fault_rate:
+            return uptime, math.nan, math.nan, math.nan, timestamp
+        burst = 60.0 if self._rng.random() < 0.02 else 0.0
+        self._cpu = 0.8 * self._cpu + 0.2 * self._rng.uniform(5.0, 20.0)
+        cpu_use = min(100.0, self._cpu + burst)
+        self._ram = min(95.0, max(5.0, self._ram + self._rng.gauss(0, 0.2)))
+        ram_usedGB = self._ram / 100.0 * self.ram_totalGB
+        return uptime, cpu_use, self._ram, ram_usedGB, timestamp
@@ -0,0 +1,234 @@
+"""Store and forward spool that keeps messages on disk while the broker is away.
+
+Messages go into an append only SQLite table in WAL mode. Inserts are grouped
+into transactions that are committed every commit_every messages or
+commit_interval seconds, and with synchronous=NORMAL the WAL is only fsynced
+at checkpoints, so an SD card sees a write every few seconds rather than one
+per reading. Anything not yet committed when the process dies is lost, and a
+message that was sent but whose removal was not committed is sent again.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+
+class Spool(object):
+    """Bounded on-disk FIFO of MQTT messages.
+
+    Parameters
+    ----------
+    path : str
+        File for the SQLite database, it is made if it does not exist and the
+        messages in it are kept across restarts.
+    max_bytes : int
+        Most payload bytes kept, the oldest messages are dropped beyond this.
+    rate : float
+        Most messages per second sent by drain.
+    commit_every : int
+        Number of changes grouped in one transaction.
+    commit_interval : float
+        Longest time in seconds a change waits to be committed.
+    """
+
+    def __init__(
+        self,
+        path,
+        max_bytes=64 * 2**20,
+        rate=20.0,
+        commit_every=100,
+        commit_interval=5.0,
+    ):
+        self.path = os.path.expanduser(str(path))
+        self.max_bytes = max_bytes
+        self.rate = rate
+        self.commit_every = commit_every
+        self.commit_interval = commit_interval
+        self.evicted = 0
+        self.sent = 0
+        self._lock = threading.RLock()
+        # Held for a whole drain so two callers never send the same messages.
+        self._drain_lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            self.path, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "topic TEXT NOT NULL, payload BLOB NOT NULL, qos INTEGER, "
+            "created REAL NOT NULL)"
+        )
+        count, nbytes = self._conn.execute(
+            "SELECT count(*), coalesce(sum(length(payload)), 0) FROM messages"
+        ).fetchone()
+        self._count = count
+        self._bytes = nbytes
+        self._uncommitted = 0
+        self._last_commit = time.monotonic()
+        self._tokens = rate
+        self._last_drain = time.monotonic()
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def nbytes(self):
+        """Payload bytes held in the spool."""
+        return self._bytes
+
+    def _begin(self):
+        if not self._conn.in_transaction:
+            self._conn.execute("BEGIN")
+
+    def _changed(self, n=1):
+        self._uncommitted += n
+        if (
+            self._uncommitted >= self.commit_every
+            or time.monotonic() - self._last_commit >= self.commit_interval
+        ):
+            self.commit()
+
+    def commit(self):
+        """Commits the changes that are waiting."""
+        with self._lock:
+            if self._conn.in_transaction:
+                self._conn.execute("COMMIT")
+            self._uncommitted = 0
+            self._last_commit = time.monotonic()
+
+    def put(self, topic, payload, qos=None):
+        """Adds a message to the end of the spool.
+
+        Parameters
+        ----------
+        topic : str
+            The topic string.
+        payload : bytes
+            The encoded message.
+        qos : int
+            QoS to publish it with, None for the publisher's default.
+        """
+        payload = payload.encode() if isinstance(payload, str) else bytes(payload)
+        with self._lock:
+            self._begin()
+            self._conn.execute(
+                "INSERT INTO messages (topic, payload, qos, created) VALUES (?, ?, ?, ?)",
+                (topic, payload, qos, time.time()),
+            )
+            self._count += 1
+            self._bytes += len(payload)
+            if self._bytes > self.max_bytes:
+                self._evict()
+            self._changed()
+
+    def _evict(self):
+        # Drop the oldest messages, a few at a time, until it fits again.
+        while self._bytes > self.max_bytes and self._count > 1:
+            rows = self._conn.execute(
+                "SELECT id, length(payload) FROM messages ORDER BY id LIMIT ?",
+                (max(1, self._count // 100),),
+            ).fetchall()
+            last_id = rows[-1][0]
+            self._conn.execute("DELETE FROM messages WHERE id <= ?", (last_id,))
+            self._count -= len(rows)
+            self._bytes -= sum(irow[1] for irow in rows)
+            self.evicted += len(rows)
+
+    def peek(self, n=1):
+        """Returns the oldest messages without removing them.
+
+        Parameters
+        ----------
+        n : int
+            Most messages to return.
+
+        Returns
+        -------
+        messages : list
+            List of (id, topic, payload, qos) tuples, oldest first.
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT id, topic, payload, qos FROM messages ORDER BY id LIMIT ?",
+                (n,),
+            ).fetchall()
+
+    def remove(self, msg_id):
+        """Removes a message, normally after it has been sent."""
+        with self._lock:
+            self._begin()
+            row = self._conn.execute(
+                "SELECT length(payload) FROM messages WHERE id = ?", (msg_id,)
+            ).fetchone()
+            if row is None:
+                return
+            self._conn.execute("DELETE FROM messages WHERE id = ?", (msg_id,))
+            self._count -= 1
+            self._bytes -= row[0]
+            self._changed()
+
+    def drain(self, publish, max_messages=None):
+        """Sends spooled messages in order, as fast as the rate limit allows.
+
+        This does not wait, it sends what the rate allows since the last call
+        and returns, so it is meant to be called every so often, e.g. from the
+        scheduler loop. It stops at the first message that fails. Only one
+        call drains at a time, a call made meanwhile returns 0 at once.
+
+        Parameters
+        ----------
+        publish : callable
+            Called as publish(topic, payload, qos), returns True if it worked.
+        max_messages : int
+            Most messages to send in this call, on top of the rate limit.
+
+        Returns
+        -------
+        nsent : int
+            Number of messages sent.
+        """
+        if not self._drain_lock.acquire(blocking=False):
+            return 0
+        try:
+            return self._drain(publish, max_messages)
+        finally:
+            self._drain_lock.release()
+
+    def _drain(self, publish, max_messages):
+        now = time.monotonic()
+        if self._uncommitted and now - self._last_commit >= self.commit_interval:
+            self.commit()
+        self._tokens = min(
+            max(self.rate, 1.0), self._tokens + (now - self._last_drain) * self.rate
+        )
+        self._last_drain = now
+        allowed = int(self._tokens)
+        if max_messages is not None:
+            allowed = min(allowed, max_messages)
+        nsent = 0
+        if allowed <= 0 or not self._count:
+            return nsent
+        for msg_id, topic, payload, qos in self.peek(allowed):
+            try:
+                success = publish(topic, payload, qos)
+            except Exception as e:
+                print("An unexpected error occurred:", str(e))
+                success = False
+            if not success:
+                break
+            self.remove(msg_id)
+            nsent += 1
+        self._tokens -= nsent
+        self.sent += nsent
+        if not self._count:
+            self.commit()
+        return nsent
+
+    def close(self):
+        """Commits what is waiting and closes the database."""
+        with self._lock:
+            self.commit()
+            self._conn.close()
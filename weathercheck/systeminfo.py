@@ -1,9 +1,15 @@
+import math
+import os
 import platform
 import shutil
+import threading
 import time
 from datetime import UTC, datetime
 
-import psutil
+from ._lazy import lazy_import
+from .backends import backend_instance
+
+psutil = lazy_import("psutil")
 
 
 def get_disk_use():
@@ -26,8 +32,14 @@ def get_disk_use():
     return totGB, usedGB, freeGB
 
 
-def sys_stats():
-    """Get the system stats
+def psutil_stats(cpu_interval=1):
+    """Get the system stats from psutil, this is the hardware system backend.
+
+    Parameters
+    ----------
+    cpu_interval : float
+        Seconds psutil blocks to measure the CPU use. If None the CPU use is
+        measured since the previous call and nothing blocks.
 
     Returns
     -------
@@ -42,8 +54,8 @@ def sys_stats():
     timestamp : float
         UTC Time stamp in s.
     """
-    uptime = time.monotonic()
-    cpu_use = psutil.cpu_percent(interval=1)
+    uptime = time.time() - psutil.boot_time()
+    cpu_use = psutil.cpu_percent(interval=cpu_interval)
     ram = psutil.virtual_memory()
     ram_per = ram.percent
     ram_usedGB = ram.used * 2**-30
@@ -52,22 +64,338 @@ def sys_stats():
     return uptime, cpu_use, ram_per, ram_usedGB, timestamp
 
 
-def get_system_dict():
-    """Get a dictionary holding all of the system info at the moment.
+def psutil_backend():
+    """Builds the hardware system backend, which is just psutil_stats.
+
+    Returns
+    -------
+    : callable
+        Function returning the system stats.
+    """
+    return psutil_stats
+
+
+def sys_stats(cpu_interval=1):
+    """Get the system stats from the selected system backend, see weathercheck.backends.
+
+    Parameters
+    ----------
+    cpu_interval : float
+        Seconds to measure the CPU use over, None measures since the previous call.
+
+    Returns
+    -------
+    uptime : float
+        Uptime in seconds.
+    cpu_use : float
+        Percentage of CPU being used.
+    ram_per : float
+        Percentage of RAM being used.
+    ram_usedGB : float
+        Same as ram percentage but in GB.
+    timestamp : float
+        UTC Time stamp in s.
+    """
+    return backend_instance("system")(cpu_interval=cpu_interval)
+
+
+TELEMETRY_FIELDS = ("percore", "loadavg", "soc", "network", "diskio", "processes")
+DAEMON_NAMES = ("run_scraper", "run_schedule", "run_weather", "run_ingest")
+SOC_TEMP_FILE = "/sys/class/thermal/thermal_zone0/temp"
+THROTTLED_FILE = "/sys/devices/platform/soc/soc:firmware/get_throttled"
+
+
+def _read_sysfs(path, base=10):
+    """Reads an integer from a sysfs file, None if it is not there."""
+    try:
+        with open(path, "r") as file:
+            return int(file.read().strip(), base)
+    except (OSError, ValueError):
+        return None
+
+
+class HostTelemetry(object):
+    """Collects extended host telemetry, counters are turned into rates between calls.
+
+    Each call to collect reads every enabled counter once and divides the change
+    since the previous call by the elapsed time. Rates are NaN on the first
+    call. Only the groups named in fields are read, so the cost on small
+    boards can be kept down.
+
+    The groups are
+        percore : busy percentage of each core, cpuuse_core<n>.
+        loadavg : 1, 5 and 15 minute load averages.
+        soc : SoC temperature in C and the Raspberry Pi throttled bit mask.
+        network : bytes and packets per second received and sent.
+        diskio : bytes and operations per second read and written per disk.
+        processes : resident memory in MB of the weathercheck daemons.
+
+    Parameters
+    ----------
+    fields : list
+        Names of the groups to collect.
+    process_names : list
+        Names matched against the command lines for the processes group.
+    rescan_every : int
+        Number of calls between searches for new daemon processes.
+    """
+
+    def __init__(
+        self, fields=TELEMETRY_FIELDS, process_names=DAEMON_NAMES, rescan_every=12
+    ):
+        unknown = set(fields) - set(TELEMETRY_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown telemetry fields {sorted(unknown)}.")
+        self.fields = set(fields)
+        self.process_names = tuple(process_names)
+        self.rescan_every = rescan_every
+        self._last = {}
+        self._last_time = None
+        self._procs = {}
+        self._ncalls = 0
+
+    def _rate(self, key, value, dt):
+        """Change of a counter per second since the previous call."""
+        last = self._last.get(key)
+        self._last[key] = value
+        if last is None or dt is None or dt <= 0 or value < last:
+            return math.nan
+        return (value - last) / dt
+
+    def _percore(self, info):
+        for icore, times in enumerate(psutil.cpu_times(percpu=True)):
+            # Guest time is already counted in user and guest_nice in nice.
+            total = (
+                sum(times)
+                - getattr(times, "guest", 0.0)
+                - getattr(times, "guest_nice", 0.0)
+            )
+            idle = times.idle + getattr(times, "iowait", 0.0)
+            last = self._last.get(("core", icore))
+            self._last[("core", icore)] = (total, idle)
+            busy = math.nan
+            if last is not None and total > last[0]:
+                busy = 100.0 * (1.0 - (idle - last[1]) / (total - last[0]))
+            info[f"cpuuse_core{icore}"] = busy
+
+    def _processes(self, info):
+        if self._ncalls % self.rescan_every == 0:
+            self._procs = {}
+            for proc in psutil.process_iter(["cmdline"]):
+                # The script is the first argument, or the second after the interpreter.
+                args = [
+                    os.path.basename(iarg) for iarg in (proc.info["cmdline"] or [])[:2]
+                ]
+                for name in self.process_names:
+                    if any(iarg.startswith(name) for iarg in args):
+                        self._procs.setdefault(name, []).append(proc)
+        for name in self.process_names:
+            rss = 0
+            for proc in self._procs.get(name, []):
+                try:
+                    rss += proc.memory_info().rss
+                except psutil.Error:
+                    pass
+            info[f"rss_{name}MB"] = rss * 2**-20
+
+    def collect(self):
+        """Reads all enabled groups.
+
+        Returns
+        -------
+        info : dict
+            Flat dictionary of the telemetry values.
+        """
+        now = time.monotonic()
+        dt = None if self._last_time is None else now - self._last_time
+        self._last_time = now
+        info = {}
+        if "percore" in self.fields:
+            self._percore(info)
+        if "loadavg" in self.fields:
+            info["load1"], info["load5"], info["load15"] = os.getloadavg()
+        if "soc" in self.fields:
+            millic = _read_sysfs(SOC_TEMP_FILE)
+            info["soctempC"] = math.nan if millic is None else millic / 1000.0
+            throttled = _read_sysfs(THROTTLED_FILE, 16)
+            info["throttled"] = math.nan if throttled is None else throttled
+        if "network" in self.fields:
+            net = psutil.net_io_counters()
+            info["netrxBps"] = self._rate("rxb", net.bytes_recv, dt)
+            info["nettxBps"] = self._rate("txb", net.bytes_sent, dt)
+            info["netrxpps"] = self._rate("rxp", net.packets_recv, dt)
+            info["nettxpps"] = self._rate("txp", net.packets_sent, dt)
+        if "diskio" in self.fields:
+            for disk, io in (psutil.disk_io_counters(perdisk=True) or {}).items():
+                if disk.startswith(("loop", "ram", "zram")):
+                    continue
+                info[f"{disk}_readBps"] = self._rate((disk, "rb"), io.read_bytes, dt)
+                info[f"{disk}_writeBps"] = self._rate((disk, "wb"), io.write_bytes, dt)
+                info[f"{disk}_readops"] = self._rate((disk, "ro"), io.read_count, dt)
+                info[f"{disk}_writeops"] = self._rate((disk, "wo"), io.write_count, dt)
+        if "processes" in self.fields:
+            self._processes(info)
+        self._ncalls += 1
+        return info
+
+
+def collect_system_info(cpu_interval=1, telemetry=None):
+    """Reads the disk use and system stats into a dictionary.
+
+    Parameters
+    ----------
+    cpu_interval : float
+        Seconds to measure the CPU use over, None measures since the previous call.
+    telemetry : HostTelemetry
+        If given its extended telemetry is added to the dictionary.
 
     Returns
     -------
-    sys_name : str
-        Name of the system from the platform module
     sys_info : dict
         Dictionary holding the system information.
     """
-    sys_name = platform.node()
     disk_info = get_disk_use()
     disk_names = ["disksizeGB", "useddiskGB", "freediskGB"]
     sys_info = {ikey: iobj for ikey, iobj in zip(disk_names, disk_info)}
-    stats_list = sys_stats()
+    stats_list = sys_stats(cpu_interval)
     stats_names = ["uptime", "cpuuse", "rampercent", "ramuseGB", "timestamp"]
     sys_dict = {ikey: iobj for ikey, iobj in zip(stats_names, stats_list)}
     sys_info.update(sys_dict)
+    if telemetry is not None:
+        sys_info.update(telemetry.collect())
+    return sys_info
+
+
+class SystemSampler(object):
+    """Samples the system info in a background thread and keeps the latest snapshot.
+
+    The CPU use is worked out by psutil from the CPU times between one sample
+    and the next, so nothing ever blocks waiting on it. The sampling period is
+    separate from how often the snapshot is read or published.
+
+    Parameters
+    ----------
+    period : float
+        Seconds between samples.
+    telemetry : HostTelemetry
+        Extended telemetry to add to each snapshot, if None only the basic info is kept.
+    """
+
+    def __init__(self, period=5.0, telemetry=None):
+        self.period = period
+        self.telemetry = telemetry
+        self.latest = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        """Takes a snapshot now and stores it as the latest."""
+        self.latest = collect_system_info(cpu_interval=None, telemetry=self.telemetry)
+        return self.latest
+
+    def _run(self):
+        # The counters were just primed, a sample now would cover no time.
+        deadline = time.monotonic() + self.period
+        self._stop.wait(self.period)
+        while not self._stop.is_set():
+            try:
+                self.sample()
+            except Exception as e:
+                print("An unexpected error occurred:", str(e))
+            deadline += self.period
+            delay = deadline - time.monotonic()
+            if delay < 0:
+                # Fell behind, skip the missed samples rather than bunching up.
+                deadline = time.monotonic()
+                delay = 0
+            self._stop.wait(delay)
+
+    def start(self):
+        """Primes the CPU counters and starts the thread, which samples a period later."""
+        if self._thread is not None and self._thread.is_alive():
+            return self
+        sys_stats(cpu_interval=None)
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="SystemSampler", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops the thread, the latest snapshot is kept."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def snapshot(self):
+        """Gets a copy of the latest snapshot, taking one first if there is none.
+
+        Returns
+        -------
+        sys_info : dict
+            Dictionary holding the system information.
+        """
+        latest = self.latest
+        if latest is None:
+            latest = self.sample()
+        return dict(latest)
+
+
+_SAMPLER = None
+
+
+def start_system_sampler(period=5.0, telemetry_fields=()):
+    """Starts the shared background sampler used by get_system_dict.
+
+    Parameters
+    ----------
+    period : float
+        Seconds between samples.
+    telemetry_fields : list
+        Groups of extended telemetry to collect, see HostTelemetry.
+
+    Returns
+    -------
+    : SystemSampler
+        The running sampler.
+    """
+    global _SAMPLER
+    if _SAMPLER is None:
+        _SAMPLER = SystemSampler(period)
+    _SAMPLER.period = period
+    _SAMPLER.telemetry = HostTelemetry(telemetry_fields) if telemetry_fields else None
+    return _SAMPLER.start()
+
+
+def get_system_dict(sampler=None):
+    """Get a dictionary holding all of the system info at the moment.
+
+    If a sampler is given, or the shared one was started with
+    start_system_sampler, its latest snapshot is returned without blocking.
+    Otherwise the info is read on the spot, which takes a second for the CPU use.
+
+    Parameters
+    ----------
+    sampler : SystemSampler
+        Sampler to take the snapshot from.
+
+    Returns
+    -------
+    sys_name : str
+        Name of the system from the platform module
+    sys_info : dict
+        Dictionary holding the system information.
+    """
+    sys_name = platform.node()
+    if sampler is None and _SAMPLER is not None and _SAMPLER.running:
+        sampler = _SAMPLER
+    if sampler is not None:
+        return sys_name, sampler.snapshot()
+    sys_info = collect_system_info()
     return sys_name, sys_info